@@ -0,0 +1,190 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+
+class AlignModelCache:
+    """
+    Bounded cache of WhisperX alignment models, one per language.
+
+    At most `max_models` models, and at most `max_bytes` bytes of weights if set, are kept on the device.
+    The least recently used models beyond that are moved to CPU memory, where up to `max_offloaded` of them
+    are kept so that using them again does not mean reading them from disk. Models in use are never moved.
+    Models are loaded outside of the cache lock, so a cold load only holds up the requests for the same language,
+    which share it.
+    """
+
+    def __init__(
+        self,
+        loader: Callable,
+        device: str,
+        max_models: int,
+        max_bytes: int = 0,
+        max_offloaded: int = 0,
+    ):
+        self.loader = loader
+        self.device = device
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        # Offloading only frees memory if the models do not already live in CPU memory
+        self.max_offloaded = max_offloaded if device != "cpu" else 0
+        self._models = OrderedDict()
+        self._offloaded = OrderedDict()
+        self._sizes = {}
+        self._in_use = {}
+        self._stats = {}
+        self._loading = {}
+        # Models being moved to CPU memory, outside of the lock
+        self._moving = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def use(self, language: str) -> Iterator[Tuple[object, dict]]:
+        """
+        Yields the alignment model and metadata of `language`, loading or promoting them if needed.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(language, {"hits": 0, "misses": 0, "reloads": 0, "load_seconds": 0.0})
+            self._in_use[language] = self._in_use.get(language, 0) + 1
+            entry = self._models.get(language)
+            loading = self._loading.get(language)
+            owner = False
+            if entry is not None:
+                self._models.move_to_end(language)
+                stats["hits"] += 1
+            elif loading is not None:
+                # Another request is loading the same model; it is shared once loaded
+                stats["hits"] += 1
+            else:
+                loading = self._loading[language] = Future()
+                offloaded = self._offloaded.pop(language, None)
+                moving = self._moving.pop(language, None)
+                owner = True
+        try:
+            if entry is None and owner:
+                try:
+                    if moving is not None:
+                        # The model is promoted again once it has reached CPU memory, or reloaded if the move failed
+                        offloaded = moving.result() if moving.exception() is None else None
+                    entry = self._load(language, offloaded, stats)
+                    loading.set_result(entry)
+                except BaseException as e:
+                    loading.set_exception(e)
+                    raise
+                finally:
+                    with self._lock:
+                        del self._loading[language]
+            elif entry is None:
+                entry = loading.result()
+        except BaseException:
+            with self._lock:
+                self._in_use[language] -= 1
+            raise
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                self._in_use[language] -= 1
+
+    def _load(self, language: str, offloaded: Union[Tuple[object, dict], None], stats: dict) -> Tuple[object, dict]:
+        start = time.perf_counter()
+        if offloaded is not None:
+            model, metadata = offloaded
+            model = model.to(self.device)
+            size = None
+        else:
+            model, metadata = self.loader(language_code=language, device=self.device)
+            size = sum(p.numel() * p.element_size() for p in model.parameters())
+        with self._lock:
+            self._models[language] = (model, metadata)
+            if size is None:
+                stats["reloads"] += 1
+            else:
+                self._sizes[language] = size
+                stats["misses"] += 1
+            stats["load_seconds"] += time.perf_counter() - start
+            evicted = self._evict()
+        self._move_to_cpu(evicted)
+        return model, metadata
+
+    def preload(self, languages: Iterable[str]):
+        """
+        Loads the alignment models of the given languages ahead of the first request.
+        """
+        for language in languages:
+            with self.use(language):
+                pass
+
+    def offload(self):
+        """
+        Moves every model that is not in use to CPU memory, or unloads it if offloading is disabled.
+        """
+        evicted = []
+        with self._lock:
+            for language in list(self._models):
+                if self._in_use.get(language, 0) == 0:
+                    evicted += self._offload(language)
+        self._move_to_cpu(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._offloaded.clear()
+            self._moving.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": list(self._models),
+                "offloaded": list(self._offloaded),
+                "bytes": sum(self._sizes[language] for language in self._models),
+                "languages": {language: dict(stats) for language, stats in self._stats.items()},
+            }
+
+    def _over_budget(self) -> bool:
+        if len(self._models) > self.max_models:
+            return True
+        return self.max_bytes > 0 and sum(self._sizes[language] for language in self._models) > self.max_bytes
+
+    def _evict(self) -> list:
+        evicted = []
+        for language in list(self._models):
+            if not self._over_budget():
+                break
+            if self._in_use.get(language, 0) > 0:
+                continue
+            evicted += self._offload(language)
+        return evicted
+
+    def _offload(self, language: str) -> list:
+        """
+        Removes the model of `language` from the device. Returns the models for `_move_to_cpu` to move to CPU
+        memory once the lock is released, so that other languages are not held up by the copy.
+        """
+        model, metadata = self._models.pop(language)
+        if self.max_offloaded <= 0:
+            return []
+        moved = self._moving[language] = Future()
+        return [(language, model, metadata, moved)]
+
+    def _move_to_cpu(self, evicted: list):
+        for language, model, metadata, moved in evicted:
+            try:
+                entry = (model.to("cpu"), metadata)
+            except BaseException as e:
+                with self._lock:
+                    if self._moving.get(language) is moved:
+                        del self._moving[language]
+                moved.set_exception(e)
+                raise
+            with self._lock:
+                # Unless a request for the language claimed the model while it was being moved
+                if self._moving.get(language) is moved:
+                    del self._moving[language]
+                    self._offloaded[language] = entry
+                    while len(self._offloaded) > self.max_offloaded:
+                        self._offloaded.popitem(last=False)
+            moved.set_result(entry)
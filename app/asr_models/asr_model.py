@@ -1,12 +1,30 @@
 import gc
+import sys
 import time
+import weakref
 from abc import ABC, abstractmethod
-from threading import Lock
-from typing import Union
+from contextlib import contextmanager
+from dataclasses import is_dataclass
+from io import StringIO
+from threading import Lock, Thread
+from typing import Callable, Iterator, TextIO, Union
 
-import torch
+import numpy as np
 
+from app.cancellation import check_cancelled
+from app.chunking import create_parallel_transcriber
 from app.config import CONFIG
+from app.metrics import (
+    MODEL_RESTORE_DURATION,
+    MODEL_TRANSITIONS,
+    MODEL_UNLOAD_DURATION,
+    observe_real_time_factor,
+    stage,
+)
+from app.scheduling import ModelScheduler
+from app.transcript import Transcript
+from app.utils import ResultWriter, get_writer
+from app.vad import restore_timestamps, trim_silence
 
 
 class ASRModel(ABC):
@@ -14,12 +32,31 @@ class ASRModel(ABC):
     Abstract base class for ASR (Automatic Speech Recognition) models.
     """
 
-    model = None
-    model_lock = Lock()
-    last_activity_time = time.time()
+    # Name of the engine, as configured with ASR_ENGINE
+    engine: str
+    # Whether results of separately transcribed chunks can be stitched together
+    supports_parallel_chunks = False
+    # Whether the engine applies `vad_filter` itself; otherwise silence is trimmed from the audio before decoding
+    native_vad = False
+    # Options of the SRT and VTT writers, which regroup words into cues when the result has word timestamps
+    subtitle_options = {}
 
-    def __init__(self):
-        pass
+    def __init__(self, model_name: Union[str, None] = None, quantization: Union[str, None] = None):
+        self.model_name = model_name or CONFIG.MODEL_NAME
+        self.quantization = quantization or CONFIG.MODEL_QUANTIZATION
+        self.model = None
+        self.model_lock = ModelScheduler(engine=self.engine, model=self.model_name)
+        self.last_activity_time = time.time()
+        # Where the weights are while the model is loaded: "active", "offloaded" or "snapshot"
+        self.residency = "active"
+        self.transitions = {}
+        self.active_sessions = 0
+        self._activity_lock = Lock()
+        self.parallel_transcriber = (
+            create_parallel_transcriber(self.engine, self.model_name, self.quantization)
+            if self.supports_parallel_chunks
+            else None
+        )
 
     @abstractmethod
     def load_model(self):
@@ -28,7 +65,6 @@ class ASRModel(ABC):
         """
         pass
 
-    @abstractmethod
     def transcribe(
         self,
         audio,
@@ -41,10 +77,157 @@ class ASRModel(ABC):
         output,
     ):
         """
-        Perform transcription on the given audio file.
+        Perform transcription on the given audio file and render the result in the requested output format.
+        """
+        result = self.transcribe_audio(audio, task, language, initial_prompt, vad_filter, word_timestamps, options)
+
+        with stage("write"):
+            return StringIO(self.render(Transcript.from_result(result), output))
+
+    def transcribe_audio(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+        vad_filter: Union[bool, None],
+        word_timestamps: Union[bool, None],
+        options: Union[dict, None],
+        progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        """
+        Perform transcription on the given audio file and return the engine result. With `vad_filter`, silence is
+        trimmed first for engines without their own VAD, and timestamps are mapped back to the original audio.
+        Long audio is split at silence and transcribed in parallel worker processes if enabled.
+        """
+        check_cancelled()
+        with observe_real_time_factor(self.engine, self.model_name, audio.shape[0] / CONFIG.SAMPLE_RATE):
+            if not vad_filter or self.native_vad:
+                return self._transcribe_audio(
+                    audio, task, language, initial_prompt, vad_filter, word_timestamps, options, progress
+                )
+
+            with stage("vad"):
+                speech, speech_map = trim_silence(audio)
+            if speech.shape[0] == 0:
+                return {"language": language, "segments": [], "text": ""}
+            if progress is not None:
+                report = progress
+
+                def progress(seconds: float):
+                    # Progress is reported in seconds of the original audio
+                    report(float(speech_map.to_original(np.float64(seconds))))
+
+            result = self._transcribe_audio(
+                speech, task, language, initial_prompt, vad_filter, word_timestamps, options, progress
+            )
+            return restore_timestamps(result, speech_map)
+
+    def _transcribe_audio(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+        vad_filter: Union[bool, None],
+        word_timestamps: Union[bool, None],
+        options: Union[dict, None],
+        progress: Union[Callable[[float], None], None],
+    ) -> dict:
+        if self.parallel_transcriber is None or not self.parallel_transcriber.should_split(audio):
+            return self.transcribe_result(
+                audio, task, language, initial_prompt, vad_filter, word_timestamps, options, progress
+            )
+
+        if not language:
+            # Detect the language once so that all chunks are transcribed consistently
+            language, _ = self.language_detection(audio)
+        params = {
+            "task": task,
+            "language": language,
+            "initial_prompt": initial_prompt,
+            "vad_filter": vad_filter,
+            "word_timestamps": word_timestamps,
+            "options": options,
+        }
+        with stage("inference"):
+            return self.parallel_transcriber.transcribe(audio, params, progress)
+
+    @abstractmethod
+    def transcribe_result(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+        vad_filter: Union[bool, None],
+        word_timestamps: Union[bool, None],
+        options: Union[dict, None],
+        progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        """
+        Perform transcription on the given audio file and return the engine result.
+        If given, `progress` is called with the number of seconds of audio processed so far.
         """
         pass
 
+    def get_writer(self, output: Union[str, None]) -> ResultWriter:
+        return get_writer(output, **self.subtitle_options)
+
+    def render(self, transcript: Transcript, output: Union[str, None]) -> str:
+        """
+        Render a transcript in the given output format.
+        """
+        return self.get_writer(output).render(transcript)
+
+    def write_result(self, result: Union[dict, Transcript], file: TextIO, output: Union[str, None]):
+        """
+        Render a result returned by `transcribe_result`, or a transcript, in the given output format.
+        """
+        file.write(self.render(Transcript.from_result(result), output))
+
+    def transcribe_stream(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+        vad_filter: Union[bool, None],
+        word_timestamps: Union[bool, None],
+        options: Union[dict, None],
+        output,
+    ) -> Iterator[str]:
+        """
+        Perform transcription on the given audio file, yielding the output as segments are decoded.
+        Engines that cannot produce segments incrementally yield the whole output at once.
+        """
+        yield self.transcribe(
+            audio, task, language, initial_prompt, vad_filter, word_timestamps, options, output
+        ).getvalue()
+
+    def transcribe_words(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+    ) -> tuple:
+        """
+        Transcribe a short buffer of a live stream with word timestamps.
+        Returns a list of (start, end, text) words and the language.
+        """
+        result = self.transcribe_result(audio, task, language, initial_prompt, False, True, {})
+        words = []
+        for segment in result["segments"]:
+            if is_dataclass(segment):
+                words.extend((word.start, word.end, word.word) for word in segment.words or [])
+            else:
+                # Words that could not be aligned have no timestamps
+                words.extend(
+                    (word["start"], word["end"], word["word"]) for word in segment.get("words") or [] if "start" in word
+                )
+        return words, result["language"]
+
     @abstractmethod
     def language_detection(self, audio):
         """
@@ -52,25 +235,156 @@ class ASRModel(ABC):
         """
         pass
 
-    def monitor_idleness(self):
+    def warmup(self):
         """
-        Monitors the idleness of the ASR model and releases the model if it has been idle for too long.
+        Runs a short dummy transcription so that kernels and buffers are set up before the first request.
         """
-        if CONFIG.MODEL_IDLE_TIMEOUT <= 0:
+        self.transcribe_result(np.zeros(CONFIG.SAMPLE_RATE, dtype=np.float32), "transcribe", "en", None, False, False, {})
+
+    def stats(self) -> dict:
+        """
+        Returns where the weights are, the counts of idle transitions, and engine-specific statistics.
+        """
+        return {
+            "residency": "unloaded" if self.model is None else self.residency,
+            "transitions": dict(self.transitions),
+        }
+
+    def ensure_loaded(self):
+        """
+        Loads the model, or moves it back to the device if it was offloaded while idle.
+        Every request path calls this before using the model.
+        """
+        self.last_activity_time = time.time()
+        with self.model_lock:
+            if self.model is None:
+                self.load_model()
+                self.residency = "active"
+                idle_monitor.watch(self)
+            elif self.residency != "active":
+                with MODEL_RESTORE_DURATION.time(engine=self.engine, model=self.model_name, tier=self.residency):
+                    self.restore_model()
+                self._transition("restored_from_" + self.residency)
+                self.residency = "active"
+
+    @contextmanager
+    def session(self) -> Iterator["ASRModel"]:
+        """
+        Marks the model as serving a request for the duration of the block, so it is not offloaded meanwhile.
+        """
+        with self._activity_lock:
+            self.active_sessions += 1
+        try:
+            self.ensure_loaded()
+            yield self
+        finally:
+            with self._activity_lock:
+                self.active_sessions -= 1
+                self.last_activity_time = time.time()
+
+    def offload_model(self) -> bool:
+        """
+        Moves the weights from the device to CPU memory. Returns False if the engine or device does not support it.
+        """
+        return False
+
+    def snapshot_model(self) -> bool:
+        """
+        Frees the weights from memory, keeping a copy on disk that can be mapped back quickly.
+        Returns False if the engine does not support it.
+        """
+        return False
+
+    def restore_model(self):
+        """
+        Moves the weights back to the device after `offload_model` or `snapshot_model`.
+        """
+        raise NotImplementedError
+
+    def apply_idle_policy(self):
+        """
+        Moves the model down the idle tiers: to CPU memory after MODEL_OFFLOAD_TIMEOUT seconds, to an on-disk
+        snapshot after MODEL_SNAPSHOT_TIMEOUT seconds, and unloads it after MODEL_IDLE_TIMEOUT seconds.
+        """
+        if self.model is None or self.active_sessions > 0:
             return
-        while True:
-            time.sleep(15)
-            if time.time() - self.last_activity_time > CONFIG.MODEL_IDLE_TIMEOUT:
-                with self.model_lock:
-                    self.release_model()
-                    break
+        # A model whose lock is held is busy; it is checked again on the next round
+        if not self.model_lock.acquire(blocking=False):
+            return
+        idle = time.time() - self.last_activity_time
+        try:
+            if self.model is None:
+                return
+            if 0 < CONFIG.MODEL_IDLE_TIMEOUT < idle:
+                self.release_model()
+                self._transition("unloaded")
+            elif 0 < CONFIG.MODEL_SNAPSHOT_TIMEOUT < idle and self.residency in ("active", "offloaded"):
+                if self.snapshot_model():
+                    self.residency = "snapshot"
+                    self._transition("snapshot")
+            elif 0 < CONFIG.MODEL_OFFLOAD_TIMEOUT < idle and self.residency == "active":
+                if self.offload_model():
+                    self.residency = "offloaded"
+                    self._transition("offloaded")
+        finally:
+            self.model_lock.release()
+
+    def _transition(self, transition: str):
+        self.transitions[transition] = self.transitions.get(transition, 0) + 1
+        MODEL_TRANSITIONS.inc(engine=self.engine, model=self.model_name, transition=transition)
+
+    def shutdown(self):
+        """
+        Stops the helpers of the model, such as the worker processes of parallel transcription, which hold copies of
+        the model. They are started again on next use.
+        """
+        if self.parallel_transcriber is not None:
+            self.parallel_transcriber.shutdown()
 
     def release_model(self):
         """
         Unloads the model from memory and clears any cached GPU memory.
         """
-        del self.model
-        torch.cuda.empty_cache()
-        gc.collect()
-        self.model = None
-        print("Model unloaded due to timeout")
+        with MODEL_UNLOAD_DURATION.time(engine=self.engine, model=self.model_name):
+            self.shutdown()
+            del self.model
+            if "torch" in sys.modules:
+                sys.modules["torch"].cuda.empty_cache()
+            gc.collect()
+            self.model = None
+        print("Model unloaded")
+
+
+class IdleMonitor:
+    """
+    Single background thread applying the idle policy of every loaded model.
+    """
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self._models = weakref.WeakSet()
+        self._lock = Lock()
+        self._thread = None
+
+    def watch(self, asr_model: ASRModel):
+        if CONFIG.MODEL_IDLE_TIMEOUT <= 0 and CONFIG.MODEL_OFFLOAD_TIMEOUT <= 0 and CONFIG.MODEL_SNAPSHOT_TIMEOUT <= 0:
+            return
+        with self._lock:
+            self._models.add(asr_model)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                models = list(self._models)
+            for asr_model in models:
+                try:
+                    asr_model.apply_idle_policy()
+                except Exception as e:
+                    print(f"Failed to apply the idle policy of {asr_model.engine}:{asr_model.model_name}: {e}")
+
+
+idle_monitor = IdleMonitor()
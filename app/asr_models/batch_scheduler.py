@@ -0,0 +1,163 @@
+import time
+from concurrent.futures import Future
+from dataclasses import replace
+from threading import Condition, Thread, current_thread
+from typing import Union
+
+import numpy as np
+from faster_whisper import BatchedInferencePipeline
+
+from app.cancellation import RequestCancelled, check_cancelled, current_token
+from app.config import CONFIG
+
+
+class _PendingWindows:
+    """
+    Windows of one request waiting to be decoded, together with the options they must be decoded with.
+    """
+
+    def __init__(self, features, tokenizer, chunks_metadata, options):
+        self.features = features
+        self.tokenizer = tokenizer
+        self.chunks_metadata = chunks_metadata
+        self.options = options
+        # clip_timestamps only describe how the request was split and do not affect decoding
+        self.key = (tokenizer.task, tokenizer.language, replace(options, clip_timestamps=[]))
+        self.future = Future()
+        self.token = current_token()
+
+    def __len__(self):
+        return len(self.features)
+
+
+class _ScheduledPipeline(BatchedInferencePipeline):
+    """
+    Batched pipeline of a single request that hands its windows to the shared scheduler instead of running them.
+    """
+
+    def __init__(self, model, scheduler: "BatchScheduler"):
+        super().__init__(model)
+        self.scheduler = scheduler
+
+    def forward(self, features, tokenizer, chunks_metadata, options):
+        return self.scheduler.submit(features, tokenizer, chunks_metadata, options)
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching of concurrent faster_whisper requests.
+
+    Each request is split into 30-second windows by faster-whisper's batched pipeline. Windows of all in-flight
+    requests are collected for up to `max_wait` seconds, or until `batch_size` windows are pending, and decoded
+    in one forward pass. The model lock is only held for the duration of a batch, so concurrent requests no
+    longer wait for each other's whole file.
+    """
+
+    def __init__(self, asr_model, batch_size: int, max_wait: float):
+        self.asr_model = asr_model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._condition = Condition()
+        self._thread = None
+
+    def transcribe(self, audio: np.ndarray, vad_filter: Union[bool, None] = False, **options):
+        """
+        Transcribes `audio` with windows decoded in shared batches. Returns the same segment generator and
+        transcription info as `WhisperModel.transcribe`.
+        """
+        pipeline = _ScheduledPipeline(self.asr_model.model, self)
+        if not vad_filter:
+            # Without VAD the batched pipeline needs explicit windows for audio longer than one chunk
+            window = pipeline.model.feature_extractor.n_samples
+            options["clip_timestamps"] = [
+                {"start": start, "end": min(start + window, audio.shape[0])}
+                for start in range(0, audio.shape[0], window)
+            ]
+        return pipeline.transcribe(
+            audio, vad_filter=bool(vad_filter), batch_size=self.batch_size, without_timestamps=False, **options
+        )
+
+    def submit(self, features, tokenizer, chunks_metadata, options) -> list:
+        """
+        Queues the windows of one request and blocks until they have been decoded.
+        """
+        check_cancelled()
+        pending = _PendingWindows(features, tokenizer, chunks_metadata, options)
+        with self._condition:
+            # The thread is started on first use, and again after the model was released
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._pending.append(pending)
+            self._condition.notify()
+        return pending.future.result()
+
+    def shutdown(self):
+        """
+        Stops the scheduler thread once the windows already queued have been decoded.
+        """
+        with self._condition:
+            self._thread = None
+            self._condition.notify_all()
+
+    def _next_batch(self) -> Union[list, None]:
+        with self._condition:
+            while not self._pending:
+                # Stopped by `shutdown`, or replaced by the thread started on the next use
+                if self._thread is not current_thread():
+                    return None
+                self._condition.wait()
+            deadline = time.monotonic() + self.max_wait
+            while sum(len(p) for p in self._pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Windows of requests cancelled while they were waiting are dropped
+            for pending in [p for p in self._pending if p.token is not None and p.token.cancelled]:
+                self._pending.remove(pending)
+                pending.future.set_exception(RequestCancelled(pending.token.reason))
+            if not self._pending:
+                return []
+
+            batch = [self._pending.pop(0)]
+            size = len(batch[0])
+            for pending in list(self._pending):
+                if pending.key == batch[0].key and size + len(pending) <= self.batch_size:
+                    self._pending.remove(pending)
+                    batch.append(pending)
+                    size += len(pending)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            try:
+                outputs = self._decode(batch)
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+            offset = 0
+            for pending in batch:
+                pending.future.set_result(outputs[offset : offset + len(pending)])
+                offset += len(pending)
+
+    def _decode(self, batch: list) -> list:
+        features = np.concatenate([pending.features for pending in batch])
+        chunks_metadata = [metadata for pending in batch for metadata in pending.chunks_metadata]
+        with self.asr_model.model_lock:
+            pipeline = BatchedInferencePipeline(self.asr_model.model)
+            return pipeline.forward(features, batch[0].tokenizer, chunks_metadata, batch[0].options)
+
+
+def create_batch_scheduler(asr_model) -> Union[BatchScheduler, None]:
+    if CONFIG.FASTER_WHISPER_BATCH_SIZE <= 0:
+        return None
+    return BatchScheduler(asr_model, CONFIG.FASTER_WHISPER_BATCH_SIZE, CONFIG.FASTER_WHISPER_BATCH_WAIT_MS / 1000)
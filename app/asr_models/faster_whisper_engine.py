@@ -1,30 +1,54 @@
-import time
-from io import StringIO
-from threading import Thread
-from typing import BinaryIO, Union
+from typing import Callable, Iterator, Union
 
-import whisper
+import numpy as np
 from faster_whisper import WhisperModel
+from faster_whisper.audio import pad_or_trim
 
 from app.asr_models.asr_model import ASRModel
+from app.asr_models.batch_scheduler import create_batch_scheduler
+from app.asr_models.offload import offload_ctranslate2, restore_ctranslate2, unload_ctranslate2
+from app.cancellation import checked
 from app.config import CONFIG
-from app.utils import ResultWriter, WriteJSON, WriteSRT, WriteTSV, WriteTXT, WriteVTT
+from app.metrics import observe_model_load, stage
 
 
 class FasterWhisperASR(ASRModel):
+    engine = "faster_whisper"
+    native_vad = True
+    supports_parallel_chunks = True
 
+    def __init__(self, model_name: Union[str, None] = None, quantization: Union[str, None] = None):
+        super().__init__(model_name, quantization)
+        self.batch_scheduler = create_batch_scheduler(self)
+
+    @observe_model_load
     def load_model(self):
 
         self.model = WhisperModel(
-            model_size_or_path=CONFIG.MODEL_NAME,
+            model_size_or_path=self.model_name,
             device=CONFIG.DEVICE,
-            compute_type=CONFIG.MODEL_QUANTIZATION,
-            download_root=CONFIG.MODEL_PATH
+            compute_type=self.quantization,
+            download_root=CONFIG.MODEL_PATH,
+            cpu_threads=CONFIG.CPU_THREADS,
         )
 
-        Thread(target=self.monitor_idleness, daemon=True).start()
+    def offload_model(self) -> bool:
+        return offload_ctranslate2(self.model.model)
+
+    def snapshot_model(self) -> bool:
+        # The converted model files in the download root are the on-disk copy
+        unload_ctranslate2(self.model.model)
+        return True
+
+    def restore_model(self):
+        restore_ctranslate2(self.model.model)
+
+    def shutdown(self):
+        super().shutdown()
+        if self.batch_scheduler is not None:
+            self.batch_scheduler.shutdown()
 
-    def transcribe(
+    def transcribe_result(
             self,
             audio,
             task: Union[str, None],
@@ -33,64 +57,117 @@ class FasterWhisperASR(ASRModel):
             vad_filter: Union[bool, None],
             word_timestamps: Union[bool, None],
             options: Union[dict, None],
-            output,
-    ):
-        self.last_activity_time = time.time()
+            progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        self.ensure_loaded()
+
+        options_dict = self._build_options(task, language, initial_prompt, word_timestamps)
+        if self.batch_scheduler is not None:
+            # Windows are decoded in batches shared with other requests; the scheduler takes the model lock
+            with stage("inference"):
+                segment_generator, info = self.batch_scheduler.transcribe(
+                    audio, vad_filter=vad_filter, beam_size=5, **options_dict
+                )
+                result = self._collect_segments(segment_generator, info, options_dict, progress)
+        else:
+            if vad_filter:
+                options_dict["vad_filter"] = True
+            with self.model_lock, stage("inference"):
+                segment_generator, info = self.model.transcribe(audio, beam_size=5, **options_dict)
+                segment_generator = self.model_lock.preemptible(segment_generator)
+                result = self._collect_segments(segment_generator, info, options_dict, progress)
 
-        with self.model_lock:
-            if self.model is None:
-                self.load_model()
+        return result
 
+    def transcribe_stream(
+            self,
+            audio,
+            task: Union[str, None],
+            language: Union[str, None],
+            initial_prompt: Union[str, None],
+            vad_filter: Union[bool, None],
+            word_timestamps: Union[bool, None],
+            options: Union[dict, None],
+            output,
+    ) -> Iterator[str]:
+        self.ensure_loaded()
+
+        options_dict = self._build_options(task, language, initial_prompt, word_timestamps)
+        writer = self.get_writer(output)
+        if self.batch_scheduler is not None:
+            segment_generator, info = self.batch_scheduler.transcribe(
+                audio, vad_filter=vad_filter, beam_size=5, **options_dict
+            )
+            yield from writer.iter_result(checked(segment_generator), language=info.language)
+        else:
+            if vad_filter:
+                options_dict["vad_filter"] = True
+            with self.model_lock:
+                segment_generator, info = self.model.transcribe(audio, beam_size=5, **options_dict)
+                segment_generator = checked(self.model_lock.preemptible(segment_generator))
+                yield from writer.iter_result(segment_generator, language=info.language)
+
+    @staticmethod
+    def _build_options(
+            task: Union[str, None],
+            language: Union[str, None],
+            initial_prompt: Union[str, None],
+            word_timestamps: Union[bool, None],
+    ) -> dict:
         options_dict = {"task": task}
         if language:
             options_dict["language"] = language
         if initial_prompt:
             options_dict["initial_prompt"] = initial_prompt
-        if vad_filter:
-            options_dict["vad_filter"] = True
         if word_timestamps:
             options_dict["word_timestamps"] = True
-        with self.model_lock:
-            segments = []
-            text = ""
-            segment_generator, info = self.model.transcribe(audio, beam_size=5, **options_dict)
-            for segment in segment_generator:
-                segments.append(segment)
-                text = text + segment.text
-            result = {"language": options_dict.get("language", info.language), "segments": segments, "text": text}
-
-        output_file = StringIO()
-        self.write_result(result, output_file, output)
-        output_file.seek(0)
-
-        return output_file
+        return options_dict
+
+    @staticmethod
+    def _collect_segments(segment_generator, info, options_dict: dict, progress=None) -> dict:
+        segments = []
+        text = ""
+        for segment in checked(segment_generator):
+            segments.append(segment)
+            text = text + segment.text
+            if progress is not None:
+                progress(segment.end)
+        return {"language": options_dict.get("language", info.language), "segments": segments, "text": text}
 
     def language_detection(self, audio):
 
-        self.last_activity_time = time.time()
+        self.ensure_loaded()
 
-        with self.model_lock:
-            if self.model is None: self.load_model()
-
-        # load audio and pad/trim it to fit 30 seconds
-        audio = whisper.pad_or_trim(audio)
+        if not self.model.model.is_multilingual:
+            return "en", 1.0
 
-        # detect the spoken language
+        # Only the encoder and the language token probabilities are computed; no text is decoded
+        n_samples = self.model.feature_extractor.n_samples
+        features = np.stack([
+            pad_or_trim(self.model.feature_extractor(pad_or_trim(window, n_samples)))
+            for window in self._detection_windows(audio, n_samples, CONFIG.LANGUAGE_DETECTION_WINDOWS)
+        ])
         with self.model_lock:
-            segments, info = self.model.transcribe(audio, beam_size=5)
-            detected_lang_code = info.language
-            detected_language_confidence = info.language_probability
-
-        return detected_lang_code, detected_language_confidence
-
-    def write_result(self, result: dict, file: BinaryIO, output: Union[str, None]):
-        if output == "srt":
-            WriteSRT(ResultWriter).write_result(result, file=file)
-        elif output == "vtt":
-            WriteVTT(ResultWriter).write_result(result, file=file)
-        elif output == "tsv":
-            WriteTSV(ResultWriter).write_result(result, file=file)
-        elif output == "json":
-            WriteJSON(ResultWriter).write_result(result, file=file)
-        else:
-            WriteTXT(ResultWriter).write_result(result, file=file)
+            encoder_output = self.model.encode(features)
+            results = self.model.model.detect_language(encoder_output)
+
+        # Average the probabilities of every window; tokens look like "<|en|>"
+        probabilities = {}
+        for window_results in results:
+            for token, probability in window_results:
+                language = token[2:-2]
+                probabilities[language] = probabilities.get(language, 0.0) + probability / len(results)
+
+        detected_lang_code = max(probabilities, key=probabilities.get)
+        return detected_lang_code, probabilities[detected_lang_code]
+
+    @staticmethod
+    def _detection_windows(audio: np.ndarray, window: int, count: int) -> list:
+        """
+        Returns up to `count` windows of `window` samples spread evenly across the audio, starting at its beginning.
+        """
+        count = min(count, -(-audio.shape[0] // window))
+        if count <= 1:
+            return [audio[:window]]
+        starts = np.linspace(0, audio.shape[0] - window, count).astype(int)
+        return [audio[start : start + window] for start in starts]
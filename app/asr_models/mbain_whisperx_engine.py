@@ -1,32 +1,49 @@
-import time
-from io import StringIO
-from threading import Thread
-from typing import BinaryIO, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Union
 
+import numpy as np
+import torch
 import whisperx
 from whisperx.audio import N_SAMPLES
 from whisperx.diarize import DiarizationPipeline
-from whisperx.utils import ResultWriter, SubtitlesWriter, WriteJSON, WriteSRT, WriteTSV, WriteTXT, WriteVTT
 
+from app.asr_models.align_model_cache import AlignModelCache
 from app.asr_models.asr_model import ASRModel
+from app.asr_models.offload import offload_ctranslate2, restore_ctranslate2, unload_ctranslate2
+from app.cancellation import check_cancelled
 from app.config import CONFIG
+from app.metrics import observe_model_load, stage
 
 
 class WhisperXASR(ASRModel):
-    def __init__(self):
-        super().__init__()
+    engine = "whisperx"
+    native_vad = True
+    subtitle_options = {
+        "max_line_width": CONFIG.SUBTITLE_MAX_LINE_WIDTH,
+        "max_line_count": CONFIG.SUBTITLE_MAX_LINE_COUNT,
+        "highlight_words": CONFIG.SUBTITLE_HIGHLIGHT_WORDS,
+    }
+
+    @observe_model_load
+    def load_model(self):
         self.model = {
             'whisperx': None,
             'diarize_model': None,
-            'align_model': {}
+            'diarize_pool': None,
+            'diarize_stream': None,
+            'align_model': AlignModelCache(
+                whisperx.load_align_model,
+                CONFIG.DEVICE,
+                max_models=CONFIG.WHISPERX_ALIGN_CACHE_SIZE,
+                max_bytes=CONFIG.WHISPERX_ALIGN_CACHE_MB * 1024 * 1024,
+                max_offloaded=CONFIG.WHISPERX_ALIGN_OFFLOAD_SIZE,
+            )
         }
-
-    def load_model(self):
         asr_options = {"without_timestamps": False}
         self.model['whisperx'] = whisperx.load_model(
-            CONFIG.MODEL_NAME,
+            self.model_name,
             device=CONFIG.DEVICE,
-            compute_type=CONFIG.MODEL_QUANTIZATION,
+            compute_type=self.quantization,
             asr_options=asr_options
         )
 
@@ -35,10 +52,14 @@ class WhisperXASR(ASRModel):
                 use_auth_token=CONFIG.HF_TOKEN,
                 device=CONFIG.DEVICE
             )
+            # A single thread runs the diarization of one request at a time, next to transcription and alignment.
+            # On GPU it uses its own CUDA stream, so that its kernels are not ordered behind those of alignment.
+            self.model['diarize_pool'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asr-diarize")
+            self.model['diarize_stream'] = torch.cuda.Stream() if CONFIG.DEVICE == "cuda" else None
 
-        Thread(target=self.monitor_idleness, daemon=True).start()
+        self.model['align_model'].preload(CONFIG.WHISPERX_ALIGN_PRELOAD)
 
-    def transcribe(
+    def transcribe_result(
         self,
         audio,
         task: Union[str, None],
@@ -47,55 +68,84 @@ class WhisperXASR(ASRModel):
         vad_filter: Union[bool, None],
         word_timestamps: Union[bool, None],
         options: Union[dict, None],
-        output,
-    ):
-        self.last_activity_time = time.time()
-        with self.model_lock:
-            if self.model is None:
-                self.load_model()
+        progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        self.ensure_loaded()
+
+        diarization = None
+        if options.get("diarize", False) and CONFIG.HF_TOKEN != "":
+            # Diarization only needs the audio, so it starts right away instead of after alignment
+            diarization = self._start_diarization(audio, options.get("min_speakers"), options.get("max_speakers"))
 
         options_dict = {"task": task}
         if language:
             options_dict["language"] = language
         if initial_prompt:
             options_dict["initial_prompt"] = initial_prompt
-        with self.model_lock:
-            result = self.model['whisperx'].transcribe(audio, **options_dict)
-            language = result["language"]
-
-        # Load the required model and cache it
-        # If we transcribe models in many different languages, this may lead to OOM propblems
-        if result["language"] in self.model['align_model']:
-            model_x, metadata = self.model['align_model'][result["language"]]
-        else:
-            self.model['align_model'][result["language"]] = whisperx.load_align_model(
-                language_code=result["language"], device=CONFIG.DEVICE
-            )
-            model_x, metadata = self.model['align_model'][result["language"]]
+        try:
+            with self.model_lock, stage("inference"):
+                result = self.model['whisperx'].transcribe(audio, **options_dict)
+                language = result["language"]
+
+            check_cancelled()
+            # Align whisper output, with the alignment model of the language taken from the bounded cache
+            with self.model['align_model'].use(result["language"]) as (model_x, metadata), stage("alignment"):
+                result = whisperx.align(
+                    result["segments"], model_x, metadata, audio, CONFIG.DEVICE, return_char_alignments=False
+                )
+        except BaseException:
+            if diarization is not None:
+                diarization.cancel()
+            raise
+
+        if diarization is not None:
+            check_cancelled()
+            result = whisperx.assign_word_speakers(diarization.result(), result)
+        result["language"] = language
 
-        # Align whisper output
-        result = whisperx.align(
-            result["segments"], model_x, metadata, audio, CONFIG.DEVICE, return_char_alignments=False
-        )
+        return result
 
-        if options.get("diarize", False) and CONFIG.HF_TOKEN != "":
-            min_speakers = options.get("min_speakers", None)
-            max_speakers = options.get("max_speakers", None)
-            # add min/max number of speakers if known
-            diarize_segments = self.model['diarize_model'](audio, min_speakers, max_speakers)
-            result = whisperx.assign_word_speakers(diarize_segments, result)
-        result["language"] = language
+    def _start_diarization(self, audio, min_speakers: Union[int, None], max_speakers: Union[int, None]) -> Future:
+        # The pipeline wraps the buffer in a tensor without copying it
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        stream = self.model['diarize_stream']
+
+        def diarize():
+            with stage("diarization"):
+                if stream is None:
+                    return self.model['diarize_model'](audio, min_speakers=min_speakers, max_speakers=max_speakers)
+                with torch.cuda.stream(stream):
+                    segments = self.model['diarize_model'](audio, min_speakers=min_speakers, max_speakers=max_speakers)
+                stream.synchronize()
+                return segments
+
+        return self.model['diarize_pool'].submit(diarize)
+
+    def offload_model(self) -> bool:
+        self.model['align_model'].offload()
+        return offload_ctranslate2(self.model['whisperx'].model.model)
+
+    def snapshot_model(self) -> bool:
+        self.model['align_model'].clear()
+        unload_ctranslate2(self.model['whisperx'].model.model)
+        return True
 
-        output_file = StringIO()
-        self.write_result(result, output_file, output)
-        output_file.seek(0)
+    def restore_model(self):
+        restore_ctranslate2(self.model['whisperx'].model.model)
 
-        return output_file
+    def release_model(self):
+        if self.model is not None and self.model['diarize_pool'] is not None:
+            self.model['diarize_pool'].shutdown(wait=False)
+        super().release_model()
+
+    def stats(self) -> dict:
+        if self.model is None:
+            return super().stats()
+        return {**super().stats(), "align_models": self.model['align_model'].stats()}
 
     def language_detection(self, audio):
+        self.ensure_loaded()
         with self.model_lock:
-            if self.model is None:
-                self.load_model()
             if audio.shape[0] < N_SAMPLES:
                 print("Warning: audio is shorter than 30s, language detection may be inaccurate.")
             results = self.model['whisperx'].model.detect_language(audio)
@@ -103,22 +153,3 @@ class WhisperXASR(ASRModel):
             language_probability = round(float(results[1]), 2)
             print(f"Detected language: {language} ({language_probability}) in first 30s of audio...")
         return language, language_probability
-
-
-    def write_result(self, result: dict, file: BinaryIO, output: Union[str, None]):
-        default_options = {
-            "max_line_width": CONFIG.SUBTITLE_MAX_LINE_WIDTH,
-            "max_line_count": CONFIG.SUBTITLE_MAX_LINE_COUNT,
-            "highlight_words": CONFIG.SUBTITLE_HIGHLIGHT_WORDS
-        }
-
-        if output == "srt":
-            WriteSRT(SubtitlesWriter).write_result(result, file=file, options=default_options)
-        elif output == "vtt":
-            WriteVTT(SubtitlesWriter).write_result(result, file=file, options=default_options)
-        elif output == "tsv":
-            WriteTSV(ResultWriter).write_result(result, file=file, options=default_options)
-        elif output == "json":
-            WriteJSON(ResultWriter).write_result(result, file=file, options=default_options)
-        else:
-            WriteTXT(ResultWriter).write_result(result, file=file, options=default_options)
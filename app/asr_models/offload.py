@@ -0,0 +1,129 @@
+"""
+Helpers moving idle model weights out of device memory and back, for CTranslate2 and PyTorch models.
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+
+def offload_ctranslate2(model) -> bool:
+    """
+    Moves the weights of a CTranslate2 model to CPU memory. Returns False if the model already runs on the CPU.
+    """
+    if model.device == "cpu":
+        return False
+    model.unload_model(to_cpu=True)
+    return True
+
+
+def unload_ctranslate2(model):
+    """
+    Frees the weights of a CTranslate2 model, which are read back from the converted model files on disk when it is
+    loaded again. Runtime context such as the tokenizer and feature extractor is kept.
+    """
+    if not model.model_is_loaded:
+        # Weights cached in CPU memory are only freed by unloading from the device
+        model.load_model()
+    model.unload_model(to_cpu=False)
+
+
+def restore_ctranslate2(model):
+    if not model.model_is_loaded:
+        model.load_model()
+
+
+def _tensors(module):
+    for tensor in (*module.parameters(), *module.buffers()):
+        if not tensor.is_sparse:
+            yield tensor
+
+
+def offload_torch(module) -> bool:
+    """
+    Moves the weights of a PyTorch module from the GPU to pinned CPU memory, from which they are copied back
+    asynchronously. Returns False if the module is not on a GPU.
+    """
+    import torch
+
+    if next(module.parameters()).device.type != "cuda":
+        return False
+    module.to("cpu")
+    for tensor in _tensors(module):
+        tensor.data = tensor.data.pin_memory()
+    torch.cuda.empty_cache()
+    return True
+
+
+def save_snapshot(module, path: str, **metadata):
+    """
+    Writes the weights of a PyTorch module, including its non-persistent buffers, and `metadata` to `path`.
+    """
+    import torch
+
+    # Quantized modules also store packed weights and their dtype, which are saved as they are
+    original = module.state_dict()
+    state_dict = OrderedDict(
+        (name, tensor.cpu() if isinstance(tensor, torch.Tensor) else tensor) for name, tensor in original.items()
+    )
+    # The versions of the modules tell quantized modules how their packed weights are laid out
+    state_dict._metadata = getattr(original, "_metadata", None)
+    buffers = {
+        name: tensor.cpu().to_dense() for name, tensor in module.named_buffers() if name not in state_dict
+    }
+    sparse = [name for name, tensor in module.named_buffers() if name in buffers and tensor.is_sparse]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save({"state_dict": state_dict, "buffers": buffers, "sparse": sparse, **metadata}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> dict:
+    """
+    Loads a snapshot written by `save_snapshot`. Its tensors are memory-mapped from the file, so processes loading
+    the same snapshot share its pages, and the OS can reclaim them under memory pressure.
+    """
+    import torch
+
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def apply_snapshot(module, snapshot: dict):
+    """
+    Replaces the weights of a PyTorch module, which may have been created on the meta device, with the tensors of
+    a snapshot without copying them.
+    """
+    module.load_state_dict(snapshot["state_dict"], assign=True)
+    for name, tensor in snapshot["buffers"].items():
+        owner, _, leaf = name.rpartition(".")
+        if name in snapshot["sparse"]:
+            tensor = tensor.to_sparse()
+        module.get_submodule(owner).register_buffer(leaf, tensor, persistent=False)
+
+
+def snapshot_torch(module, path: str, **metadata):
+    """
+    Replaces the weights of a PyTorch module with views of a memory-mapped snapshot on disk, written to `path` the
+    first time. The weights are then paged in by the OS as they are used, and their memory can be reclaimed.
+    """
+    import torch
+
+    if not os.path.exists(path):
+        save_snapshot(module, path, **metadata)
+    apply_snapshot(module, load_snapshot(path))
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def restore_torch(module, device: str):
+    """
+    Moves the weights of a PyTorch module back to `device`. On the CPU, memory-mapped weights are left in place.
+    """
+    if device != "cpu":
+        module.to(device, non_blocking=True)
+
+
+def snapshot_path(directory: str, *parts: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", "-".join(parts))
+    return os.path.join(directory, f"{name}.pt")
@@ -1,28 +1,199 @@
-import time
-from io import StringIO
-from threading import Thread
-from typing import BinaryIO, Union
+import os
+import sys
+from contextvars import ContextVar
+from dataclasses import asdict
+from types import SimpleNamespace
+from typing import Callable, Union
 
 import torch
+import tqdm
 import whisper
-from whisper.utils import ResultWriter, WriteJSON, WriteSRT, WriteTSV, WriteTXT, WriteVTT
 
 from app.asr_models.asr_model import ASRModel
+from app.asr_models.offload import (
+    apply_snapshot,
+    load_snapshot,
+    offload_torch,
+    restore_torch,
+    save_snapshot,
+    snapshot_path,
+    snapshot_torch,
+)
+from app.cancellation import check_cancelled
 from app.config import CONFIG
+from app.metrics import observe_model_load, stage
+
+# Progress callback of the transcription running in the current thread
+_progress: ContextVar[Union[Callable[[float], None], None]] = ContextVar("openai_whisper_progress", default=None)
+
+
+class _ProgressBar(tqdm.tqdm):
+    """
+    Progress bar that `whisper.transcribe` advances by the frames it seeks past after every window. Reports the
+    seconds of audio processed so far to the progress callback of the transcription, also while the bar is hidden.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frames = 0
+
+    def update(self, n=1):
+        progress = _progress.get()
+        if progress is not None:
+            self.frames += n
+            progress(self.frames * whisper.audio.HOP_LENGTH / whisper.audio.SAMPLE_RATE)
+        return super().update(n)
+
+
+# The decoding loop only tells where it seeks to through its progress bar; `whisper.transcribe` is the function
+sys.modules["whisper.transcribe"].tqdm = SimpleNamespace(tqdm=_ProgressBar)
+
+
+def _replace_linear(model: torch.nn.Module, convert: Callable[[torch.nn.Linear], torch.nn.Module]):
+    """
+    Replaces every linear layer of `model` with the module returned by `convert`.
+    """
+    for parent in list(model.modules()):
+        for name, child in parent.named_children():
+            if isinstance(child, torch.nn.Linear):
+                setattr(parent, name, convert(child))
+
+
+def _empty_whisper(dims: dict) -> whisper.model.Whisper:
+    """
+    Creates a Whisper model with its modules on the meta device, to be filled by `apply_snapshot`. The constructor of
+    `Whisper` is bypassed, as it creates the sparse `alignment_heads` buffer, which the meta device does not support;
+    the snapshot provides that buffer.
+    """
+    dims = whisper.model.ModelDimensions(**dims)
+    model = whisper.model.Whisper.__new__(whisper.model.Whisper)
+    torch.nn.Module.__init__(model)
+    model.dims = dims
+    with torch.device("meta"):
+        model.encoder = whisper.model.AudioEncoder(
+            dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head, dims.n_audio_layer
+        )
+        model.decoder = whisper.model.TextDecoder(
+            dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head, dims.n_text_layer
+        )
+    return model
+
+
+def _plain_linear(linear: torch.nn.Linear) -> torch.nn.Linear:
+    # Whisper's Linear subclass casts its weights to the input dtype, and is not recognized by quantize_dynamic
+    plain = torch.nn.Linear(linear.in_features, linear.out_features, bias=linear.bias is not None, device="meta")
+    plain.weight = linear.weight
+    plain.bias = linear.bias
+    return plain
+
+
+def _quantized_linear(linear: torch.nn.Linear) -> torch.nn.Module:
+    # Placeholder whose packed weights are replaced by those of the prepared model
+    return torch.ao.nn.quantized.dynamic.Linear(
+        linear.in_features, linear.out_features, bias_=linear.bias is not None, dtype=torch.qint8
+    )
 
 
 class OpenAIWhisperASR(ASRModel):
+    engine = "openai_whisper"
+    supports_parallel_chunks = True
+    subtitle_options = {"max_line_width": 1000, "max_line_count": 10, "highlight_words": False}
 
-    def load_model(self):
+    @property
+    def quantized(self) -> bool:
+        # PyTorch only has dynamically quantized int8 kernels for the CPU; on the GPU, Whisper decodes in float16
+        return self.quantization == "int8" and not torch.cuda.is_available()
 
-        if torch.cuda.is_available():
-            self.model = whisper.load_model(name=CONFIG.MODEL_NAME, download_root=CONFIG.MODEL_PATH).cuda()
-        else:
-            self.model = whisper.load_model(name=CONFIG.MODEL_NAME, download_root=CONFIG.MODEL_PATH)
+    @observe_model_load
+    def load_model(self):
 
-        Thread(target=self.monitor_idleness, daemon=True).start()
+        if CONFIG.CPU_THREADS > 0:
+            torch.set_num_threads(CONFIG.CPU_THREADS)
 
-    def transcribe(
+        if self.quantized:
+            self.model = self._load_quantized()
+        elif CONFIG.MODEL_SHARED_WEIGHTS:
+            self.model = self._load_shared()
+        else:
+            self.model = whisper.load_model(name=self.model_name, download_root=CONFIG.MODEL_PATH, device="cpu")
+        if torch.cuda.is_available():
+            self.model = self.model.cuda()
+        for name in CONFIG.OPENAI_WHISPER_COMPILE:
+            # The encoder always sees 30-second windows, while the decoder sees a growing number of tokens
+            getattr(self.model, name).compile(dynamic=name == "decoder")
+        self._check_between_windows(self.model)
+
+    def _check_between_windows(self, model):
+        """
+        Makes `transcribe` check for cancellation, and give the model up to a waiting request that comes first,
+        before decoding each 30-second window.
+        """
+        decode = model.decode
+
+        def checked_decode(*args, **kwargs):
+            check_cancelled()
+            self.model_lock.preempt()
+            return decode(*args, **kwargs)
+
+        model.decode = checked_decode
+
+    def _snapshot_path(self) -> str:
+        if self.quantized:
+            return snapshot_path(CONFIG.MODEL_SNAPSHOT_DIR, self.engine, self.model_name, self.quantization)
+        return snapshot_path(CONFIG.MODEL_SNAPSHOT_DIR, self.engine, self.model_name)
+
+    def _load_quantized(self):
+        """
+        Creates the model with its linear layers quantized to int8 with dynamic activation quantization. The prepared
+        model is written to a snapshot, from which later loads, and the workers of parallel transcription, read the
+        quantized weights instead of converting the float weights again.
+        """
+        path = self._snapshot_path()
+        if not os.path.exists(path):
+            model = whisper.load_model(name=self.model_name, download_root=CONFIG.MODEL_PATH, device="cpu")
+            _replace_linear(model, _plain_linear)
+            torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            save_snapshot(model, path, dims=asdict(model.dims))
+            return model
+
+        snapshot = load_snapshot(path)
+        model = _empty_whisper(snapshot["dims"])
+        _replace_linear(model, _quantized_linear)
+        # Packing copies the quantized weights out of the snapshot, so unlike float weights they are not shared
+        apply_snapshot(model, snapshot)
+        return model
+
+    def _load_shared(self):
+        """
+        Creates the model with its weights memory-mapped from a snapshot, which is written on first use. Every
+        process loading the same snapshot shares its pages instead of holding a private copy of the weights.
+        """
+        path = self._snapshot_path()
+        if not os.path.exists(path):
+            model = whisper.load_model(name=self.model_name, download_root=CONFIG.MODEL_PATH, device="cpu")
+            save_snapshot(model, path, dims=asdict(model.dims))
+            del model
+
+        snapshot = load_snapshot(path)
+        # Creating the modules on the meta device skips allocating and initializing weights that are replaced anyway
+        model = _empty_whisper(snapshot["dims"])
+        apply_snapshot(model, snapshot)
+        return model
+
+    def offload_model(self) -> bool:
+        return offload_torch(self.model)
+
+    def snapshot_model(self) -> bool:
+        if self.quantized:
+            # Packed int8 weights cannot be memory-mapped; they are small enough to stay in memory
+            return False
+        snapshot_torch(self.model, self._snapshot_path(), dims=asdict(self.model.dims))
+        return True
+
+    def restore_model(self):
+        restore_torch(self.model, "cuda" if torch.cuda.is_available() else "cpu")
+
+    def transcribe_result(
         self,
         audio,
         task: Union[str, None],
@@ -31,13 +202,9 @@ class OpenAIWhisperASR(ASRModel):
         vad_filter: Union[bool, None],
         word_timestamps: Union[bool, None],
         options: Union[dict, None],
-        output,
-    ):
-        self.last_activity_time = time.time()
-
-        with self.model_lock:
-            if self.model is None:
-                self.load_model()
+        progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        self.ensure_loaded()
 
         options_dict = {"task": task}
         if language:
@@ -46,22 +213,18 @@ class OpenAIWhisperASR(ASRModel):
             options_dict["initial_prompt"] = initial_prompt
         if word_timestamps:
             options_dict["word_timestamps"] = word_timestamps
-        with self.model_lock:
-            result = self.model.transcribe(audio, **options_dict)
+        reset = _progress.set(progress)
+        try:
+            with self.model_lock, stage("inference"):
+                result = self.model.transcribe(audio, **options_dict)
+        finally:
+            _progress.reset(reset)
 
-        output_file = StringIO()
-        self.write_result(result, output_file, output)
-        output_file.seek(0)
-
-        return output_file
+        return result
 
     def language_detection(self, audio):
 
-        self.last_activity_time = time.time()
-
-        with self.model_lock:
-            if self.model is None:
-                self.load_model()
+        self.ensure_loaded()
 
         # load audio and pad/trim it to fit 30 seconds
         audio = whisper.pad_or_trim(audio)
@@ -75,16 +238,3 @@ class OpenAIWhisperASR(ASRModel):
         detected_lang_code = max(probs, key=probs.get)
 
         return detected_lang_code, probs[max(probs)]
-
-    def write_result(self, result: dict, file: BinaryIO, output: Union[str, None]):
-        options = {"max_line_width": 1000, "max_line_count": 10, "highlight_words": False}
-        if output == "srt":
-            WriteSRT(ResultWriter).write_result(result, file=file, options=options)
-        elif output == "vtt":
-            WriteVTT(ResultWriter).write_result(result, file=file, options=options)
-        elif output == "tsv":
-            WriteTSV(ResultWriter).write_result(result, file=file, options=options)
-        elif output == "json":
-            WriteJSON(ResultWriter).write_result(result, file=file, options=options)
-        else:
-            WriteTXT(ResultWriter).write_result(result, file=file, options=options)
@@ -0,0 +1,123 @@
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Union
+
+import numpy as np
+
+from app.asr_models.asr_model import ASRModel
+from app.cancellation import check_cancelled
+from app.config import CONFIG
+from app.metrics import observe_model_load, stage
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+
+
+@dataclass
+class Word:
+    start: float
+    end: float
+    word: str
+    probability: float
+
+
+@dataclass
+class Segment:
+    id: int
+    seek: int
+    start: float
+    end: float
+    text: str
+    tokens: List[int]
+    avg_logprob: float
+    compression_ratio: float
+    no_speech_prob: float
+    words: Optional[List[Word]]
+    temperature: Optional[float]
+
+
+class StubASR(ASRModel):
+    """
+    Deterministic engine that produces placeholder segments without loading any weights.
+
+    The same audio always yields the same output, and each segment takes `STUB_REAL_TIME_FACTOR` times its duration
+    to "decode", so the HTTP, decoding and serialization paths can be benchmarked on machines without a model.
+    """
+
+    engine = "stub"
+
+    @observe_model_load
+    def load_model(self):
+        self.model = self.model_name
+
+    def transcribe_result(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+        vad_filter: Union[bool, None],
+        word_timestamps: Union[bool, None],
+        options: Union[dict, None],
+        progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        segments = []
+        text = ""
+        for segment in self._segments(audio, word_timestamps):
+            segments.append(segment)
+            text = text + segment.text
+            if progress is not None:
+                progress(segment.end)
+        return {"language": language or "en", "segments": segments, "text": text}
+
+    def transcribe_stream(
+        self,
+        audio,
+        task: Union[str, None],
+        language: Union[str, None],
+        initial_prompt: Union[str, None],
+        vad_filter: Union[bool, None],
+        word_timestamps: Union[bool, None],
+        options: Union[dict, None],
+        output,
+    ) -> Iterator[str]:
+        yield from self.get_writer(output).iter_result(
+            self._segments(audio, word_timestamps), language=language or "en"
+        )
+
+    def _segments(self, audio, word_timestamps: Union[bool, None]) -> Iterator[Segment]:
+        self.ensure_loaded()
+
+        sr = CONFIG.SAMPLE_RATE
+        window = int(CONFIG.STUB_SEGMENT_SECONDS * sr)
+        for index, offset in enumerate(range(0, audio.shape[0], window)):
+            check_cancelled()
+            chunk = np.asarray(audio[offset : offset + window])
+            start = offset / sr
+            end = (offset + chunk.shape[0]) / sr
+            with self.model_lock, stage("inference"):
+                time.sleep((end - start) * CONFIG.STUB_REAL_TIME_FACTOR)
+                # Derive the words from the samples so that the output only depends on the audio
+                seed = zlib.crc32(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+                words = [WORDS[(seed >> shift) % len(WORDS)] for shift in range(0, 24, 3)]
+            step = (end - start) / len(words)
+            yield Segment(
+                id=index,
+                seek=offset // 160,
+                start=start,
+                end=end,
+                text=" " + " ".join(words),
+                tokens=[],
+                avg_logprob=-0.1,
+                compression_ratio=1.0,
+                no_speech_prob=0.0,
+                words=[
+                    Word(start=start + i * step, end=start + (i + 1) * step, word=" " + word, probability=1.0)
+                    for i, word in enumerate(words)
+                ] if word_timestamps else None,
+                temperature=0.0,
+            )
+
+    def language_detection(self, audio):
+        self.last_activity_time = time.time()
+        return "en", 1.0
@@ -0,0 +1,208 @@
+"""
+In-process decoding of uncompressed uploads, so that WAV, FLAC and raw PCM do not need an ffmpeg subprocess.
+"""
+
+import io
+import struct
+from math import gcd
+from typing import BinaryIO, Iterator, Tuple, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.config import CONFIG
+
+try:
+    import soundfile
+except ImportError:
+    # libsndfile is optional; FLAC is decoded by ffmpeg without it
+    soundfile = None
+
+# WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT and WAVE_FORMAT_EXTENSIBLE, whose sub-format is one of the first two
+WAVE_PCM = 1
+WAVE_FLOAT = 3
+WAVE_EXTENSIBLE = 0xFFFE
+
+
+class _Prepended(io.RawIOBase):
+    """
+    Non-seekable file object whose first bytes were already read, for sniffing the format of an upload.
+    """
+
+    def __init__(self, head: bytes, file: BinaryIO):
+        self.head = head
+        self.file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.file.read(size)
+        if size < 0:
+            data, self.head = self.head + self.file.read(), b""
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.file.read(size - len(data))
+        return data
+
+
+def peek(file: BinaryIO, size: int) -> Tuple[bytes, BinaryIO]:
+    """
+    Reads the first `size` bytes of `file`. Returns them together with a file object that still starts at them.
+    """
+    seekable = getattr(file, "seekable", lambda: False)()
+    position = file.tell() if seekable else 0
+    head = file.read(size)
+    if seekable:
+        file.seek(position)
+        return head, file
+    return head, _Prepended(head, file)
+
+
+def sniff(head: bytes) -> Union[str, None]:
+    """
+    Returns "wav" or "flac" if the header identifies the file as such, and None otherwise.
+    """
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"fLaC":
+        return "flac"
+    return None
+
+
+def can_decode(fmt: Union[str, None], file: BinaryIO) -> bool:
+    if fmt == "wav":
+        return True
+    # libsndfile needs to seek within the file
+    return fmt == "flac" and soundfile is not None and getattr(file, "seekable", lambda: False)()
+
+
+def _read_exactly(file: BinaryIO, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) < size:
+        raise RuntimeError("Failed to load audio: the WAV file is truncated")
+    return data
+
+
+def _to_float(data: bytes, audio_format: int, bits: int) -> np.ndarray:
+    if audio_format == WAVE_FLOAT and bits in (32, 64):
+        return np.frombuffer(data, f"<f{bits // 8}").astype(np.float32, copy=False)
+    if audio_format != WAVE_PCM:
+        raise RuntimeError(f"Failed to load audio: unsupported WAV format {audio_format}")
+    if bits == 8:
+        return (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+    if bits == 16:
+        return np.frombuffer(data, "<i2").astype(np.float32) / 32768
+    if bits == 24:
+        b = np.frombuffer(data, np.uint8).reshape(-1, 3).astype(np.int32)
+        # Place the 3 bytes in the top of an int32, so that the shift back down extends the sign
+        samples = ((b[:, 0] << 8) | (b[:, 1] << 16) | (b[:, 2] << 24)) >> 8
+        return samples.astype(np.float32) / 8388608
+    if bits == 32:
+        return np.frombuffer(data, "<i4").astype(np.float32) / 2147483648
+    raise RuntimeError(f"Failed to load audio: unsupported WAV sample size of {bits} bits")
+
+
+def decode_wav(file: BinaryIO, buffer, chunk_size: int = CONFIG.AUDIO_CHUNK_SIZE) -> int:
+    """
+    Decodes a WAV file chunk by chunk into `buffer`, down-mixed to mono. Returns its sample rate.
+    """
+    _read_exactly(file, 12)
+    fmt = None
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            raise RuntimeError("Failed to load audio: the WAV file has no data")
+        chunk_id, chunk_size_bytes = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            fmt = _read_exactly(file, chunk_size_bytes + chunk_size_bytes % 2)
+        elif chunk_id == b"data":
+            break
+        else:
+            # Chunks are padded to an even size
+            _read_exactly(file, chunk_size_bytes + chunk_size_bytes % 2)
+    if fmt is None:
+        raise RuntimeError("Failed to load audio: the WAV file has no format chunk")
+
+    audio_format, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if audio_format == WAVE_EXTENSIBLE and len(fmt) >= 26:
+        audio_format = struct.unpack("<H", fmt[24:26])[0]
+    if channels == 0 or block_align != channels * ((bits + 7) // 8):
+        raise RuntimeError("Failed to load audio: invalid WAV format chunk")
+
+    # Streamed WAV files may leave the data size at 0 or its maximum; they are read up to the end
+    remaining = chunk_size_bytes if 0 < chunk_size_bytes < 0xFFFFFFFF else None
+    chunk_size -= chunk_size % block_align
+    rest = b""
+    while remaining is None or remaining > 0:
+        data = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+        if not data:
+            break
+        if remaining is not None:
+            remaining -= len(data)
+        data = rest + data
+        cut = len(data) - len(data) % block_align
+        data, rest = data[:cut], data[cut:]
+        samples = _to_float(data, audio_format, bits)
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+        buffer.append(samples)
+    return sample_rate
+
+
+def decode_flac(file: BinaryIO, buffer, block_size: int = CONFIG.AUDIO_CHUNK_SIZE // 4) -> int:
+    """
+    Decodes a FLAC file with libsndfile, block by block into `buffer`, down-mixed to mono. Returns its sample rate.
+    """
+    with soundfile.SoundFile(file) as f:
+        for block in f.blocks(blocksize=block_size, dtype="float32", always_2d=True):
+            buffer.append(block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0])
+        return f.samplerate
+
+
+def _filter_bank(up: int, down: int, half_width: int, beta: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Kaiser-windowed sinc filters for the `up` fractional positions of the output samples between two input
+    samples. Returns the tap offsets and the filters, one row per position.
+    """
+    cutoff = min(1.0, up / down)
+    # Downsampling stretches the filter, so that it also removes frequencies above the new Nyquist rate
+    support = int(np.ceil(half_width / cutoff))
+    taps = np.arange(-support + 1, support + 1)
+    x = taps[None, :] - np.arange(up)[:, None] / up
+    window = np.i0(beta * np.sqrt(np.clip(1 - (x / support) ** 2, 0, None))) / np.i0(beta)
+    bank = cutoff * np.sinc(cutoff * x) * window
+    bank /= bank.sum(axis=1, keepdims=True)
+    return taps, bank.astype(np.float32)
+
+
+def resample(
+    audio: np.ndarray, orig_sr: int, target_sr: int, half_width: int = 16, beta: float = 8.6, block: int = 1 << 17
+) -> Iterator[np.ndarray]:
+    """
+    Resamples `audio` with a polyphase windowed-sinc filter, yielding `block` output samples at a time.
+    Output samples `up` apart share a filter and are `down` input samples apart, so each filter is applied to a
+    strided view of the input windows with a single matrix-vector product.
+    """
+    g = gcd(orig_sr, target_sr)
+    up, down = target_sr // g, orig_sr // g
+    taps, bank = _filter_bank(up, down, half_width, beta)
+    n_out = -(-audio.shape[0] * up // down)
+
+    for start in range(0, n_out, block):
+        stop = min(start + block, n_out)
+        # Input samples needed by this block, zero-padded beyond the ends of the audio
+        low = start * down // up + int(taps[0])
+        high = (stop - 1) * down // up + int(taps[-1]) + 1
+        segment = np.zeros(high - low, np.float32)
+        segment[max(0, -low) : max(0, min(high, audio.shape[0]) - low)] = audio[max(0, low) : min(high, audio.shape[0])]
+        windows = sliding_window_view(segment, len(taps))
+
+        out = np.empty(stop - start, np.float32)
+        for first in range(start, min(start + up, stop)):
+            count = len(range(first, stop, up))
+            center = first * down // up + int(taps[0]) - low
+            out[first - start :: up] = windows[center :: down][:count] @ bank[first * down % up]
+        yield out
@@ -0,0 +1,123 @@
+"""
+Transcription of many files per request, for the `/asr/batch` endpoint.
+"""
+
+import asyncio
+import io
+import json
+import tarfile
+import zipfile
+from threading import Lock
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, List, NamedTuple
+from urllib.parse import quote
+
+
+class BatchItem(NamedTuple):
+    index: int
+    filename: str
+    # Returns the contents of the file; archive members are read on demand
+    open: Callable[[], BinaryIO]
+
+
+def _archive_members(file: BinaryIO, filename: str) -> List[tuple]:
+    """
+    Lists the files of a zip or tar archive as (name, open) pairs, or returns an empty list if `file` is not one.
+    """
+    # Archives are read by several decode workers; members are read one at a time, as the archive shares one file
+    lock = Lock()
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        archive = zipfile.ZipFile(file)
+
+        def read_zip(info):
+            with lock:
+                return io.BytesIO(archive.read(info))
+
+        return [(f"{filename}/{info.filename}", lambda info=info: read_zip(info))
+                for info in archive.infolist() if not info.is_dir()]
+
+    file.seek(0)
+    if tarfile.is_tarfile(file):
+        file.seek(0)
+        archive = tarfile.open(fileobj=file, mode="r:*")
+
+        def read_tar(member):
+            with lock:
+                return io.BytesIO(archive.extractfile(member).read())
+
+        return [(f"{filename}/{member.name}", lambda member=member: read_tar(member))
+                for member in archive.getmembers() if member.isfile()]
+
+    file.seek(0)
+    return []
+
+
+def expand_uploads(files: List[tuple]) -> List[BatchItem]:
+    """
+    Turns uploaded (filename, file) pairs into the files to transcribe, with zip and tar archives replaced by their
+    members.
+    """
+    items = []
+    for filename, file in files:
+        members = _archive_members(file, filename)
+        for name, open_member in members or [(filename, lambda file=file: file)]:
+            items.append(BatchItem(len(items), name, open_member))
+    return items
+
+
+async def transcribe_batch(
+    items: List[BatchItem],
+    decode: Callable[[BatchItem], Awaitable],
+    transcribe: Callable[[BatchItem, object], Awaitable[str]],
+    prefetch: int,
+) -> AsyncIterator[dict]:
+    """
+    Decodes and transcribes every item, yielding a result for each one as soon as it is done.
+
+    Files are decoded ahead of the model, on the decode pool, while earlier files are being transcribed; at most
+    `prefetch` files are decoded or waiting for the model at once, which bounds the memory held by decoded audio.
+    A file that fails yields an error, without affecting the other files.
+    """
+    results = asyncio.Queue()
+    slots = asyncio.Semaphore(max(1, prefetch))
+
+    async def run(item: BatchItem):
+        async with slots:
+            try:
+                audio = await decode(item)
+                result = {"status": "ok", "result": await transcribe(item, audio)}
+            except Exception as e:
+                result = {"status": "error", "error": str(e)}
+        await results.put({"index": item.index, "filename": item.filename, **result})
+
+    tasks = [asyncio.create_task(run(item)) for item in items]
+    try:
+        for _ in tasks:
+            yield await results.get()
+    finally:
+        # The client went away; files that did not start yet are skipped
+        for task in tasks:
+            task.cancel()
+
+
+async def format_ndjson(results: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for result in results:
+        yield json.dumps(result) + "\n"
+
+
+async def format_multipart(results: AsyncIterator[dict], output: str, boundary: str) -> AsyncIterator[str]:
+    """
+    Formats batch results as the parts of a multipart/mixed response, one part per file.
+    """
+    async for result in results:
+        body = result["result"] if result["status"] == "ok" else result["error"]
+        extension = output if result["status"] == "ok" else "error.txt"
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f'Content-Disposition: attachment; filename="{quote(result["filename"])}.{extension}"\r\n'
+            f"Asr-Index: {result['index']}\r\n"
+            f"Asr-Status: {result['status']}\r\n\r\n"
+            f"{body}\r\n"
+        )
+    yield f"--{boundary}--\r\n"
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Union
+
+import numpy as np
+
+from app.cancellation import RequestCancelled
+from app.config import CONFIG
+from app.scheduling import mark_waiting
+
+
+class TranscriptionCache:
+    """
+    Content-addressed cache of transcription results.
+
+    Results are keyed by a hash of the decoded PCM together with the engine, model, quantization and every
+    transcription option. Entries live in an in-memory LRU tier and, optionally, in an on-disk tier; both are
+    evicted least-recently-used once they exceed their size budget. Concurrent requests for the same key share
+    a single in-flight computation.
+    """
+
+    def __init__(self, memory_size: int, disk_path: Union[str, None] = None, disk_size: int = 0):
+        self.memory_size = memory_size
+        self.disk_path = disk_path
+        self.disk_size = disk_size
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._inflight = {}
+        self._lock = Lock()
+
+        if self.disk_path:
+            os.makedirs(self.disk_path, exist_ok=True)
+            entries = [entry for entry in os.scandir(self.disk_path) if entry.name.endswith(".pkl")]
+            for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+                self._disk[entry.name[:-4]] = entry.stat().st_size
+                self._disk_bytes += entry.stat().st_size
+            self._evict_disk()
+
+    @staticmethod
+    def key(audio: np.ndarray, *parts) -> str:
+        """
+        Computes the cache key of the given audio and transcription parameters.
+        """
+        digest = hashlib.sha256(np.ascontiguousarray(audio, dtype=np.float32))
+        digest.update(json.dumps(parts, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get_or_compute(self, key: str, compute: Callable):
+        """
+        Returns the cached value of `key`, computing and storing it with `compute` on a miss. If the same key is
+        already being computed by another request, waits for that result instead of computing it again.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key][0]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self._inflight[key] = Future()
+        if future is not None:
+            mark_waiting()
+            try:
+                return future.result()
+            except RequestCancelled:
+                # The request computing the value went away; this one computes it instead
+                return self.get_or_compute(key, compute)
+
+        future = self._inflight[key]
+        try:
+            value = self._disk_get(key)
+            with self._lock:
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.disk_hits += 1
+            if value is None:
+                value = compute()
+                self._disk_put(key, value)
+            self._memory_put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            # Removed first, so that waiters retrying after a cancellation do not find the failed computation
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get(self, key: str):
+        """
+        Returns the cached value of `key`, or None if it is in neither tier. Nothing is computed.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key][0]
+        value = self._disk_get(key)
+        if value is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._memory_put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _memory_put(self, key: str, value):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.memory_size:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_size:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _disk_get(self, key: str):
+        if not self.disk_path:
+            return None
+        with self._lock:
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        path = os.path.join(self.disk_path, key + ".pkl")
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+            return value
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+
+    def _disk_put(self, key: str, value):
+        if not self.disk_path:
+            return
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.disk_size:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.disk_path, key + ".pkl"))
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_size and self._disk:
+            evicted, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(os.path.join(self.disk_path, evicted + ".pkl"))
+            except FileNotFoundError:
+                pass
+
+
+transcription_cache = TranscriptionCache(
+    memory_size=CONFIG.CACHE_MEMORY_SIZE * 1024 * 1024,
+    disk_path=CONFIG.CACHE_DIR,
+    disk_size=CONFIG.CACHE_DISK_SIZE * 1024 * 1024,
+)
@@ -0,0 +1,80 @@
+"""
+Cooperative cancellation of requests. The webservice sets a token for every request; engines call `check_cancelled`
+between segments or windows, so that work nobody will read stops at the next checkpoint and releases the model.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Union
+
+DEADLINE_EXCEEDED = "deadline exceeded"
+
+
+class RequestCancelled(Exception):
+    """
+    Raised at a checkpoint of a request whose client disconnected or whose deadline passed.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"The request was cancelled: {reason}.")
+        self.reason = reason
+
+
+class CancellationToken:
+    def __init__(self, timeout: Union[float, None] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = DEADLINE_EXCEEDED
+        return self.reason is not None
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+# Token of the request being processed; copied into the worker threads that run it
+_current_token: ContextVar[Union[CancellationToken, None]] = ContextVar("cancellation_token", default=None)
+
+
+def current_token() -> Union[CancellationToken, None]:
+    return _current_token.get()
+
+
+def check_cancelled():
+    """
+    Raises `RequestCancelled` if the current request was cancelled. Does nothing outside of a request.
+    """
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def checked(items: Iterable) -> Iterator:
+    """
+    Yields the items, checking for cancellation before each one is produced.
+    """
+    check_cancelled()
+    for item in items:
+        yield item
+        check_cancelled()
+
+
+@contextmanager
+def cancellation(token: CancellationToken) -> Iterator[CancellationToken]:
+    """
+    Makes `token` the token of the current request for the duration of the block.
+    """
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
@@ -0,0 +1,139 @@
+"""
+Cascaded transcription: a fast draft model transcribes the whole file, and the requested model only transcribes again
+the spans of the draft that it was unsure of.
+"""
+
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from app.cancellation import check_cancelled
+from app.config import CONFIG
+from app.metrics import CASCADE_ESCALATED
+from app.transcript import segment_dict
+from app.vad import SpeechMap, restore_timestamps
+
+# Engines whose segments carry the decoding scores the cascade relies on
+CASCADE_ENGINES = ("openai_whisper", "faster_whisper", "stub")
+
+
+def cascade_parameters() -> tuple:
+    """
+    Returns the settings a cascaded transcription depends on, which are part of its cache key.
+    """
+    return (
+        CONFIG.CASCADE_DRAFT_MODEL,
+        CONFIG.CASCADE_LOGPROB_THRESHOLD,
+        CONFIG.CASCADE_COMPRESSION_RATIO_THRESHOLD,
+        CONFIG.CASCADE_NO_SPEECH_THRESHOLD,
+        CONFIG.CASCADE_PAD_SECONDS,
+    )
+
+
+def is_uncertain(segment: dict) -> bool:
+    """
+    Returns whether the draft of a segment is likely wrong: a low average log probability, repetitive text, or text
+    decoded from what the model considers silence.
+    """
+    return (
+        segment.get("avg_logprob", 0.0) < CONFIG.CASCADE_LOGPROB_THRESHOLD
+        or segment.get("compression_ratio", 0.0) > CONFIG.CASCADE_COMPRESSION_RATIO_THRESHOLD
+        or segment.get("no_speech_prob", 0.0) > CONFIG.CASCADE_NO_SPEECH_THRESHOLD
+    )
+
+
+def escalated_spans(segments: List[dict], duration: float, pad: float) -> List[Tuple[float, float, int, int]]:
+    """
+    Returns the spans to transcribe again as (start, end, first, last) tuples, where segments `first` to `last - 1`
+    of the draft are replaced. Consecutive uncertain segments form a single span, which is padded by up to `pad`
+    seconds into the silence around it, but never into the confident segments that are kept.
+    """
+    spans = []
+    i = 0
+    while i < len(segments):
+        if not is_uncertain(segments[i]):
+            i += 1
+            continue
+        first = i
+        while i < len(segments) and is_uncertain(segments[i]):
+            i += 1
+        previous_end = segments[first - 1]["end"] if first > 0 else 0.0
+        next_start = segments[i]["start"] if i < len(segments) else duration
+        start = max(segments[first]["start"] - pad, min(previous_end, segments[first]["start"]))
+        end = min(segments[i - 1]["end"] + pad, max(next_start, segments[i - 1]["end"]), duration)
+        if end > start:
+            spans.append((start, end, first, i))
+    return spans
+
+
+def _shift(result: dict, start: float, end: float) -> List[dict]:
+    """
+    Moves the segments of a span transcription to the time of the span in the file.
+    """
+    segments = [segment_dict(segment) for segment in result["segments"]]
+    shifted = restore_timestamps(dict(result, segments=segments), SpeechMap(np.zeros(1), np.array([start])))
+    for segment in shifted["segments"]:
+        segment["start"] = min(segment["start"], end)
+        segment["end"] = min(segment["end"], end)
+        if "seek" in segment:
+            segment["seek"] += round(start * 100)
+    return shifted["segments"]
+
+
+def transcribe_cascade(
+    model_pool,
+    draft: str,
+    model: Union[str, None],
+    audio: np.ndarray,
+    task: Union[str, None],
+    language: Union[str, None],
+    initial_prompt: Union[str, None],
+    vad_filter: Union[bool, None],
+    word_timestamps: Union[bool, None],
+    options: Union[dict, None],
+) -> dict:
+    """
+    Transcribes `audio` with the `draft` model, and the uncertain spans of the draft again with `model`. Returns the
+    merged result, with the fraction of the audio that was transcribed again in `escalated`.
+    """
+    duration = audio.shape[0] / CONFIG.SAMPLE_RATE
+    with model_pool.acquire(draft) as draft_model:
+        result = draft_model.transcribe_audio(audio, task, language, initial_prompt, vad_filter, word_timestamps, options)
+    segments = [segment_dict(segment) for segment in result["segments"]]
+    # Spans are too short for a reliable language detection, so they keep the language of the draft
+    language = language or result.get("language")
+
+    spans = escalated_spans(segments, duration, CONFIG.CASCADE_PAD_SECONDS)
+    merged = []
+    kept = 0
+    if spans:
+        # The requested model is only loaded if the draft has uncertain spans
+        with model_pool.acquire(model) as asr_model:
+            for start, end, first, last in spans:
+                check_cancelled()
+                merged.extend(segments[kept:first])
+                # The draft of the preceding segment stands in for the text the model would have conditioned on
+                previous = segments[first - 1]["text"].strip() if first else None
+                span = asr_model.transcribe_audio(
+                    audio[round(start * CONFIG.SAMPLE_RATE) : round(end * CONFIG.SAMPLE_RATE)],
+                    task,
+                    language,
+                    " ".join(filter(None, [initial_prompt, previous])) or None,
+                    vad_filter,
+                    word_timestamps,
+                    options,
+                )
+                merged.extend(_shift(span, start, end))
+                kept = last
+    merged.extend(segments[kept:])
+
+    for i, segment in enumerate(merged):
+        segment["id"] = i
+    fraction = sum(end - start for start, end, _, _ in spans) / duration if duration > 0 else 0.0
+    CASCADE_ESCALATED.observe(fraction)
+    return {
+        "text": "".join(segment["text"] for segment in merged),
+        "segments": merged,
+        "language": language,
+        "escalated": fraction,
+    }
@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import is_dataclass, replace
+from typing import Callable, List, Tuple, Union
+
+import numpy as np
+
+from app.cancellation import check_cancelled
+from app.config import CONFIG
+
+# ASR model of the current worker process, created by `_init_worker`
+_worker_model = None
+
+
+def split_at_silence(
+    audio: np.ndarray,
+    chunk_seconds: float,
+    sr: int = CONFIG.SAMPLE_RATE,
+    search_seconds: float = 5.0,
+    frame_seconds: float = 0.02,
+) -> List[Tuple[int, int]]:
+    """
+    Splits audio into chunks of roughly `chunk_seconds`, moving every boundary to the quietest frame within
+    `search_seconds` of it, so that chunks do not cut through words.
+    Returns a list of (start, end) sample offsets.
+    """
+    frame = int(frame_seconds * sr)
+    n_frames = audio.shape[0] // frame
+    if n_frames == 0 or audio.shape[0] <= chunk_seconds * sr:
+        return [(0, audio.shape[0])]
+
+    energy = np.sqrt(np.mean(np.square(audio[: n_frames * frame].reshape(n_frames, frame)), axis=1))
+    chunk_frames = int(chunk_seconds / frame_seconds)
+    search_frames = int(search_seconds / frame_seconds)
+
+    boundaries = [0]
+    target = chunk_frames
+    while target < n_frames - search_frames:
+        low = max(boundaries[-1] + 1, target - search_frames)
+        high = min(n_frames, target + search_frames)
+        boundary = low + int(np.argmin(energy[low:high]))
+        boundaries.append(boundary)
+        target = boundary + chunk_frames
+
+    starts = [boundary * frame for boundary in boundaries]
+    return list(zip(starts, starts[1:] + [audio.shape[0]], strict=True))
+
+
+def _init_worker(cpu_threads: int, engine: str, model_name: str, quantization: str):
+    global _worker_model
+    from app.factory.asr_model_factory import ASRModelFactory
+
+    CONFIG.CPU_THREADS = cpu_threads
+    _worker_model = ASRModelFactory.create_asr_model(engine, model_name, quantization)
+    _worker_model.load_model()
+
+
+def _transcribe_chunk(path: str, length: int, start: int, end: int, params: dict) -> dict:
+    audio = np.array(np.memmap(path, dtype=np.float32, mode="r", shape=(length,))[start:end])
+    return _worker_model.transcribe_result(audio, **params)
+
+
+def _shift_segment(segment, offset: float, segment_id: int):
+    # `seek` counts mel frames of 10 ms from the start of the audio
+    seek_offset = round(offset * 100)
+    if is_dataclass(segment):
+        words = segment.words and [
+            replace(word, start=word.start + offset, end=word.end + offset) for word in segment.words
+        ]
+        return replace(
+            segment,
+            id=segment_id,
+            seek=segment.seek + seek_offset,
+            start=segment.start + offset,
+            end=segment.end + offset,
+            words=words,
+        )
+
+    segment = dict(segment, id=segment_id, start=segment["start"] + offset, end=segment["end"] + offset)
+    if "seek" in segment:
+        segment["seek"] += seek_offset
+    if segment.get("words"):
+        segment["words"] = [
+            dict(word, start=word["start"] + offset, end=word["end"] + offset) for word in segment["words"]
+        ]
+    return segment
+
+
+def stitch_results(results: List[Tuple[float, dict]]) -> dict:
+    """
+    Joins the results of consecutive chunks, given as (offset in seconds, result) pairs, into a single result
+    with timestamps relative to the start of the whole audio.
+    """
+    results = sorted(results, key=lambda item: item[0])
+    segments = []
+    text = ""
+    for offset, result in results:
+        for segment in result["segments"]:
+            segments.append(_shift_segment(segment, offset, len(segments)))
+        text = text + result["text"]
+    return {"language": results[0][1]["language"] if results else None, "segments": segments, "text": text}
+
+
+class ParallelTranscriber:
+    """
+    Transcribes long audio by splitting it at silence and decoding the chunks in parallel worker processes,
+    each with its own model instance and `cpu_threads` budget.
+    """
+
+    def __init__(self, workers: int, chunk_seconds: float, cpu_threads: int, model_spec: Tuple[str, str, str]):
+        self.workers = workers
+        self.chunk_seconds = chunk_seconds
+        self.cpu_threads = cpu_threads
+        self.model_spec = model_spec
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Models are loaded lazily in the workers; spawn avoids inheriting the threads of the parent model
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.cpu_threads, *self.model_spec),
+            )
+        return self._pool
+
+    def shutdown(self):
+        """
+        Stops the worker processes, and the copies of the model they hold. They are started again on next use.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def should_split(self, audio: np.ndarray) -> bool:
+        return audio.shape[0] > 2 * self.chunk_seconds * CONFIG.SAMPLE_RATE
+
+    def transcribe(
+        self,
+        audio: np.ndarray,
+        params: dict,
+        progress: Union[Callable[[float], None], None] = None,
+    ) -> dict:
+        """
+        Transcribes `audio` with the given `transcribe_result` parameters. The language should be set in `params`,
+        otherwise it is detected separately for every chunk.
+        """
+        chunks = split_at_silence(audio, self.chunk_seconds)
+
+        # Workers read their chunk from a memory-mapped copy of the audio instead of receiving it pickled
+        fd, path = tempfile.mkstemp(dir=CONFIG.AUDIO_SPOOL_DIR, suffix=".pcm")
+        futures = {}
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.ascontiguousarray(audio, dtype=np.float32).tofile(f)
+            futures = {
+                self.pool.submit(_transcribe_chunk, path, audio.shape[0], start, end, params): (start, end)
+                for start, end in chunks
+            }
+            results = []
+            processed = 0.0
+            pending = set(futures)
+            while pending:
+                # Chunks are long; the request is checked for cancellation while they are transcribed
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = futures[future]
+                    results.append((start / CONFIG.SAMPLE_RATE, future.result()))
+                    processed += (end - start) / CONFIG.SAMPLE_RATE
+                    if progress is not None:
+                        progress(processed)
+                check_cancelled()
+        finally:
+            # Chunks that did not start yet are dropped if the request failed or was cancelled
+            for future in futures:
+                future.cancel()
+            os.remove(path)
+
+        return stitch_results(results)
+
+
+def create_parallel_transcriber(engine: str, model_name: str, quantization: str) -> Union[ParallelTranscriber, None]:
+    if CONFIG.PARALLEL_CHUNK_WORKERS <= 0:
+        return None
+    cpu_threads = CONFIG.PARALLEL_CHUNK_THREADS or max(1, (os.cpu_count() or 1) // CONFIG.PARALLEL_CHUNK_WORKERS)
+    return ParallelTranscriber(
+        CONFIG.PARALLEL_CHUNK_WORKERS,
+        CONFIG.PARALLEL_CHUNK_SECONDS,
+        cpu_threads,
+        (engine, model_name, quantization),
+    )
@@ -1,6 +1,19 @@
 import os
 
-import torch
+
+def _cuda_available(engine: str) -> bool:
+    """
+    Checks whether a CUDA device is available, without importing torch when the engine does not need it.
+    """
+    if engine == "stub":
+        return False
+    if engine == "faster_whisper":
+        import ctranslate2
+
+        return ctranslate2.get_cuda_device_count() > 0
+    import torch
+
+    return torch.cuda.is_available()
 
 
 class CONFIG:
@@ -8,7 +21,7 @@ class CONFIG:
     Configuration class for ASR models.
     Reads environment variables for runtime configuration, with sensible defaults.
     """
-    # Determine the ASR engine ('faster_whisper', 'openai_whisper' or 'whisperx')
+    # Determine the ASR engine ('faster_whisper', 'openai_whisper', 'whisperx' or 'stub')
     ASR_ENGINE = os.getenv("ASR_ENGINE", "openai_whisper")
 
     # Retrieve Huggingface Token
@@ -17,7 +30,7 @@ class CONFIG:
         print("You must set the HF_TOKEN environment variable to download the diarization model used by WhisperX.")
 
     # Determine the computation device (GPU or CPU)
-    DEVICE = os.getenv("ASR_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
+    DEVICE = os.getenv("ASR_DEVICE") or ("cuda" if _cuda_available(ASR_ENGINE) else "cpu")
 
     # Model name to use (e.g., "base", "small", etc.)
     MODEL_NAME = os.getenv("ASR_MODEL", "base")
@@ -30,7 +43,7 @@ class CONFIG:
     #   'float16' - 16-bit floating-point precision (lower precision, faster inference)
     #   'int8' - 8-bit integer precision (lowest precision, fastest inference)
     # Defaults to 'float32' for GPU availability, 'int8' for CPU.
-    MODEL_QUANTIZATION = os.getenv("ASR_QUANTIZATION", "float32" if torch.cuda.is_available() else "int8")
+    MODEL_QUANTIZATION = os.getenv("ASR_QUANTIZATION") or ("float32" if _cuda_available(ASR_ENGINE) else "int8")
     if MODEL_QUANTIZATION not in {"float32", "float16", "int8"}:
         raise ValueError("Invalid MODEL_QUANTIZATION. Choose 'float32', 'float16', or 'int8'.")
 
@@ -38,6 +51,15 @@ class CONFIG:
     # after being idle for this many seconds. A value of 0 means the model will never be unloaded.
     MODEL_IDLE_TIMEOUT = int(os.getenv("MODEL_IDLE_TIMEOUT", 0))
 
+    # Idle offload tiers, in seconds (0 disables a tier). After MODEL_OFFLOAD_TIMEOUT, GPU weights are moved to
+    # (pinned) CPU memory; after MODEL_SNAPSHOT_TIMEOUT, they are freed and mapped back from an on-disk copy in
+    # MODEL_SNAPSHOT_DIR when needed. The model is moved back to the device on the next request.
+    MODEL_OFFLOAD_TIMEOUT = int(os.getenv("MODEL_OFFLOAD_TIMEOUT", 0))
+    MODEL_SNAPSHOT_TIMEOUT = int(os.getenv("MODEL_SNAPSHOT_TIMEOUT", 0))
+    MODEL_SNAPSHOT_DIR = os.getenv(
+        "MODEL_SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".cache", "whisper-asr-webservice", "snapshots")
+    )
+
     # Default sample rate for audio input. 16 kHz is commonly used in speech-to-text tasks.
     SAMPLE_RATE = int(os.getenv("SAMPLE_RATE", 16000))
 
@@ -45,3 +67,134 @@ class CONFIG:
     SUBTITLE_MAX_LINE_WIDTH = int(os.getenv("SUBTITLE_MAX_LINE_WIDTH", 1000))
     SUBTITLE_MAX_LINE_COUNT = int(os.getenv("SUBTITLE_MAX_LINE_COUNT", 2))
     SUBTITLE_HIGHLIGHT_WORDS = os.getenv("SUBTITLE_HIGHLIGHT_WORDS", "false").lower() == "true"
+
+    # Worker pools for audio decoding and model inference. Decoding and inference run off the event loop,
+    # so the webservice stays responsive while a long file is being transcribed.
+    DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", 2))
+    INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 1))
+
+    # Number of requests allowed to wait for a free inference worker. Requests beyond this limit are
+    # rejected with 503 and a Retry-After header (in seconds) so a load balancer can route around the node.
+    MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", 16))
+    QUEUE_RETRY_AFTER = int(os.getenv("QUEUE_RETRY_AFTER", 30))
+
+    # Default deadline of a transcription in seconds, after which it is aborted at the next segment or window and
+    # answered with 504. Requests can set a shorter or longer one with `timeout`. 0 means no deadline.
+    REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 0))
+
+    # Scheduling of the requests waiting for a model. Requests are served in order of arrival time, delayed by
+    # SCHEDULER_PRIORITY_STEP seconds for every priority class below `high` and by SCHEDULER_DURATION_WEIGHT seconds
+    # for every second of audio. With SCHEDULER_PREEMPT, a long transcription gives the model up between windows to
+    # a waiting request that comes first.
+    SCHEDULER_PRIORITY_STEP = float(os.getenv("SCHEDULER_PRIORITY_STEP", 60))
+    SCHEDULER_DURATION_WEIGHT = float(os.getenv("SCHEDULER_DURATION_WEIGHT", 0.1))
+    SCHEDULER_PREEMPT = os.getenv("SCHEDULER_PREEMPT", "false").lower() == "true"
+
+    # Audio decoding. Uploads are streamed through ffmpeg in chunks of AUDIO_CHUNK_SIZE bytes. Decoded audio
+    # larger than AUDIO_MEMORY_LIMIT (in MB, 0 disables the limit) is spilled to a memory-mapped temporary file
+    # in AUDIO_SPOOL_DIR (defaults to the system temporary directory).
+    AUDIO_CHUNK_SIZE = int(os.getenv("AUDIO_CHUNK_SIZE", 1024 * 1024))
+    AUDIO_MEMORY_LIMIT = int(os.getenv("AUDIO_MEMORY_LIMIT", 512))
+    AUDIO_SPOOL_DIR = os.getenv("AUDIO_SPOOL_DIR") or None
+
+    # Transcription result cache. Results are keyed by a hash of the decoded audio, the engine, model,
+    # quantization and transcription options. CACHE_MEMORY_SIZE and CACHE_DISK_SIZE are in MB;
+    # the on-disk tier is only used when CACHE_DIR is set.
+    CACHE_MEMORY_SIZE = int(os.getenv("CACHE_MEMORY_SIZE", 64))
+    CACHE_DIR = os.getenv("CACHE_DIR") or None
+    CACHE_DISK_SIZE = int(os.getenv("CACHE_DISK_SIZE", 1024))
+
+    # Dynamic micro-batching for faster_whisper. When FASTER_WHISPER_BATCH_SIZE is greater than 0, 30-second
+    # windows of concurrent requests are collected for up to FASTER_WHISPER_BATCH_WAIT_MS milliseconds and
+    # decoded together in batches of up to FASTER_WHISPER_BATCH_SIZE windows.
+    FASTER_WHISPER_BATCH_SIZE = int(os.getenv("FASTER_WHISPER_BATCH_SIZE", 0))
+    FASTER_WHISPER_BATCH_WAIT_MS = int(os.getenv("FASTER_WHISPER_BATCH_WAIT_MS", 10))
+
+    # Asynchronous jobs. Uploads, results and the job database are stored in JOBS_DIR; finished jobs
+    # are removed JOBS_TTL seconds after they completed.
+    JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.expanduser("~"), ".cache", "whisper-asr-webservice", "jobs"))
+    JOBS_TTL = int(os.getenv("JOBS_TTL", 86400))
+
+    # Batch transcription. At most BATCH_PREFETCH files of a batch are decoded ahead of, or being transcribed by,
+    # the model at once.
+    BATCH_PREFETCH = int(os.getenv("BATCH_PREFETCH", 8))
+
+    # Stub engine, for benchmarks without model weights. Every STUB_SEGMENT_SECONDS of audio yields one segment,
+    # which takes STUB_REAL_TIME_FACTOR times its duration to produce.
+    STUB_SEGMENT_SECONDS = float(os.getenv("STUB_SEGMENT_SECONDS", 5))
+    STUB_REAL_TIME_FACTOR = float(os.getenv("STUB_REAL_TIME_FACTOR", 0))
+
+    # Streaming transcription over WebSocket. The buffered audio of a stream is transcribed again every
+    # STREAM_STEP_SECONDS of new audio; audio that has been committed is dropped from the buffer once it is longer
+    # than STREAM_BUFFER_SECONDS.
+    STREAM_STEP_SECONDS = float(os.getenv("STREAM_STEP_SECONDS", 1.0))
+    STREAM_BUFFER_SECONDS = float(os.getenv("STREAM_BUFFER_SECONDS", 15))
+
+    # Number of 30-second windows, spread evenly across the file, whose language probabilities are averaged by
+    # /detect-language with faster_whisper. 1 only looks at the beginning of the file.
+    LANGUAGE_DETECTION_WINDOWS = int(os.getenv("LANGUAGE_DETECTION_WINDOWS", 1))
+
+    # Number of CPU threads used by the model. 0 uses the default of the engine.
+    CPU_THREADS = int(os.getenv("CPU_THREADS", 0))
+
+    # Modules of the openai_whisper model compiled with torch.compile, as a comma-separated list of `encoder` and
+    # `decoder`. Compilation happens on the first transcription and makes it slower; later ones run faster.
+    OPENAI_WHISPER_COMPILE = [
+        name.strip() for name in os.getenv("OPENAI_WHISPER_COMPILE", "").split(",") if name.strip()
+    ]
+    if set(OPENAI_WHISPER_COMPILE) - {"encoder", "decoder"}:
+        raise ValueError("Invalid OPENAI_WHISPER_COMPILE. Choose 'encoder', 'decoder', or both.")
+
+    # Multi-process serving. WORKERS processes share the listening socket, each with its own model pinned to
+    # WORKER_THREADS cores (0 divides the available cores between the workers). 'auto' starts one worker per
+    # 4 cores on CPU hosts and a single worker on GPU hosts. WORKER_INDEX is set by the supervisor in every worker.
+    WORKERS = os.getenv("WORKERS", "1")
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", 0))
+    WORKER_INDEX = os.getenv("WORKER_INDEX")
+
+    # Load the openai_whisper weights memory-mapped from a snapshot in MODEL_SNAPSHOT_DIR, so that processes
+    # serving the same model share one copy of them. Enabled by the supervisor when WORKERS is greater than 1.
+    MODEL_SHARED_WEIGHTS = os.getenv("MODEL_SHARED_WEIGHTS", "false").lower() == "true"
+
+    # Parallel chunked transcription (openai_whisper and faster_whisper). When PARALLEL_CHUNK_WORKERS is greater
+    # than 0, audio longer than two chunks is split at silence into chunks of about PARALLEL_CHUNK_SECONDS, which
+    # are transcribed in that many worker processes, each using PARALLEL_CHUNK_THREADS CPU threads
+    # (0 divides the available cores between the workers).
+    PARALLEL_CHUNK_WORKERS = int(os.getenv("PARALLEL_CHUNK_WORKERS", 0))
+    PARALLEL_CHUNK_SECONDS = int(os.getenv("PARALLEL_CHUNK_SECONDS", 300))
+    PARALLEL_CHUNK_THREADS = int(os.getenv("PARALLEL_CHUNK_THREADS", 0))
+
+    # Silence trimming applied with `vad_filter` by the engines without their own voice activity detection. Frames
+    # louder than VAD_THRESHOLD_DB above the noise floor are speech; silences shorter than VAD_MIN_SILENCE_SECONDS
+    # are kept, and VAD_SPEECH_PAD_SECONDS of audio are kept around every speech span.
+    VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", 15))
+    VAD_MIN_SILENCE_SECONDS = float(os.getenv("VAD_MIN_SILENCE_SECONDS", 1.0))
+    VAD_SPEECH_PAD_SECONDS = float(os.getenv("VAD_SPEECH_PAD_SECONDS", 0.2))
+
+    # Additional models that requests can select with the `model` parameter, as a comma-separated list of
+    # `[engine:]model[:quantization]` (e.g. "large-v3,faster_whisper:small:int8"). Models are loaded on first use;
+    # when MODEL_MEMORY_BUDGET (in MB, 0 means unlimited) would be exceeded, the least recently used idle models
+    # are unloaded first.
+    MODEL_POOL = [name.strip() for name in os.getenv("MODEL_POOL", "").split(",") if name.strip()]
+    MODEL_MEMORY_BUDGET = int(os.getenv("MODEL_MEMORY_BUDGET", 0))
+
+    # Cascaded transcription (openai_whisper and faster_whisper). Requests with `cascade` are transcribed with
+    # CASCADE_DRAFT_MODEL, given like MODEL_POOL entries, and only the segments whose avg_logprob is below
+    # CASCADE_LOGPROB_THRESHOLD, or whose compression_ratio or no_speech_prob is above CASCADE_COMPRESSION_RATIO_THRESHOLD
+    # or CASCADE_NO_SPEECH_THRESHOLD, are transcribed again with the requested model, with up to CASCADE_PAD_SECONDS
+    # of the surrounding silence. CASCADE_DEFAULT is the default of `cascade`.
+    CASCADE_DRAFT_MODEL = os.getenv("CASCADE_DRAFT_MODEL", "")
+    CASCADE_DEFAULT = os.getenv("CASCADE_DEFAULT", "false").lower() == "true"
+    CASCADE_LOGPROB_THRESHOLD = float(os.getenv("CASCADE_LOGPROB_THRESHOLD", -0.6))
+    CASCADE_COMPRESSION_RATIO_THRESHOLD = float(os.getenv("CASCADE_COMPRESSION_RATIO_THRESHOLD", 2.0))
+    CASCADE_NO_SPEECH_THRESHOLD = float(os.getenv("CASCADE_NO_SPEECH_THRESHOLD", 0.6))
+    CASCADE_PAD_SECONDS = float(os.getenv("CASCADE_PAD_SECONDS", 0.5))
+
+    # WhisperX alignment models. At most WHISPERX_ALIGN_CACHE_SIZE models, and WHISPERX_ALIGN_CACHE_MB MB of weights
+    # (0 means unlimited), are kept on the device; up to WHISPERX_ALIGN_OFFLOAD_SIZE least recently used models are
+    # moved to CPU memory instead of being unloaded. WHISPERX_ALIGN_PRELOAD is a comma-separated list of languages
+    # whose alignment models are loaded at startup.
+    WHISPERX_ALIGN_CACHE_SIZE = int(os.getenv("WHISPERX_ALIGN_CACHE_SIZE", 4))
+    WHISPERX_ALIGN_CACHE_MB = int(os.getenv("WHISPERX_ALIGN_CACHE_MB", 0))
+    WHISPERX_ALIGN_OFFLOAD_SIZE = int(os.getenv("WHISPERX_ALIGN_OFFLOAD_SIZE", 4))
+    WHISPERX_ALIGN_PRELOAD = [lang.strip() for lang in os.getenv("WHISPERX_ALIGN_PRELOAD", "").split(",") if lang.strip()]
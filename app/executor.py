@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from threading import Event, Lock
+from typing import Union
+
+from app.config import CONFIG
+from app.scheduling import current_job, handed_over
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a request cannot be admitted because the inference queue is full.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("The inference queue is full, retry later.")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Runs the blocking audio decoding and model inference calls off the event loop.
+
+    Audio decoding and inference use separate thread pools, so an upload can be decoded while the model
+    is busy with another request. Inference calls waiting for a free worker are started in the order of the rank of
+    their job, like the model lock, rather than in order of arrival. At most `inference_workers + max_queue_size` requests are admitted at
+    once; any request beyond that is rejected with `QueueFullError` instead of waiting on the model lock.
+    """
+
+    def __init__(self, decode_workers: int, inference_workers: int, max_queue_size: int, retry_after: int):
+        self.decode_pool = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="asr-decode")
+        self.inference_pool = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="asr-inference")
+        # Runs the calls that preempted transcriptions hand over, at most one per inference worker
+        self.preemption_pool = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="asr-preemption")
+        self.capacity = inference_workers + max_queue_size
+        self.retry_after = retry_after
+        self.admitted = 0
+        self._lock = Lock()
+        self._pending = []
+        self._sequence = itertools.count()
+
+    def try_admit(self) -> bool:
+        """
+        Reserves a slot in the queue. Returns False if the queue is full.
+        """
+        with self._lock:
+            if self.admitted >= self.capacity:
+                return False
+            self.admitted += 1
+            return True
+
+    def release(self):
+        """
+        Releases a slot previously reserved with `try_admit`.
+        """
+        with self._lock:
+            self.admitted -= 1
+
+    @contextmanager
+    def admit(self):
+        """
+        Holds a queue slot for the duration of the block, raising `QueueFullError` if none is free.
+        """
+        if not self.try_admit():
+            raise QueueFullError(self.retry_after)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def decode(self, func, *args, **kwargs):
+        """
+        Runs an audio decoding call on the decode pool.
+        """
+        return await self._run(self.decode_pool, func, *args, **kwargs)
+
+    async def infer(self, func, *args, **kwargs):
+        """
+        Runs a model inference call on the inference pool.
+        """
+        context = contextvars.copy_context()
+        future = Future()
+        with self._lock:
+            rank = context.run(current_job).rank()
+            heapq.heappush(self._pending, (rank, next(self._sequence), context, partial(func, *args, **kwargs), future))
+        # Every submitted task runs whichever pending call comes first when a worker becomes free, unless a preempted
+        # transcription has handed it over to a spare worker already
+        self.inference_pool.submit(self._run_next)
+        return await asyncio.wrap_future(future)
+
+    def hand_over(self, before: float) -> Union[Event, None]:
+        """
+        Starts the first pending inference call on a spare worker if it ranks before `before`, for a transcription
+        that gives up the model while it occupies the worker the call is waiting for. Returns an event that is set
+        once the call waits for a model or for a result computed by another call, or has finished; or None if no
+        pending call ranks first.
+        """
+        with self._lock:
+            if not self._pending or self._pending[0][0] >= before:
+                return None
+            _, _, context, call, future = heapq.heappop(self._pending)
+        settled = Event()
+        self.preemption_pool.submit(self._run_handed_over, context, call, future, settled)
+        return settled
+
+    def _run_next(self):
+        with self._lock:
+            if not self._pending:
+                # Handed over to a spare worker
+                return
+            _, _, context, call, future = heapq.heappop(self._pending)
+        self._call(context, call, future)
+
+    def _run_handed_over(self, context: contextvars.Context, call, future: Future, settled: Event):
+        def run():
+            with handed_over(settled):
+                return call()
+
+        try:
+            self._call(context, run, future)
+        finally:
+            settled.set()
+
+    @staticmethod
+    def _call(context: contextvars.Context, call, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(call))
+        except BaseException as e:
+            future.set_exception(e)
+
+    @staticmethod
+    async def _run(pool: ThreadPoolExecutor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # The call sees the context variables of the request, such as its cancellation token
+        return await loop.run_in_executor(pool, contextvars.copy_context().run, partial(func, *args, **kwargs))
+
+
+executor = InferenceExecutor(
+    decode_workers=CONFIG.DECODE_WORKERS,
+    inference_workers=CONFIG.INFERENCE_WORKERS,
+    max_queue_size=CONFIG.MAX_QUEUE_SIZE,
+    retry_after=CONFIG.QUEUE_RETRY_AFTER,
+)
@@ -1,18 +1,197 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator, List, NamedTuple, Union
+
 from app.asr_models.asr_model import ASRModel
-from app.asr_models.faster_whisper_engine import FasterWhisperASR
-from app.asr_models.mbain_whisperx_engine import WhisperXASR
-from app.asr_models.openai_whisper_engine import OpenAIWhisperASR
 from app.config import CONFIG
 
+# Approximate number of parameters, in millions, of the standard models
+MODEL_PARAMETERS = {
+    "tiny": 39,
+    "base": 74,
+    "small": 244,
+    "medium": 769,
+    "large": 1550,
+    "turbo": 809,
+    "distil-small": 166,
+    "distil-medium": 394,
+    "distil-large": 756,
+}
+
+BYTES_PER_PARAMETER = {"float32": 4, "float16": 2, "int8": 1}
+
 
 class ASRModelFactory:
     @staticmethod
-    def create_asr_model() -> ASRModel:
-        if CONFIG.ASR_ENGINE == "openai_whisper":
-            return OpenAIWhisperASR()
-        elif CONFIG.ASR_ENGINE == "faster_whisper":
-            return FasterWhisperASR()
-        elif CONFIG.ASR_ENGINE == "whisperx":
-            return WhisperXASR()
+    def create_asr_model(
+        engine: Union[str, None] = None,
+        model_name: Union[str, None] = None,
+        quantization: Union[str, None] = None,
+    ) -> ASRModel:
+        engine = engine or CONFIG.ASR_ENGINE
+        # Engines are imported on demand, so only the libraries of the engines in use are loaded
+        if engine == "openai_whisper":
+            from app.asr_models.openai_whisper_engine import OpenAIWhisperASR
+
+            return OpenAIWhisperASR(model_name, quantization)
+        elif engine == "faster_whisper":
+            from app.asr_models.faster_whisper_engine import FasterWhisperASR
+
+            return FasterWhisperASR(model_name, quantization)
+        elif engine == "whisperx":
+            from app.asr_models.mbain_whisperx_engine import WhisperXASR
+
+            return WhisperXASR(model_name, quantization)
+        elif engine == "stub":
+            from app.asr_models.stub_engine import StubASR
+
+            return StubASR(model_name, quantization)
         else:
-            raise ValueError(f"Unsupported ASR engine: {CONFIG.ASR_ENGINE}")
+            raise ValueError(f"Unsupported ASR engine: {engine}")
+
+
+class ModelSpec(NamedTuple):
+    engine: str
+    model_name: str
+    quantization: str
+
+    @classmethod
+    def parse(cls, spec: str) -> "ModelSpec":
+        """
+        Parses a model specification of the form `[engine:]model[:quantization]`, defaulting to the configured
+        engine and quantization.
+        """
+        parts = spec.split(":")
+        engine = None
+        quantization = None
+        if len(parts) > 1 and parts[0] in ("openai_whisper", "faster_whisper", "whisperx", "stub"):
+            engine = parts.pop(0)
+        if len(parts) > 1 and parts[-1] in BYTES_PER_PARAMETER:
+            quantization = parts.pop()
+        return cls(engine or CONFIG.ASR_ENGINE, ":".join(parts), quantization or CONFIG.MODEL_QUANTIZATION)
+
+    def estimated_size(self) -> int:
+        """
+        Returns the approximate memory used by the model weights, in bytes.
+        """
+        name = self.model_name.split("/")[-1].removesuffix(".en")
+        parameters = max(
+            (count for prefix, count in MODEL_PARAMETERS.items() if name.startswith(prefix)),
+            default=MODEL_PARAMETERS["large"],
+        )
+        return parameters * 1_000_000 * BYTES_PER_PARAMETER[self.quantization]
+
+
+class ASRModelPool:
+    """
+    Pool of ASR models selected per request by name.
+
+    Models are created and loaded on first use. When loading a model would exceed the memory budget, the least
+    recently used models that are not serving a request are released first.
+    """
+
+    def __init__(self, names: List[str], memory_budget: int = 0):
+        self.names = names
+        self.memory_budget = memory_budget
+        self._models = dict.fromkeys(names)
+        self._loaded = OrderedDict()
+        self._in_use = dict.fromkeys(names, 0)
+        self._lock = Lock()
+
+    def instance(self, name: Union[str, None] = None) -> ASRModel:
+        """
+        Returns the model instance registered under `name`, without loading it.
+        """
+        name = name or self.names[0]
+        if name not in self._models:
+            raise ValueError(f"Unknown model: {name}")
+        with self._lock:
+            if self._models[name] is None:
+                self._models[name] = ASRModelFactory.create_asr_model(*ModelSpec.parse(name))
+            return self._models[name]
+
+    @contextmanager
+    def acquire(self, name: Union[str, None] = None) -> Iterator[ASRModel]:
+        """
+        Loads the model registered under `name` if needed and keeps it from being evicted while in use.
+        """
+        name = name or self.names[0]
+        asr_model = self.instance(name)
+        with self._lock:
+            self._in_use[name] += 1
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                loaded = True
+            else:
+                loaded = False
+        try:
+            if not loaded:
+                self._load(name, asr_model)
+            with asr_model.session():
+                yield asr_model
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+
+    def preload(self, name: Union[str, None] = None):
+        """
+        Loads the model registered under `name` ahead of the first request.
+        """
+        with self.acquire(name):
+            pass
+
+    def warmup(self, name: Union[str, None] = None):
+        """
+        Loads the model registered under `name` and runs a dummy transcription with it.
+        """
+        with self.acquire(name) as asr_model:
+            asr_model.warmup()
+
+    def _load(self, name: str, asr_model: ASRModel):
+        size = ModelSpec.parse(name).estimated_size()
+        if asr_model.parallel_transcriber is not None:
+            # Every worker process of parallel transcription loads its own copy of the model
+            size *= 1 + asr_model.parallel_transcriber.workers
+        with self._lock:
+            if name in self._loaded:
+                return
+            evicted = []
+            if self.memory_budget > 0:
+                used = sum(self._loaded.values())
+                for candidate in list(self._loaded):
+                    if used + size <= self.memory_budget:
+                        break
+                    if self._idle(candidate):
+                        used -= self._loaded.pop(candidate)
+                        evicted.append(candidate)
+            self._loaded[name] = size
+
+        for candidate in evicted:
+            evicted_model = self._models[candidate]
+            with evicted_model.model_lock:
+                with self._lock:
+                    # A request may have acquired the model since it was chosen; it is then loaded again instead
+                    idle = self._idle(candidate) and candidate not in self._loaded
+                if idle and evicted_model.model is not None:
+                    evicted_model.release_model()
+        asr_model.ensure_loaded()
+
+    def _idle(self, name: str) -> bool:
+        # Requests count as soon as they acquire the model, before it is loaded; sessions also cover other callers
+        return self._in_use[name] == 0 and self._models[name].active_sessions == 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": list(self._loaded),
+                "estimated_bytes": sum(self._loaded.values()),
+                "memory_budget": self.memory_budget,
+            }
+
+
+def create_model_pool() -> ASRModelPool:
+    names = [CONFIG.MODEL_NAME] + [name for name in CONFIG.MODEL_POOL if name != CONFIG.MODEL_NAME]
+    if CONFIG.CASCADE_DRAFT_MODEL and CONFIG.CASCADE_DRAFT_MODEL not in names:
+        names.append(CONFIG.CASCADE_DRAFT_MODEL)
+    return ASRModelPool(names, CONFIG.MODEL_MEMORY_BUDGET * 1024 * 1024)
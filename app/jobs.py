@@ -0,0 +1,217 @@
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+import uuid
+from threading import Event, Lock, Thread
+from typing import BinaryIO, Union
+
+from app.config import CONFIG
+from app.factory.asr_model_factory import ASRModelPool
+from app.metrics import track_request_memory
+from app.scheduling import scheduling
+from app.transcript import Transcript
+from app.utils import load_audio
+
+
+class JobStore:
+    """
+    SQLite-backed store of transcription jobs. Uploads and results are spooled next to the database,
+    so queued and finished jobs survive a process restart. Several processes may share the same directory;
+    only the one created with `recover` requeues jobs that were running when the service stopped. Jobs are claimed
+    on behalf of `worker`, so that the jobs of a worker process that died can be requeued with `requeue`.
+    """
+
+    def __init__(self, directory: str, recover: bool = True, worker: Union[str, None] = None):
+        self.directory = directory
+        self.worker = worker
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = Lock()
+        self._db = sqlite3.connect(os.path.join(self.directory, "jobs.db"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    params TEXT NOT NULL,
+                    duration REAL,
+                    processed REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    worker TEXT
+                )
+                """
+            )
+            # Databases created before jobs recorded the worker that claimed them
+            columns = [row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            if "worker" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN worker TEXT")
+        if recover:
+            # Jobs interrupted by a restart are picked up again
+            self.requeue()
+
+    def requeue(self, worker: Union[str, None] = None) -> int:
+        """
+        Queues the running jobs claimed by `worker` again, or all running jobs if `worker` is None. Returns the
+        number of requeued jobs.
+        """
+        query = "UPDATE jobs SET status = 'queued', processed = 0, worker = NULL WHERE status = 'running'"
+        with self._lock, self._db:
+            if worker is None:
+                return self._db.execute(query).rowcount
+            return self._db.execute(f"{query} AND worker = ?", (worker,)).rowcount
+
+    def upload_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.upload")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.result")
+
+    def create(self, file: BinaryIO, filename: str, params: dict) -> str:
+        """
+        Spools the upload to disk and queues a job for it. Returns the job ID.
+        """
+        job_id = uuid.uuid4().hex
+        with open(self.upload_path(job_id), "wb") as f:
+            shutil.copyfileobj(file, f, CONFIG.AUDIO_CHUNK_SIZE)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, filename, params, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, json.dumps(params), now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def next_queued(self) -> Union[dict, None]:
+        """
+        Marks the oldest queued job as running and returns it.
+        """
+        with self._lock, self._db:
+            while True:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # Another process may have claimed the job in the meantime
+                claimed = self._db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+                    (self.worker, time.time(), row["id"]),
+                ).rowcount
+                if claimed:
+                    break
+        return self.get(row["id"])
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def save_result(self, job_id: str, result: Transcript):
+        tmp_path = self.result_path(job_id) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.result_path(job_id))
+
+    def load_result(self, job_id: str) -> Union[dict, Transcript]:
+        # Results of jobs completed before transcripts were introduced are engine results
+        with open(self.result_path(job_id), "rb") as f:
+            return pickle.load(f)
+
+    def remove_expired(self, ttl: int):
+        """
+        Deletes finished jobs, and their files, that were last updated more than `ttl` seconds ago.
+        """
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (time.time() - ttl,),
+            ).fetchall()
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in rows])
+        for row in rows:
+            for path in (self.upload_path(row["id"]), self.result_path(row["id"])):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class JobRunner:
+    """
+    Background worker that runs queued jobs through the ASR models and periodically removes expired jobs.
+    """
+
+    def __init__(self, store: JobStore, model_pool: ASRModelPool, ttl: int, poll_interval: float = 1.0):
+        self.store = store
+        self.model_pool = model_pool
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._wakeup = Event()
+        self._last_cleanup = 0.0
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+
+    def notify(self):
+        """
+        Wakes the runner up after a job has been queued.
+        """
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            if time.time() - self._last_cleanup > 60:
+                self.store.remove_expired(self.ttl)
+                self._last_cleanup = time.time()
+
+            job = self.store.next_queued()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _process(self, job: dict):
+        job_id = job["id"]
+        params = job["params"]
+        try:
+            with track_request_memory():
+                with open(self.store.upload_path(job_id), "rb") as f:
+                    audio = load_audio(f, params["encode"])
+                duration = audio.shape[0] / CONFIG.SAMPLE_RATE
+                self.store.update(job_id, duration=duration)
+
+                # Jobs run in the background, so interactive requests get the model first
+                with scheduling("low", duration), self.model_pool.acquire(params.get("model")) as asr_model:
+                    result = asr_model.transcribe_audio(
+                        audio,
+                        params["task"],
+                        params["language"],
+                        params["initial_prompt"],
+                        params["vad_filter"],
+                        params["word_timestamps"],
+                        params["options"],
+                        progress=lambda seconds: self.store.update(job_id, processed=min(seconds, duration)),
+                    )
+            self.store.save_result(job_id, Transcript.from_result(result, model=params.get("model")))
+            self.store.update(job_id, status="completed", processed=duration)
+        except Exception as e:
+            self.store.update(job_id, status="failed", error=str(e))
+        finally:
+            if os.path.exists(self.store.upload_path(job_id)):
+                os.remove(self.store.upload_path(job_id))
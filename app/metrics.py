@@ -0,0 +1,357 @@
+import bisect
+import functools
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from app.config import CONFIG
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RATIO_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+BYTES_BUCKETS = tuple(2**power for power in range(26, 37))  # 64 MiB to 64 GiB
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type: str
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # Labels added to every sample, set by the registry
+        self.constant_labels: Dict[str, str] = {}
+        self._lock = Lock()
+
+    def _labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        names = (*self.label_names, *self.constant_labels)
+        return _format_labels(names, (*key, *self.constant_labels.values()), extra)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}_total{self._labels(key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Gauge whose value is set explicitly, or read from `function` when the metrics are collected.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), function: Callable = None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name}{self._labels(())} {_format_value(self.function())}"]
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: bucket counts (not cumulative), sum and count
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+            total[1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observes the wall-clock duration of the block, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = {key: (list(counts), list(total)) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, (total, count)) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts, strict=True):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Minimal registry of metrics rendered in the Prometheus text exposition format.
+    """
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, constant_labels: Dict[str, str] = None):
+        self.constant_labels = constant_labels or {}
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        metric.constant_labels = self.constant_labels
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+# Every worker process of multi-process serving has its own metrics, which are told apart by their worker label
+registry = Registry({"worker": CONFIG.WORKER_INDEX} if CONFIG.WORKER_INDEX is not None else None)
+
+STAGE_DURATION = registry.histogram(
+    "asr_stage_duration_seconds",
+    "Time spent in each processing stage (decode, vad, inference, alignment, diarization, write, language_detection).",
+    ["stage"],
+)
+REAL_TIME_FACTOR = registry.histogram(
+    "asr_real_time_factor",
+    "Transcription time divided by the duration of the audio.",
+    ["engine", "model"],
+    buckets=RATIO_BUCKETS,
+)
+AUDIO_DURATION = registry.counter(
+    "asr_audio_seconds",
+    "Seconds of audio transcribed.",
+    ["engine", "model"],
+)
+MODEL_LOCK_WAIT = registry.histogram(
+    "asr_model_lock_wait_seconds",
+    "Time spent waiting for the model, by priority class.",
+    ["engine", "model", "priority"],
+)
+SCHEDULER_PREEMPTIONS = registry.counter(
+    "asr_scheduler_preemptions",
+    "Times a transcription gave up the model between windows to a job that ranks before it.",
+    ["engine", "model", "priority"],
+)
+CASCADE_ESCALATED = registry.histogram(
+    "asr_cascade_escalated_ratio",
+    "Fraction of the audio of a cascaded transcription that was transcribed again with the requested model.",
+    buckets=RATIO_BUCKETS,
+)
+MODEL_LOAD_DURATION = registry.histogram(
+    "asr_model_load_duration_seconds",
+    "Time spent loading a model.",
+    ["engine", "model"],
+)
+MODEL_UNLOAD_DURATION = registry.histogram(
+    "asr_model_unload_duration_seconds",
+    "Time spent unloading a model.",
+    ["engine", "model"],
+)
+MODEL_RESTORE_DURATION = registry.histogram(
+    "asr_model_restore_duration_seconds",
+    "Time spent moving an idle model back to the device, by the tier it was restored from.",
+    ["engine", "model", "tier"],
+)
+MODEL_TRANSITIONS = registry.counter(
+    "asr_model_transitions",
+    "Idle transitions of the models (offloaded, snapshot, unloaded) and restores (restored_from_<tier>).",
+    ["engine", "model", "transition"],
+)
+REQUEST_PEAK_RSS = registry.histogram(
+    "asr_request_peak_rss_bytes",
+    "Peak resident memory of the process while a request was processed.",
+    buckets=BYTES_BUCKETS,
+)
+REQUEST_PEAK_VRAM = registry.histogram(
+    "asr_request_peak_vram_bytes",
+    "Peak GPU memory allocated while a request was processed.",
+    buckets=BYTES_BUCKETS,
+)
+
+
+def stage(name: str):
+    """
+    Times the block as the given processing stage.
+    """
+    return STAGE_DURATION.time(stage=name)
+
+
+@contextmanager
+def observe_real_time_factor(engine: str, model: str, audio_seconds: float) -> Iterator[None]:
+    """
+    Records the real-time factor of transcribing `audio_seconds` of audio in the block.
+    """
+    start = time.perf_counter()
+    yield
+    if audio_seconds > 0:
+        REAL_TIME_FACTOR.observe((time.perf_counter() - start) / audio_seconds, engine=engine, model=model)
+        AUDIO_DURATION.inc(audio_seconds, engine=engine, model=model)
+
+
+def observe_model_load(load_model: Callable) -> Callable:
+    """
+    Decorates the `load_model` method of an ASR model to record its duration.
+    """
+
+    @functools.wraps(load_model)
+    def wrapper(self, *args, **kwargs):
+        with MODEL_LOAD_DURATION.time(engine=self.engine, model=self.model_name):
+            return load_model(self, *args, **kwargs)
+
+    return wrapper
+
+
+def current_rss() -> int:
+    """
+    Returns the resident memory of the process in bytes, or its peak where the current value is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _vram_allocated() -> int:
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return 0
+    return torch.cuda.memory_allocated()
+
+
+class _MemorySampler:
+    """
+    Samples the resident and GPU memory while at least one request is tracked, keeping the peak of each request.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self._peaks: Dict[int, List[int]] = {}
+        self._lock = Lock()
+        self._active = Event()
+        Thread(target=self._run, daemon=True).start()
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        peak = [current_rss(), _vram_allocated()]
+        with self._lock:
+            self._peaks[id(peak)] = peak
+            self._active.set()
+        try:
+            yield
+        finally:
+            self._sample()
+            with self._lock:
+                del self._peaks[id(peak)]
+                if not self._peaks:
+                    self._active.clear()
+            REQUEST_PEAK_RSS.observe(peak[0])
+            if peak[1]:
+                REQUEST_PEAK_VRAM.observe(peak[1])
+
+    def _sample(self):
+        rss = current_rss()
+        vram = _vram_allocated()
+        with self._lock:
+            for peak in self._peaks.values():
+                peak[0] = max(peak[0], rss)
+                peak[1] = max(peak[1], vram)
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            self._sample()
+            time.sleep(self.interval)
+
+
+_memory_sampler = None
+_memory_sampler_lock = Lock()
+
+
+def track_request_memory():
+    """
+    Records the peak resident and GPU memory used while the block runs.
+    """
+    global _memory_sampler
+    with _memory_sampler_lock:
+        if _memory_sampler is None:
+            _memory_sampler = _MemorySampler()
+    return _memory_sampler.track()
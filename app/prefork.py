@@ -0,0 +1,147 @@
+"""
+Multi-process serving. A supervisor binds the listening socket and starts `WORKERS` worker processes, each
+serving the app with its own model, pinned to its own share of the CPU cores.
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import List
+
+from app.config import CONFIG
+
+# Worker processes are started with spawn, so they do not inherit the threads and locks of the supervisor
+_context = multiprocessing.get_context("spawn")
+
+
+def _available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(workers: str, threads: int, cores: List[int], cuda: bool) -> List[List[int]]:
+    """
+    Divides `cores` between the workers. Returns the cores of every worker.
+    With `workers` set to 'auto', a GPU host gets a single worker, which owns the device, and a CPU host one
+    worker per `threads` cores (4 if not set). When there are fewer cores than workers times threads, workers
+    share cores.
+    """
+    if workers == "auto":
+        count = 1 if cuda else max(1, len(cores) // (threads or 4))
+    else:
+        count = max(1, int(workers))
+    threads = threads or max(1, len(cores) // count)
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(count)]
+
+
+def shares_weights(engine: str, quantization: str, cuda: bool) -> bool:
+    """
+    Returns whether the workers can share the weights of a model through a memory-mapped snapshot. Only the float
+    weights of openai_whisper can: int8 weights are packed on the CPU into memory owned by every process, and
+    CTranslate2 loads the weights of faster_whisper and whisperx into its own memory. The stub engine has no weights.
+    """
+    if engine == "stub":
+        return True
+    return engine == "openai_whisper" and (cuda or quantization != "int8")
+
+
+def _warn_unshared(names: List[str], workers: int, cuda: bool):
+    from app.factory.asr_model_factory import ModelSpec
+
+    for spec in map(ModelSpec.parse, dict.fromkeys(names)):
+        if not shares_weights(spec.engine, spec.quantization, cuda):
+            size = spec.estimated_size() * workers / 1024**3
+            print(
+                f"Warning: the {spec.quantization} weights of {spec.engine}:{spec.model_name} cannot be shared between "
+                f"workers, so each of the {workers} workers loads its own copy (about {size:.1f} GiB in total). "
+                "Set ASR_QUANTIZATION=float32 with openai_whisper to share a single copy."
+            )
+
+
+def _prepare():
+    """
+    Loads the default model once, so that its weights are downloaded, and the shared snapshot is written,
+    before the workers race to do the same.
+    """
+    from app.factory.asr_model_factory import ASRModelFactory
+
+    ASRModelFactory.create_asr_model().load_model()
+
+
+def _worker(sock: socket.socket, cores: List[int], host: str, port: int):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import uvicorn
+
+    from app.webservice import app
+
+    uvicorn.Server(uvicorn.Config(app, host=host, port=port)).run(sockets=[sock])
+
+
+def _spawn(index: int, sock: socket.socket, cores: List[int], host: str, port: int):
+    # The environment is read by the configuration of the worker when it imports the app
+    os.environ.update({
+        "WORKER_INDEX": str(index),
+        "CPU_THREADS": str(len(cores)),
+        "OMP_NUM_THREADS": str(len(cores)),
+        "MODEL_SHARED_WEIGHTS": "true",
+    })
+    process = _context.Process(target=_worker, args=(sock, cores, host, port), name=f"asr-worker-{index}")
+    process.start()
+    return process
+
+
+def serve(host: str, port: int, workers: str):
+    from app.jobs import JobStore
+
+    plan = plan_workers(workers, CONFIG.WORKER_THREADS, _available_cores(), CONFIG.DEVICE == "cuda")
+    print(f"Starting {len(plan)} workers: " + ", ".join(f"{i}: cores {cores}" for i, cores in enumerate(plan)))
+    if len(plan) > 1:
+        _warn_unshared([CONFIG.MODEL_NAME, *CONFIG.MODEL_POOL], len(plan), CONFIG.DEVICE == "cuda")
+
+    os.environ["MODEL_SHARED_WEIGHTS"] = "true"
+    preparation = _context.Process(target=_prepare, name="asr-prepare")
+    preparation.start()
+    preparation.join()
+    if preparation.exitcode != 0:
+        raise RuntimeError(f"Loading the model failed with exit code {preparation.exitcode}")
+
+    # Workers share the jobs without recovering them, so the supervisor requeues the jobs that were running when the
+    # service stopped, and those claimed by every worker it restarts
+    jobs = JobStore(CONFIG.JOBS_DIR)
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = [_spawn(index, sock, cores, host, port) for index, cores in enumerate(plan)]
+    try:
+        while not stopping:
+            for index, process in enumerate(processes):
+                if not process.is_alive() and not stopping:
+                    requeued = jobs.requeue(str(index))
+                    print(f"Worker {index} exited with code {process.exitcode}, restarting it and requeuing {requeued} jobs")
+                    processes[index] = _spawn(index, sock, plan[index], host, port)
+            time.sleep(0.5)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        sock.close()
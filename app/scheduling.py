@@ -0,0 +1,198 @@
+"""
+Priority and shortest-job-first scheduling of the requests waiting for a model.
+"""
+
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Condition, Event
+from typing import Iterable, Iterator, NamedTuple, Union
+
+from app.cancellation import check_cancelled
+from app.config import CONFIG
+from app.metrics import MODEL_LOCK_WAIT, SCHEDULER_PREEMPTIONS
+
+PRIORITIES = ("high", "normal", "low")
+
+
+class Job(NamedTuple):
+    priority: str
+    # Seconds of audio, known once the upload has been decoded
+    duration: float
+    arrival: float
+
+    def rank(self) -> float:
+        """
+        Time at which the job is due. Jobs are served in order of rank: a lower priority class delays a job by
+        SCHEDULER_PRIORITY_STEP seconds per class, and every second of audio by SCHEDULER_DURATION_WEIGHT seconds.
+        As the rank of a waiting job does not change while newer jobs arrive with later ranks, every job eventually
+        comes first, however long or low-priority it is.
+        """
+        delay = PRIORITIES.index(self.priority) * CONFIG.SCHEDULER_PRIORITY_STEP
+        return self.arrival + delay + self.duration * CONFIG.SCHEDULER_DURATION_WEIGHT
+
+
+# Job of the request being processed; copied into the worker threads that run it
+_current_job: ContextVar[Union[Job, None]] = ContextVar("scheduler_job", default=None)
+
+
+def current_job() -> Job:
+    # Work outside of a request, such as warm-up, is scheduled like a short request arriving now
+    return _current_job.get() or Job("normal", 0.0, time.monotonic())
+
+
+@contextmanager
+def scheduling(priority: str, duration: float) -> Iterator[Job]:
+    """
+    Schedules the model calls in the block as a job of the given priority class and audio duration.
+    """
+    reset = _current_job.set(Job(priority, duration, time.monotonic()))
+    try:
+        yield _current_job.get()
+    finally:
+        _current_job.reset(reset)
+
+
+# Seconds a preempted transcription gives a job it handed the model over to before asking for the model again, in
+# case the job waits for something that does not tell it apart
+HANDOVER_TIMEOUT = 5.0
+
+# Set in a job that a preempted transcription handed the model over to, see `ModelScheduler.preempt`
+_handover: ContextVar[Union[Event, None]] = ContextVar("scheduler_handover", default=None)
+
+
+@contextmanager
+def handed_over(settled: Event) -> Iterator[None]:
+    """
+    Runs the block as a job that a preempted transcription handed the model over to. `settled` is set once the job
+    waits, see `mark_waiting`.
+    """
+    reset = _handover.set(settled)
+    try:
+        yield
+    finally:
+        _handover.reset(reset)
+
+
+def mark_waiting():
+    """
+    Called where a job waits for a model, or for a result computed by another job. A preempted transcription that
+    handed the model over to the job then asks for the model again, rather than waiting for the job to finish, which
+    may itself wait for that transcription.
+    """
+    settled = _handover.get()
+    if settled is not None:
+        settled.set()
+
+
+class ModelScheduler:
+    """
+    Lock of a model that is granted to the waiting job with the lowest rank instead of the first to arrive, so that
+    short and interactive requests are not stuck behind long uploads.
+
+    Engines hold it for a whole transcription, or for every window or batch of windows; with SCHEDULER_PREEMPT, a
+    long transcription also gives it up between windows to any waiting job that comes first.
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self._condition = Condition()
+        self._held = False
+        self._waiting = []
+        self._sequence = itertools.count()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        return self._acquire(blocking, timeout, cancellable=False)
+
+    def _acquire(self, blocking: bool, timeout: float, cancellable: bool) -> bool:
+        job = current_job()
+        start = time.perf_counter()
+        entry = (job.rank(), next(self._sequence))
+        with self._condition:
+            if not self._held and not self._waiting:
+                self._held = True
+                mark_waiting()
+                MODEL_LOCK_WAIT.observe(0.0, priority=job.priority, **self.labels)
+                return True
+            if not blocking:
+                return False
+
+            heapq.heappush(self._waiting, entry)
+            mark_waiting()
+            deadline = None if timeout < 0 else start + timeout
+            try:
+                while self._held or self._waiting[0] != entry:
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        self._remove(entry)
+                        return False
+                    # Cancelled requests leave the queue; they are checked a few times per second
+                    self._condition.wait(0.25 if remaining is None else min(remaining, 0.25))
+                    if cancellable:
+                        check_cancelled()
+            except BaseException:
+                self._remove(entry)
+                raise
+            heapq.heappop(self._waiting)
+            self._held = True
+        MODEL_LOCK_WAIT.observe(time.perf_counter() - start, priority=job.priority, **self.labels)
+        return True
+
+    def _remove(self, entry: tuple):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        # The job that is now first may be able to take the free lock
+        self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._held = False
+            self._condition.notify_all()
+
+    def locked(self) -> bool:
+        return self._held
+
+    def preempt(self):
+        """
+        Called by the holder between windows. With SCHEDULER_PREEMPT, hands the model over to the first waiting job
+        if it ranks before the current one, and waits for its turn again. Jobs waiting for an inference worker are
+        considered too: as the holder may occupy the only worker, the first of them is started on a spare worker, and
+        given the chance to take the model first.
+        """
+        if not CONFIG.SCHEDULER_PREEMPT:
+            return
+        # Imported here, as the executor ranks its calls with the jobs of this module
+        from app.executor import executor
+
+        job = current_job()
+        rank = job.rank()
+        with self._condition:
+            waiting = bool(self._waiting) and self._waiting[0][0] < rank
+        settled = None if waiting else executor.hand_over(rank)
+        if not waiting and settled is None:
+            return
+        SCHEDULER_PREEMPTIONS.inc(priority=job.priority, **self.labels)
+        self.release()
+        try:
+            if settled is not None:
+                settled.wait(HANDOVER_TIMEOUT)
+        finally:
+            # Not cancellable, as the block that holds the lock releases it on exit; cancellation is checked afterwards
+            self._acquire(True, -1, cancellable=False)
+
+    def preemptible(self, items: Iterable) -> Iterator:
+        """
+        Yields the items, each produced by a lazy decoding loop, with a chance of preemption before the next one.
+        """
+        for item in items:
+            yield item
+            self.preempt()
+
+    def __enter__(self):
+        self._acquire(True, -1, cancellable=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,167 @@
+"""
+Incremental transcription of live audio, for the `/asr/stream` WebSocket endpoint.
+"""
+
+import re
+from threading import Lock
+from typing import List, NamedTuple, Union
+
+import numpy as np
+
+from app.config import CONFIG
+
+SAMPLE_FORMATS = {"s16le": np.int16, "f32le": np.float32}
+
+
+class StreamWord(NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+def decode_frames(data: bytes, sample_format: str) -> np.ndarray:
+    """
+    Converts raw little-endian PCM frames to float32 samples in [-1, 1].
+    """
+    samples = np.frombuffer(data, dtype=np.dtype(SAMPLE_FORMATS[sample_format]).newbyteorder("<"))
+    if sample_format == "s16le":
+        return samples.astype(np.float32) / 32768.0
+    return samples.astype(np.float32)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^\w]", "", text.lower())
+
+
+class StreamingTranscriber:
+    """
+    Transcribes a live audio stream over a rolling buffer, with the LocalAgreement policy.
+
+    Every pass transcribes the whole buffer again. Words that two consecutive passes agree on are final: they are
+    committed with their timestamps and never change afterwards. The remaining words are sent as a partial
+    hypothesis, which later passes may revise. Once the buffer is longer than `buffer_seconds`, the audio up to the
+    last committed word is dropped, so every pass decodes at most a few seconds more than `buffer_seconds`, and
+    holds the model lock only for that long.
+    """
+
+    def __init__(
+        self,
+        task: Union[str, None] = "transcribe",
+        language: Union[str, None] = None,
+        initial_prompt: Union[str, None] = None,
+        step_seconds: float = CONFIG.STREAM_STEP_SECONDS,
+        buffer_seconds: float = CONFIG.STREAM_BUFFER_SECONDS,
+        sr: int = CONFIG.SAMPLE_RATE,
+    ):
+        self.task = task
+        self.language = language
+        self.initial_prompt = initial_prompt
+        self.step = int(step_seconds * sr)
+        self.buffer_seconds = buffer_seconds
+        self.sr = sr
+        self.buffer = np.zeros(0, dtype=np.float32)
+        # Time of the first sample of the buffer, in seconds since the start of the stream
+        self.offset = 0.0
+        self.committed: List[StreamWord] = []
+        self.hypothesis: List[StreamWord] = []
+        self._pending = 0
+        self._lock = Lock()
+
+    @property
+    def committed_end(self) -> float:
+        return self.committed[-1].end if self.committed else 0.0
+
+    def feed(self, samples: np.ndarray):
+        with self._lock:
+            self.buffer = np.concatenate([self.buffer, samples])
+            self._pending += samples.shape[0]
+
+    def ready(self) -> bool:
+        """
+        Returns True once `step_seconds` of audio arrived since the last pass.
+        """
+        return self._pending >= self.step
+
+    def process(self, asr_model) -> List[dict]:
+        """
+        Runs one pass over the buffer. Returns the messages to send: a final segment for the newly committed
+        words, if any, followed by the current partial hypothesis.
+        """
+        with self._lock:
+            audio = self.buffer
+            offset = self.offset
+            self._pending = 0
+
+        words, language = asr_model.transcribe_words(audio, self.task, self.language, self._prompt(offset))
+        # Keep the language of the first pass, so that later passes cannot switch it mid-stream
+        self.language = self.language or language
+        words = [StreamWord(offset + start, offset + end, text) for start, end, text in words]
+
+        messages = self._commit(self._agree(words))
+        if self.buffer.shape[0] > self.buffer_seconds * self.sr:
+            if self.committed_end <= self.offset:
+                # No agreement within the whole buffer; commit the hypothesis rather than let the buffer grow
+                messages += self._commit(self.hypothesis)
+                self.hypothesis = []
+            self._trim(self.committed_end)
+        if self.hypothesis:
+            messages.append(self._message("partial", self.hypothesis))
+        return messages
+
+    def finish(self, asr_model) -> List[dict]:
+        """
+        Runs a last pass over the remaining audio and commits all of it.
+        """
+        messages = self.process(asr_model) if self._pending else []
+        messages = [message for message in messages if message["type"] == "final"]
+        messages += self._commit(self.hypothesis)
+        self.hypothesis = []
+        return messages
+
+    def _agree(self, words: List[StreamWord]) -> List[StreamWord]:
+        # Words before the committed ones were already sent
+        words = [word for word in words if word.start >= self.committed_end - 0.1]
+        if words and self.committed and abs(words[0].start - self.committed_end) < 1:
+            # A pass may repeat the last committed words with slightly different timestamps
+            for n in range(min(len(self.committed), len(words), 5), 0, -1):
+                tail = [_normalize(word.text) for word in self.committed[-n:]]
+                if tail == [_normalize(word.text) for word in words[:n]]:
+                    words = words[n:]
+                    break
+
+        agreed = []
+        for previous, word in zip(self.hypothesis, words, strict=False):
+            if _normalize(previous.text) != _normalize(word.text):
+                break
+            agreed.append(word)
+        self.hypothesis = words[len(agreed):]
+        return agreed
+
+    def _commit(self, words: List[StreamWord]) -> List[dict]:
+        if not words:
+            return []
+        self.committed.extend(words)
+        return [self._message("final", words)]
+
+    def _trim(self, time: float):
+        with self._lock:
+            cut = min(int((time - self.offset) * self.sr), self.buffer.shape[0])
+            if cut > 0:
+                self.buffer = self.buffer[cut:]
+                self.offset += cut / self.sr
+
+    def _prompt(self, offset: float) -> Union[str, None]:
+        # Committed text that is no longer in the buffer gives the model the context of the audio it cannot hear
+        context = "".join(word.text for word in self.committed if word.end <= offset)[-200:]
+        prompt = " ".join(text for text in (self.initial_prompt, context.strip()) if text)
+        return prompt or None
+
+    @staticmethod
+    def _message(message_type: str, words: List[StreamWord]) -> dict:
+        return {
+            "type": message_type,
+            "start": round(words[0].start, 3),
+            "end": round(words[-1].end, 3),
+            "text": "".join(word.text for word in words).strip(),
+            "words": [{"start": round(w.start, 3), "end": round(w.end, 3), "word": w.text} for w in words],
+        }
@@ -0,0 +1,203 @@
+"""
+Engine-independent representation of a transcription, which every output format is rendered from.
+"""
+
+from dataclasses import dataclass, fields
+from typing import Iterator, List, Union
+
+import numpy as np
+
+# Per-segment decoding scores, stored as the columns of `Transcript.scores`
+SCORES = ("temperature", "avg_logprob", "compression_ratio", "no_speech_prob")
+
+
+def _fields(item) -> dict:
+    if isinstance(item, dict):
+        return item
+    # Unlike dataclasses.asdict, nested dataclasses are not copied recursively
+    return {field.name: getattr(item, field.name) for field in fields(item)}
+
+
+def segment_dict(segment) -> dict:
+    """
+    Returns a segment of any engine, a dataclass or a dict, as a dict whose words are dicts too.
+    """
+    segment = _fields(segment)
+    if segment.get("words"):
+        segment = dict(segment, words=[_fields(word) for word in segment["words"]])
+    return segment
+
+
+def _offsets(lengths: List[int]) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+@dataclass
+class Transcript:
+    """
+    Array-backed transcription result.
+
+    Segment and word texts are each concatenated into a single string and sliced by offsets; timestamps, scores and
+    tokens are numpy arrays. Missing values are NaN. `word_offsets` and `token_offsets` are None if the engine did not
+    produce words or tokens. The words of segment `i` are `word_offsets[i]:word_offsets[i + 1]`.
+    """
+
+    language: Union[str, None]
+    text: str
+    text_offsets: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    scores: np.ndarray
+    speakers: Union[List[Union[str, None]], None] = None
+    seeks: Union[np.ndarray, None] = None
+    tokens: Union[np.ndarray, None] = None
+    token_offsets: Union[np.ndarray, None] = None
+    word_text: str = ""
+    word_text_offsets: Union[np.ndarray, None] = None
+    word_starts: Union[np.ndarray, None] = None
+    word_ends: Union[np.ndarray, None] = None
+    word_probabilities: Union[np.ndarray, None] = None
+    word_speakers: Union[List[Union[str, None]], None] = None
+    word_offsets: Union[np.ndarray, None] = None
+    # Whether the engine also listed every word at the top level of its result, as WhisperX does
+    word_segments: bool = False
+    # Model that produced the transcript, as requested with the `model` parameter
+    model: Union[str, None] = None
+    # Fraction of the audio that a cascaded transcription transcribed again with the requested model
+    escalated: Union[float, None] = None
+
+    @classmethod
+    def from_result(cls, result: Union[dict, "Transcript"], model: Union[str, None] = None) -> "Transcript":
+        """
+        Converts the result of any engine into a transcript, in a single pass over its segments.
+        """
+        if isinstance(result, Transcript):
+            return result
+
+        texts, starts, ends, scores, speakers, seeks, tokens, token_counts = [], [], [], [], [], [], [], []
+        word_texts, word_starts, word_ends, word_probabilities, word_speakers, word_counts = [], [], [], [], [], []
+        has_words = has_tokens = False
+        for segment in result["segments"]:
+            segment = _fields(segment)
+            texts.append(segment["text"])
+            starts.append(segment["start"])
+            ends.append(segment["end"])
+            scores.append([segment.get(name, np.nan) for name in SCORES])
+            speakers.append(segment.get("speaker"))
+            seeks.append(segment.get("seek", 0))
+            if segment.get("tokens") is not None:
+                has_tokens = True
+                tokens.extend(segment["tokens"])
+            token_counts.append(len(segment.get("tokens") or ()))
+
+            words = segment.get("words")
+            has_words = has_words or words is not None
+            for word in words or ():
+                word = _fields(word)
+                word_texts.append(word["word"])
+                # Words that WhisperX could not align have no timestamps
+                word_starts.append(word.get("start", np.nan))
+                word_ends.append(word.get("end", np.nan))
+                word_probabilities.append(word.get("probability", word.get("score", np.nan)))
+                word_speakers.append(word.get("speaker"))
+            word_counts.append(len(words or ()))
+
+        transcript = cls(
+            language=result.get("language"),
+            text="".join(texts),
+            text_offsets=_offsets([len(text) for text in texts]),
+            starts=np.asarray(starts, np.float64),
+            ends=np.asarray(ends, np.float64),
+            scores=np.asarray(scores, np.float64).reshape(-1, len(SCORES)),
+            speakers=speakers if any(speaker is not None for speaker in speakers) else None,
+            seeks=np.asarray(seeks, np.int64) if has_tokens else None,
+            tokens=np.asarray(tokens, np.int32) if has_tokens else None,
+            token_offsets=_offsets(token_counts) if has_tokens else None,
+            model=model,
+            escalated=result.get("escalated"),
+        )
+        if has_words:
+            transcript.word_text = "".join(word_texts)
+            transcript.word_text_offsets = _offsets([len(text) for text in word_texts])
+            transcript.word_starts = np.asarray(word_starts, np.float64)
+            transcript.word_ends = np.asarray(word_ends, np.float64)
+            transcript.word_probabilities = np.asarray(word_probabilities, np.float64)
+            transcript.word_speakers = word_speakers if any(s is not None for s in word_speakers) else None
+            transcript.word_offsets = _offsets(word_counts)
+            transcript.word_segments = "word_segments" in result
+        return transcript
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def has_words(self) -> bool:
+        return self.word_offsets is not None
+
+    def segment_texts(self) -> List[str]:
+        offsets = self.text_offsets.tolist()
+        return [self.text[start:end] for start, end in zip(offsets, offsets[1:], strict=False)]
+
+    def word_texts(self) -> List[str]:
+        offsets = self.word_text_offsets.tolist()
+        return [self.word_text[start:end] for start, end in zip(offsets, offsets[1:], strict=False)]
+
+    def words(self) -> List[dict]:
+        """
+        Returns every word as a dict with its text, and its timestamps and probability if known.
+        """
+        if not self.has_words:
+            return []
+        words = []
+        speakers = self.word_speakers or [None] * len(self.word_starts)
+        columns = zip(
+            self.word_texts(),
+            self.word_starts.tolist(),
+            self.word_ends.tolist(),
+            self.word_probabilities.tolist(),
+            speakers,
+            strict=True,
+        )
+        for text, start, end, probability, speaker in columns:
+            word = {"word": text}
+            if not np.isnan(start):
+                word["start"] = start
+                word["end"] = end
+            if not np.isnan(probability):
+                word["probability"] = probability
+            if speaker is not None:
+                word["speaker"] = speaker
+            words.append(word)
+        return words
+
+    def segments(self) -> Iterator[dict]:
+        """
+        Yields every segment as a dict, in the layout of the JSON output.
+        """
+        words = self.words()
+        word_offsets = self.word_offsets.tolist() if self.has_words else None
+        token_offsets = self.token_offsets.tolist() if self.tokens is not None else None
+        starts, ends, scores = self.starts.tolist(), self.ends.tolist(), self.scores.tolist()
+        for i, text in enumerate(self.segment_texts()):
+            segment = {"id": i, "start": starts[i], "end": ends[i], "text": text}
+            if token_offsets is not None:
+                segment["seek"] = int(self.seeks[i])
+                segment["tokens"] = self.tokens[token_offsets[i] : token_offsets[i + 1]].tolist()
+            for name, value in zip(SCORES, scores[i], strict=True):
+                if not np.isnan(value):
+                    segment[name] = value
+            if word_offsets is not None:
+                segment["words"] = words[word_offsets[i] : word_offsets[i + 1]]
+            if self.speakers is not None and self.speakers[i] is not None:
+                segment["speaker"] = self.speakers[i]
+            yield segment
+
+    def to_dict(self) -> dict:
+        result = {"text": self.text, "segments": list(self.segments()), "language": self.language}
+        if self.word_segments:
+            result["word_segments"] = self.words()
+        if self.escalated is not None:
+            result["escalated"] = self.escalated
+        return result
@@ -1,67 +1,221 @@
 import json
+import math
 import os
-from dataclasses import asdict
-from typing import BinaryIO, TextIO
+import re
+import tempfile
+from itertools import repeat
+from threading import Thread
+from typing import BinaryIO, Iterable, Iterator, List, TextIO, Tuple, Union
 
 import ffmpeg
 import numpy as np
-from faster_whisper.utils import format_timestamp
 
+from app.audio import can_decode, decode_flac, decode_wav, peek, resample, sniff
 from app.config import CONFIG
+from app.metrics import stage
+from app.transcript import Transcript, segment_dict
+
+
+def format_timestamp(seconds: float, always_include_hours: bool = False, decimal_marker: str = ".") -> str:
+    assert seconds >= 0, "non-negative timestamp expected"
+    milliseconds = round(seconds * 1000.0)
+
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1_000)
+
+    hours_marker = f"{hours:02d}:" if always_include_hours or hours > 0 else ""
+    return f"{hours_marker}{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
 
 
 class ResultWriter:
+    """
+    Renders a `Transcript` in one output format. Whole results are rendered with `render`, in a single pass over the
+    arrays of the transcript; `iter_result` renders segments one by one while they are being transcribed.
+    """
+
     extension: str
 
-    def __init__(self, output_dir: str):
+    def __init__(self, output_dir: str = "."):
         self.output_dir = output_dir
 
-    def __call__(self, result: dict, audio_path: str):
+    def __call__(self, result: Union[dict, Transcript], audio_path: str):
         audio_basename = os.path.basename(audio_path)
         output_path = os.path.join(self.output_dir, audio_basename + "." + self.extension)
 
         with open(output_path, "w", encoding="utf-8") as f:
             self.write_result(result, file=f)
 
-    def write_result(self, result: dict, file: TextIO):
+    def write_result(self, result: Union[dict, Transcript], file: TextIO):
+        file.write(self.render(Transcript.from_result(result)))
+
+    def render(self, transcript: Transcript) -> str:
         raise NotImplementedError
 
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        """
+        Renders the segments one by one as they are produced, yielding the text of each.
+        """
+        raise NotImplementedError
+
+
+def _with_speaker(text: str, speaker: Union[str, None]) -> str:
+    return text if speaker is None else f"[{speaker}]: {text}"
+
 
 class WriteTXT(ResultWriter):
     extension: str = "txt"
 
-    def write_result(self, result: dict, file: TextIO):
-        for segment in result["segments"]:
-            print(segment.text.strip(), file=file, flush=True)
+    def render(self, transcript: Transcript) -> str:
+        speakers = transcript.speakers or repeat(None)
+        return "".join(
+            _with_speaker(text.strip(), speaker) + "\n"
+            for text, speaker in zip(transcript.segment_texts(), speakers, strict=False)
+        )
+
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        for segment in segments:
+            yield segment.text.strip() + "\n"
+
+
+class SubtitlesWriter(ResultWriter):
+    """
+    Renders subtitles with one cue per segment. When `max_line_width` and `max_line_count` are set and the transcript
+    has word timestamps, words are instead regrouped into cues of at most `max_line_count` lines of
+    `max_line_width` characters, optionally with the current word underlined.
+    """
+
+    always_include_hours: bool
+    decimal_marker: str
+
+    def __init__(
+        self,
+        output_dir: str = ".",
+        max_line_width: Union[int, None] = None,
+        max_line_count: Union[int, None] = None,
+        highlight_words: bool = False,
+    ):
+        super().__init__(output_dir)
+        self.max_line_width = max_line_width
+        self.max_line_count = max_line_count
+        self.highlight_words = highlight_words
+
+    def format_timestamp(self, seconds: float) -> str:
+        return format_timestamp(seconds, self.always_include_hours, self.decimal_marker)
+
+    def cues(self, transcript: Transcript) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields the start, end and text of every cue.
+        """
+        if transcript.has_words and self.max_line_width and self.max_line_count:
+            yield from self._word_cues(transcript)
+            return
+        speakers = transcript.speakers or repeat(None)
+        columns = zip(
+            transcript.starts.tolist(), transcript.ends.tolist(), transcript.segment_texts(), speakers, strict=False
+        )
+        for start, end, text, speaker in columns:
+            text = _with_speaker(text.strip().replace("-->", "->"), speaker)
+            yield self.format_timestamp(start), self.format_timestamp(end), text
+
+    def _word_cues(self, transcript: Transcript) -> Iterator[Tuple[str, str, str]]:
+        texts = transcript.word_texts()
+        # Engines either keep the leading space of every word, or expect them to be joined with spaces
+        separator = "" if transcript.language in ("ja", "zh") or any(t[:1].isspace() for t in texts) else " "
+        for speaker, words in self._group_words(transcript, texts):
+            start, end = self.format_timestamp(words[0][0]), self.format_timestamp(words[-1][1])
+            if not self.highlight_words:
+                yield start, end, self._cue_text(separator.join(word for _, _, word in words), speaker)
+                continue
+            last = start
+            for i, (word_start, word_end, _) in enumerate(words):
+                word_start, word_end = self.format_timestamp(word_start), self.format_timestamp(word_end)
+                if last != word_start:
+                    yield last, word_start, self._cue_text(separator.join(word for _, _, word in words), speaker)
+                text = separator.join(
+                    re.sub(r"^(\s*)(.*)$", r"\1<u>\2</u>", word) if j == i else word for j, (_, _, word) in enumerate(words)
+                )
+                yield word_start, word_end, self._cue_text(text, speaker)
+                last = word_end
 
+    @staticmethod
+    def _cue_text(text: str, speaker: Union[str, None]) -> str:
+        text = "\n".join(line.strip() for line in text.replace("-->", "->").split("\n"))
+        return _with_speaker(text, speaker)
 
-class WriteVTT(ResultWriter):
+    def _group_words(self, transcript: Transcript, texts: List[str]) -> Iterator[Tuple[Union[str, None], list]]:
+        """
+        Yields the speaker and the (start, end, text) words of every cue. A new line starts with a newline.
+        """
+        segments = np.repeat(np.arange(len(transcript)), np.diff(transcript.word_offsets)).tolist()
+        speakers = transcript.speakers or [None] * len(transcript)
+        line_length = 0
+        line_count = 1
+        cue = []
+        cue_speaker = None
+        last_start = last_end = float(transcript.starts[0]) if len(transcript) else 0.0
+        words = zip(texts, transcript.word_starts.tolist(), transcript.word_ends.tolist(), segments, strict=True)
+        for text, start, end, segment in words:
+            # Words without timestamps are placed at the end of the previous word
+            start, end = (last_end, last_end) if math.isnan(start) else (start, end)
+            speaker = speakers[segment]
+            long_pause = start - last_start > 3.0
+            if line_length > 0 and line_length + len(text) <= self.max_line_width and not long_pause and (
+                speaker == cue_speaker
+            ):
+                line_length += len(text)
+            else:
+                text = text.strip()
+                if cue and (long_pause or line_count >= self.max_line_count or speaker != cue_speaker):
+                    yield cue_speaker, cue
+                    cue = []
+                    line_count = 1
+                elif line_length > 0:
+                    line_count += 1
+                    text = "\n" + text
+                line_length = len(text.strip())
+            cue_speaker = speaker
+            cue.append((start, end, text))
+            last_start, last_end = start, end
+        if cue:
+            yield cue_speaker, cue
+
+
+class WriteVTT(SubtitlesWriter):
     extension: str = "vtt"
+    always_include_hours: bool = False
+    decimal_marker: str = "."
 
-    def write_result(self, result: dict, file: TextIO):
-        print("WEBVTT\n", file=file)
-        for segment in result["segments"]:
-            print(
+    def render(self, transcript: Transcript) -> str:
+        return "WEBVTT\n\n" + "".join(f"{start} --> {end}\n{text}\n\n" for start, end, text in self.cues(transcript))
+
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        yield "WEBVTT\n\n"
+        for segment in segments:
+            yield (
                 f"{format_timestamp(segment.start)} --> {format_timestamp(segment.end)}\n"
-                f"{segment.text.strip().replace('-->', '->')}\n",
-                file=file,
-                flush=True,
+                f"{segment.text.strip().replace('-->', '->')}\n\n"
             )
 
 
-class WriteSRT(ResultWriter):
+class WriteSRT(SubtitlesWriter):
     extension: str = "srt"
+    always_include_hours: bool = True
+    decimal_marker: str = ","
+
+    def render(self, transcript: Transcript) -> str:
+        return "".join(
+            f"{i}\n{start} --> {end}\n{text}\n\n" for i, (start, end, text) in enumerate(self.cues(transcript), start=1)
+        )
 
-    def write_result(self, result: dict, file: TextIO):
-        for i, segment in enumerate(result["segments"], start=1):
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        for i, segment in enumerate(segments, start=1):
             # write srt lines
-            print(
+            yield (
                 f"{i}\n"
                 f"{format_timestamp(segment.start, always_include_hours=True, decimal_marker=',')} --> "
                 f"{format_timestamp(segment.end, always_include_hours=True, decimal_marker=',')}\n"
-                f"{segment.text.strip().replace('-->', '->')}\n",
-                file=file,
-                flush=True,
+                f"{segment.text.strip().replace('-->', '->')}\n\n"
             )
 
 
@@ -77,51 +231,225 @@ class WriteTSV(ResultWriter):
 
     extension: str = "tsv"
 
-    def write_result(self, result: dict, file: TextIO):
-        print("start", "end", "text", sep="\t", file=file)
-        for segment in result["segments"]:
-            print(round(1000 * segment.start), file=file, end="\t")
-            print(round(1000 * segment.end), file=file, end="\t")
-            print(segment.text.strip().replace("\t", " "), file=file, flush=True)
+    def render(self, transcript: Transcript) -> str:
+        starts = np.round(transcript.starts * 1000).astype(np.int64).tolist()
+        ends = np.round(transcript.ends * 1000).astype(np.int64).tolist()
+        rows = zip(starts, ends, transcript.segment_texts(), strict=True)
+        return "start\tend\ttext\n" + "".join(
+            f"{start}\t{end}\t{text.strip().replace(chr(9), ' ')}\n" for start, end, text in rows
+        )
+
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        yield "start\tend\ttext\n"
+        for segment in segments:
+            text = segment.text.strip().replace("\t", " ")
+            yield f"{round(1000 * segment.start)}\t{round(1000 * segment.end)}\t{text}\n"
 
 
 class WriteJSON(ResultWriter):
     extension: str = "json"
 
-    def write_result(self, result: dict, file: TextIO):
-        if "segments" in result:
-            result["segments"] = [asdict(segment) for segment in result["segments"]]
-        json.dump(result, file)
+    def render(self, transcript: Transcript) -> str:
+        return json.dumps(transcript.to_dict())
+
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        # A JSON document can only be produced once all segments are known
+        yield self.render(Transcript.from_result({"language": language, "segments": list(segments)}))
+
+
+class WriteNDJSON(ResultWriter):
+    """
+    Write a transcript as newline-delimited JSON, one segment object per line, so that each segment can be
+    consumed as soon as it has been transcribed.
+    """
+
+    extension: str = "ndjson"
+
+    def render(self, transcript: Transcript) -> str:
+        return "".join(json.dumps(segment) + "\n" for segment in transcript.segments())
+
+    def iter_result(self, segments: Iterable, language: Union[str, None] = None) -> Iterator[str]:
+        for segment in segments:
+            yield json.dumps(segment_dict(segment)) + "\n"
+
+
+WRITERS = {"txt": WriteTXT, "vtt": WriteVTT, "srt": WriteSRT, "tsv": WriteTSV, "json": WriteJSON, "ndjson": WriteNDJSON}
+OUTPUT_FORMATS = list(WRITERS)
+
+
+def get_writer(output: Union[str, None], **subtitle_options) -> ResultWriter:
+    """
+    Returns the writer of an output format, plain text by default. `subtitle_options` apply to SRT and VTT.
+    """
+    writer = WRITERS.get(output, WriteTXT)
+    return writer(**subtitle_options) if issubclass(writer, SubtitlesWriter) else writer()
+
+
+def format_sse(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Wraps rendered output chunks as Server-Sent Events, one `data` event per chunk followed by an `end` event.
+    """
+    for chunk in chunks:
+        yield "".join(f"data: {line}\n" for line in chunk.rstrip("\n").split("\n")) + "\n"
+    yield "event: end\ndata: \n\n"
+
+
+def format_sse_error(message: str) -> str:
+    """
+    Formats the `error` event that ends Server-Sent Events early, in place of the `end` event.
+    """
+    return "event: error\n" + "".join(f"data: {line}\n" for line in message.split("\n")) + "\n"
+
+
+class PCMBuffer:
+    """
+    Growable float32 buffer that 16-bit PCM is decoded into chunk by chunk.
+
+    The buffer grows in place while it stays below `memory_limit` bytes. Past that it is moved to a
+    memory-mapped temporary file, so very long decodes do not have to fit in RAM.
+    """
+
+    def __init__(self, capacity: int = 30 * CONFIG.SAMPLE_RATE, memory_limit: int = 0):
+        self.memory_limit = memory_limit
+        self.data = np.empty(max(capacity, 1), np.float32)
+        self.size = 0
+        self._spool = None
+        self._remainder = b""
+
+    def write(self, chunk: bytes):
+        """
+        Appends little-endian int16 samples, converting them to float32 in [-1.0, 1.0).
+        """
+        if self._remainder:
+            chunk = self._remainder + chunk
+        cut = len(chunk) - len(chunk) % 2
+        self._remainder = chunk[cut:]
+        samples = np.frombuffer(chunk, np.int16, count=cut // 2)
+        self._reserve(self.size + len(samples))
+        out = self.data[self.size : self.size + len(samples)]
+        np.multiply(samples, np.float32(1 / 32768.0), out=out, dtype=np.float32)
+        self.size += len(samples)
+
+    def append(self, samples: np.ndarray):
+        """
+        Appends float32 samples.
+        """
+        self._reserve(self.size + len(samples))
+        self.data[self.size : self.size + len(samples)] = samples
+        self.size += len(samples)
+
+    def getvalue(self) -> np.ndarray:
+        """
+        Returns the decoded samples, releasing any unused capacity.
+        """
+        if self._spool is not None:
+            self._spool.close()
+            return self.data[: self.size]
+        self.data.resize(max(self.size, 1), refcheck=False)
+        return self.data[: self.size]
+
+    def _reserve(self, samples: int):
+        capacity = len(self.data)
+        if samples <= capacity:
+            return
+        capacity = max(samples, capacity + capacity // 2)
+        if self._spool is None and self.memory_limit and capacity * 4 > self.memory_limit:
+            self._spill(capacity)
+        elif self._spool is not None:
+            self.data.flush()
+            self._spool.truncate(capacity * 4)
+            self.data = np.memmap(self._spool, dtype=np.float32, mode="r+", shape=(capacity,))
+        else:
+            self.data.resize(capacity, refcheck=False)
+
+    def _spill(self, capacity: int):
+        # The file is unlinked right away; the mapping keeps the data alive until the array is released.
+        self._spool = tempfile.TemporaryFile(dir=CONFIG.AUDIO_SPOOL_DIR)
+        self._spool.truncate(capacity * 4)
+        spooled = np.memmap(self._spool, dtype=np.float32, mode="r+", shape=(capacity,))
+        spooled[: self.size] = self.data[: self.size]
+        self.data = spooled
+
+
+def _feed(source: BinaryIO, sink: BinaryIO, chunk_size: int):
+    try:
+        while chunk := source.read(chunk_size):
+            sink.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg exited early; the error is reported from its exit status
+        pass
+    finally:
+        try:
+            sink.close()
+        except BrokenPipeError:
+            pass
 
 
 def load_audio(file: BinaryIO, encode=True, sr: int = CONFIG.SAMPLE_RATE):
     """
     Open an audio file object and read as mono waveform, resampling as necessary.
     Modified from https://github.com/openai/whisper/blob/main/whisper/audio.py to accept a file object
+    WAV files, and FLAC files if libsndfile is installed, are decoded and resampled in-process. Other uploads
+    are streamed through ffmpeg in chunks. Audio is decoded into a single float32 buffer, which is moved to a
+    memory-mapped temporary file once it grows beyond `AUDIO_MEMORY_LIMIT`.
     Parameters
     ----------
     file: BinaryIO
         The audio file like object
     encode: Boolean
-        If true, encode audio stream to WAV before sending to whisper
+        If true, decode compressed formats through ffmpeg. If false, files that are not WAV or FLAC are read as
+        headerless 16-bit little-endian PCM at `sr`
     sr: int
         The sample rate to resample the audio if necessary
     Returns
     -------
     A NumPy array containing the audio waveform, in float32 dtype.
     """
-    if encode:
+    with stage("decode"):
+        memory_limit = CONFIG.AUDIO_MEMORY_LIMIT * 1024 * 1024
+        buffer = PCMBuffer(memory_limit=memory_limit)
+        chunk_size = CONFIG.AUDIO_CHUNK_SIZE
+
+        head, file = peek(file, 12)
+        fmt = sniff(head)
+        if can_decode(fmt, file):
+            orig_sr = decode_wav(file, buffer, chunk_size) if fmt == "wav" else decode_flac(file, buffer)
+            audio = buffer.getvalue()
+            if orig_sr == sr:
+                return audio
+            capacity = -(-audio.shape[0] * sr // orig_sr)
+            resampled = PCMBuffer(min(capacity, memory_limit // 4) if memory_limit else capacity, memory_limit)
+            for block in resample(audio, orig_sr, sr):
+                resampled.append(block)
+            return resampled.getvalue()
+
+        if not encode:
+            while chunk := file.read(chunk_size):
+                buffer.write(chunk)
+            return buffer.getvalue()
+
+        # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
+        # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
+        process = (
+            ffmpeg.input("pipe:", threads=0)
+            .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
+            .run_async(cmd="ffmpeg", pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+        )
+        stderr = []
+        feeder = Thread(target=_feed, args=(file, process.stdin, chunk_size), daemon=True)
+        drainer = Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        feeder.start()
+        drainer.start()
         try:
-            # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
-            # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
-            out, _ = (
-                ffmpeg.input("pipe:", threads=0)
-                .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
-                .run(cmd="ffmpeg", capture_stdout=True, capture_stderr=True, input=file.read())
-            )
-        except ffmpeg.Error as e:
-            raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
-    else:
-        out = file.read()
+            while chunk := process.stdout.read(chunk_size):
+                buffer.write(chunk)
+        finally:
+            process.stdout.close()
+            feeder.join()
+            drainer.join()
+            process.wait()
+
+        if process.returncode != 0:
+            raise RuntimeError(f"Failed to load audio: {b''.join(stderr).decode(errors='replace')}")
 
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+        return buffer.getvalue()
@@ -0,0 +1,126 @@
+"""
+Engine-independent voice activity detection, which removes silence before decoding for engines without their own VAD.
+"""
+
+from dataclasses import is_dataclass, replace
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from app.config import CONFIG
+
+
+class SpeechMap(NamedTuple):
+    """
+    Maps times in the trimmed audio back to the original audio. Span `i` starts at `offsets[i]` seconds in the trimmed
+    audio and at `sources[i]` seconds in the original audio.
+    """
+
+    offsets: np.ndarray
+    sources: np.ndarray
+
+    def to_original(self, times: np.ndarray, ends: bool = False) -> np.ndarray:
+        # The end of a span and the start of the next one are the same time in the trimmed audio; ends stay in the
+        # span they close
+        side = "left" if ends else "right"
+        spans = np.clip(np.searchsorted(self.offsets, times, side=side) - 1, 0, len(self.offsets) - 1)
+        return times - self.offsets[spans] + self.sources[spans]
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the start and end indices of the runs of True values.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    return edges[::2], edges[1::2]
+
+
+def _merge(starts: np.ndarray, ends: np.ndarray, min_gap: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges the spans separated by less than `min_gap`.
+    """
+    if len(starts) == 0:
+        return starts, ends
+    separate = starts[1:] - ends[:-1] >= min_gap
+    return starts[np.concatenate(([True], separate))], ends[np.concatenate((separate, [True]))]
+
+
+def speech_spans(
+    audio: np.ndarray,
+    sr: int = CONFIG.SAMPLE_RATE,
+    threshold_db: float = CONFIG.VAD_THRESHOLD_DB,
+    min_silence_seconds: float = CONFIG.VAD_MIN_SILENCE_SECONDS,
+    pad_seconds: float = CONFIG.VAD_SPEECH_PAD_SECONDS,
+    frame_seconds: float = 0.02,
+) -> List[Tuple[int, int]]:
+    """
+    Finds speech by frame energy. Frames louder than `threshold_db` above the noise floor are speech; silences
+    shorter than `min_silence_seconds` are kept, and every span is padded by `pad_seconds` of the surrounding audio.
+    Returns a list of (start, end) sample offsets.
+    """
+    frame = int(frame_seconds * sr)
+    n_frames = -(-audio.shape[0] // frame)
+    if n_frames == 0:
+        return []
+    frames = np.zeros(n_frames * frame, np.float32)
+    frames[: audio.shape[0]] = audio
+    power = np.einsum("ij,ij->i", frames.reshape(n_frames, frame), frames.reshape(n_frames, frame)) / frame
+    energy = 10 * np.log10(power + 1e-10)
+
+    floor, peak = np.percentile(energy, [10, 99])
+    # Digital silence would put the threshold far below any background noise, and audio without pauses would put it
+    # in the middle of the speech; the threshold stays between 50 dB and 20 dB below the loudest frames, and frames
+    # quieter than -60 dBFS are never speech
+    threshold = max(min(max(floor + threshold_db, peak - 50), peak - 20), -60)
+
+    starts, ends = _runs(energy > threshold)
+    starts, ends = _merge(starts, ends, int(min_silence_seconds / frame_seconds))
+    pad = int(pad_seconds / frame_seconds)
+    starts, ends = _merge(np.maximum(starts - pad, 0), np.minimum(ends + pad, n_frames), 1)
+    return [
+        (start * frame, min(end * frame, audio.shape[0])) for start, end in zip(starts.tolist(), ends.tolist(), strict=True)
+    ]
+
+
+def trim_silence(audio: np.ndarray, sr: int = CONFIG.SAMPLE_RATE) -> Tuple[np.ndarray, SpeechMap]:
+    """
+    Returns the speech of `audio` joined together, and the map from its times to the times of `audio`.
+    """
+    spans = speech_spans(audio, sr)
+    if not spans:
+        return audio[:0], SpeechMap(np.zeros(1), np.zeros(1))
+    starts, ends = np.array(spans).T
+    lengths = ends - starts
+    offsets = np.concatenate(([0], np.cumsum(lengths[:-1])))
+    trimmed = np.empty(int(lengths.sum()), np.float32)
+    for start, end, offset in zip(starts.tolist(), ends.tolist(), offsets.tolist(), strict=True):
+        trimmed[offset : offset + end - start] = audio[start:end]
+    return trimmed, SpeechMap(offsets / sr, starts / sr)
+
+
+def _get(item, name: str):
+    return getattr(item, name) if is_dataclass(item) else item.get(name)
+
+
+def _set(item, **values):
+    return replace(item, **values) if is_dataclass(item) else dict(item, **values)
+
+
+def restore_timestamps(result: dict, speech_map: SpeechMap) -> dict:
+    """
+    Maps the segment and word timestamps of a result on trimmed audio back to the original audio.
+    """
+    segments = result["segments"]
+    words = [word for segment in segments for word in _get(segment, "words") or () if _get(word, "start") is not None]
+    starts = speech_map.to_original(np.array([_get(item, "start") for item in [*segments, *words]], np.float64))
+    ends = speech_map.to_original(np.array([_get(item, "end") for item in [*segments, *words]], np.float64), ends=True)
+    times = iter(zip(starts.tolist(), ends.tolist(), strict=True))
+
+    mapped_segments = [_set(segment, start=start, end=end) for segment, (start, end) in zip(segments, times, strict=False)]
+    mapped_words = {id(word): _set(word, start=start, end=end) for word, (start, end) in zip(words, times, strict=False)}
+    for i, segment in enumerate(mapped_segments):
+        if _get(segment, "words"):
+            # Words without timestamps, which WhisperX could not align, are kept as they are
+            words = [mapped_words.get(id(word), word) for word in _get(segment, "words")]
+            mapped_segments[i] = _set(segment, words=words)
+    return dict(result, segments=mapped_segments)
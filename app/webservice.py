@@ -1,25 +1,76 @@
+import asyncio
 import importlib.metadata
+import json
 import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from io import StringIO
 from os import path
-from typing import Annotated, Optional, Union
+from threading import Event, Thread
+from typing import Annotated, AsyncIterator, Callable, Iterator, List, Literal, Optional, Union
 from urllib.parse import quote
 
 import click
 import uvicorn
-from fastapi import FastAPI, File, Query, UploadFile, applications
+from fastapi import FastAPI, File, Header, HTTPException, Query, Request, UploadFile, WebSocket, applications
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from whisper import tokenizer
 
+from app.batch import BatchItem, expand_uploads, format_multipart, format_ndjson, transcribe_batch
+from app.cache import transcription_cache
+from app.cancellation import DEADLINE_EXCEEDED, CancellationToken, RequestCancelled, cancellation
+from app.cascade import CASCADE_ENGINES, cascade_parameters, transcribe_cascade
 from app.config import CONFIG
-from app.factory.asr_model_factory import ASRModelFactory
-from app.utils import load_audio
+from app.executor import QueueFullError, executor
+from app.factory.asr_model_factory import ModelSpec, create_model_pool
+from app.jobs import JobRunner, JobStore
+from app.languages import LANGUAGES
+from app.metrics import registry, stage, track_request_memory
+from app.scheduling import PRIORITIES, scheduling
+from app.streaming import SAMPLE_FORMATS, StreamingTranscriber, decode_frames
+from app.transcript import Transcript
+from app.utils import format_sse, format_sse_error, load_audio
 
-asr_model = ASRModelFactory.create_asr_model()
-asr_model.load_model()
+model_pool = create_model_pool()
+model_ready = Event()
+model_error = None
+
+# With several workers, interrupted jobs are requeued by the supervisor, before the workers start and when it restarts one
+job_store = JobStore(CONFIG.JOBS_DIR, recover=CONFIG.WORKER_INDEX is None, worker=CONFIG.WORKER_INDEX)
+job_runner = JobRunner(job_store, model_pool, CONFIG.JOBS_TTL)
+
+registry.gauge("asr_queue_depth", "Requests admitted and not yet finished.", function=lambda: executor.admitted)
+registry.gauge("asr_queue_capacity", "Maximum number of requests admitted at once.", function=lambda: executor.capacity)
+
+LANGUAGE_CODES = sorted(LANGUAGES.keys())
+OutputFormat = Literal["txt", "vtt", "srt", "tsv", "json", "ndjson"]
+# Requests for a model that is not in the pool are rejected with 422 before any work is done
+ModelName = Literal[tuple(model_pool.names)]
+
+
+def warm_up():
+    """
+    Loads the default model and runs a dummy transcription, after which the service reports ready.
+    """
+    global model_error
+    try:
+        model_pool.warmup()
+    except Exception as e:
+        model_error = str(e)
+        print(f"Model warm-up failed: {e}")
+    else:
+        model_ready.set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The model is loaded in the background, so the server starts listening and passes liveness probes right away
+    Thread(target=warm_up, daemon=True).start()
+    job_runner.start()
+    yield
 
-LANGUAGE_CODES = sorted(tokenizer.LANGUAGES.keys())
 
 projectMetadata = importlib.metadata.metadata("whisper-asr-webservice")
 app = FastAPI(
@@ -29,6 +80,7 @@ app = FastAPI(
     contact={"url": projectMetadata["Home-page"]},
     swagger_ui_parameters={"defaultModelsExpandDepth": -1},
     license_info={"name": "MIT License", "url": "https://github.com/ahmetoner/whisper-asr-webservice/blob/main/LICENCE"},
+    lifespan=lifespan,
 )
 
 assets_path = os.getcwd() + "/swagger-ui-assets"
@@ -47,6 +99,38 @@ if path.exists(assets_path + "/swagger-ui.css") and path.exists(assets_path + "/
     applications.get_swagger_ui_html = swagger_monkey_patch
 
 
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    Streaming response that calls `on_close` once it has been sent, or has failed to be, including when the client
+    disconnected before its body was read.
+    """
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request: Request, exc: RequestCancelled):
+    # 499 is only seen in logs, as the client that disconnected does not read the response
+    return JSONResponse(status_code=504 if exc.reason == DEADLINE_EXCEEDED else 499, content={"detail": str(exc)})
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/", response_class=RedirectResponse, include_in_schema=False)
 async def index():
     return "/docs"
@@ -54,17 +138,16 @@ async def index():
 
 @app.post("/asr", tags=["Endpoints"])
 async def asr(
+    request: Request,
     audio_file: UploadFile = File(...),  # noqa: B008
     encode: bool = Query(default=True, description="Encode audio first through ffmpeg"),
+    model: Union[ModelName, None] = Query(default=CONFIG.MODEL_NAME, description="Model to use"),  # noqa: B008
     task: Union[str, None] = Query(default="transcribe", enum=["transcribe", "translate"]),
     language: Union[str, None] = Query(default=None, enum=LANGUAGE_CODES),
     initial_prompt: Union[str, None] = Query(default=None),
     vad_filter: Annotated[
         bool | None,
-        Query(
-            description="Enable the voice activity detection (VAD) to filter out parts of the audio without speech",
-            include_in_schema=(True if CONFIG.ASR_ENGINE == "faster_whisper" else False),
-        ),
+        Query(description="Enable the voice activity detection (VAD) to filter out parts of the audio without speech"),
     ] = False,
     word_timestamps: bool = Query(
         default=False,
@@ -86,41 +169,583 @@ async def asr(
         description="Max speakers in this file",
         include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" else False),
     ),
-    output: Union[str, None] = Query(default="txt", enum=["txt", "vtt", "srt", "tsv", "json"]),
+    output: List[OutputFormat] = Query(  # noqa: B008
+        default=["txt"],
+        description="Output formats; several formats are returned together as a JSON object",
+    ),
+    stream: Union[str, None] = Query(
+        default=None,
+        enum=["chunked", "sse"],
+        description="Send each segment as soon as it is transcribed, as a chunked response or as Server-Sent Events",
+    ),
+    timeout: Union[float, None] = Query(
+        default=None,
+        gt=0,
+        description="Seconds after which the transcription is aborted, also accepted as the Asr-Timeout header",
+    ),
+    asr_timeout: Union[float, None] = Header(default=None, gt=0, include_in_schema=False),
+    priority: str = Query(
+        default="normal",
+        enum=list(PRIORITIES),
+        description="Scheduling class; shorter files and higher classes get the model first",
+    ),
+    cascade: bool = Query(
+        default=CONFIG.CASCADE_DEFAULT,
+        description="Transcribe with the draft model first, and only its uncertain segments with `model`",
+        include_in_schema=bool(CONFIG.CASCADE_DRAFT_MODEL),
+    ),
 ):
-    result = asr_model.transcribe(
-        load_audio(audio_file.file, encode),
-        task,
-        language,
-        initial_prompt,
-        vad_filter,
-        word_timestamps,
-        {"diarize": diarize, "min_speakers": min_speakers, "max_speakers": max_speakers},
-        output,
-    )
-    return StreamingResponse(
-        result,
-        media_type="text/plain",
-        headers={
-            "Asr-Engine": CONFIG.ASR_ENGINE,
-            "Content-Disposition": f'attachment; filename="{quote(audio_file.filename)}.{output}"',
-        },
+    spec = ModelSpec.parse(model)
+    headers = {"Asr-Engine": spec.engine, "Asr-Model": spec.model_name}
+    options = {"diarize": diarize, "min_speakers": min_speakers, "max_speakers": max_speakers}
+    outputs = list(dict.fromkeys(output))
+
+    if cascade:
+        if not CONFIG.CASCADE_DRAFT_MODEL:
+            raise HTTPException(status_code=400, detail="Cascaded transcription requires CASCADE_DRAFT_MODEL")
+        if {spec.engine, ModelSpec.parse(CONFIG.CASCADE_DRAFT_MODEL).engine} - set(CASCADE_ENGINES):
+            raise HTTPException(status_code=400, detail="Cascaded transcription requires decoding scores")
+        if stream:
+            raise HTTPException(status_code=400, detail="Cascaded transcriptions cannot be streamed")
+
+    if stream:
+        if len(outputs) != 1:
+            raise HTTPException(status_code=400, detail="Streamed responses have a single output format")
+        headers["Content-Disposition"] = f'attachment; filename="{quote(audio_file.filename)}.{outputs[0]}"'
+        if not executor.try_admit():
+            raise QueueFullError(executor.retry_after)
+        try:
+            audio = await executor.decode(load_audio, audio_file.file, encode)
+        except BaseException:
+            executor.release()
+            raise
+        chunks = _transcribe_stream(
+            model, audio, task, language, initial_prompt, vad_filter, word_timestamps, options, outputs[0]
+        )
+        token = CancellationToken(timeout or asr_timeout or CONFIG.REQUEST_TIMEOUT)
+        if stream == "sse":
+            chunks = format_sse(chunks)
+        with scheduling(priority, audio.shape[0] / CONFIG.SAMPLE_RATE), cancellation(token):
+            chunks = _stream_on_executor(chunks, token, lambda error: _format_stream_error(error, stream, outputs[0]))
+        media_type = "text/event-stream" if stream == "sse" else "text/plain"
+        return ClosingStreamingResponse(
+            chunks,
+            # Stops the transcription if the response was closed before it ended
+            on_close=lambda: token.cancel("client disconnected"),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    async with _cancel_on_disconnect(request, timeout or asr_timeout):
+        with executor.admit(), track_request_memory():
+            audio = await executor.decode(load_audio, audio_file.file, encode)
+            transcript_id = await executor.decode(
+                transcription_cache.key,
+                audio,
+                *spec,
+                task,
+                language,
+                initial_prompt,
+                vad_filter,
+                word_timestamps,
+                options,
+                # Transcripts without cascade keep the keys they were cached under
+                *(cascade_parameters() if cascade else ()),
+            )
+            with scheduling(priority, audio.shape[0] / CONFIG.SAMPLE_RATE):
+                transcript = await executor.infer(
+                    transcription_cache.get_or_compute,
+                    transcript_id,
+                    lambda: _transcribe(
+                        model, audio, task, language, initial_prompt, vad_filter, word_timestamps, options, cascade=cascade
+                    ),
+                )
+    return await _render_response(transcript_id, transcript, outputs, audio_file.filename, headers)
+
+
+@asynccontextmanager
+async def _cancel_on_disconnect(request: Request, timeout: Union[float, None]) -> AsyncIterator[CancellationToken]:
+    """
+    Cancels the request in the block when its client disconnects or its deadline passes.
+    """
+    token = CancellationToken(timeout or CONFIG.REQUEST_TIMEOUT)
+    watcher = asyncio.create_task(_watch_disconnect(request, token))
+    try:
+        with cancellation(token):
+            yield token
+    finally:
+        watcher.cancel()
+
+
+async def _watch_disconnect(request: Request, token: CancellationToken):
+    # The upload has been read, so the next message the server receives is the disconnection of the client
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            token.cancel("client disconnected")
+            return
+
+
+@app.post("/asr/batch", tags=["Endpoints"])
+async def asr_batch(
+    audio_files: List[UploadFile] = File(..., description="Audio files, or zip or tar archives of audio files"),  # noqa: B008
+    encode: bool = Query(default=True, description="Encode audio first through ffmpeg"),
+    model: Union[ModelName, None] = Query(default=CONFIG.MODEL_NAME, description="Model to use"),  # noqa: B008
+    task: Union[str, None] = Query(default="transcribe", enum=["transcribe", "translate"]),
+    language: Union[str, None] = Query(default=None, enum=LANGUAGE_CODES),
+    initial_prompt: Union[str, None] = Query(default=None),
+    vad_filter: Annotated[
+        bool | None,
+        Query(description="Enable the voice activity detection (VAD) to filter out parts of the audio without speech"),
+    ] = False,
+    word_timestamps: bool = Query(
+        default=False,
+        description="Word level timestamps",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "faster_whisper" else False),
+    ),
+    diarize: bool = Query(
+        default=False,
+        description="Diarize the input",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" and CONFIG.HF_TOKEN != "" else False),
+    ),
+    min_speakers: Union[int, None] = Query(
+        default=None,
+        description="Min speakers in this file",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" else False),
+    ),
+    max_speakers: Union[int, None] = Query(
+        default=None,
+        description="Max speakers in this file",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" else False),
+    ),
+    output: Union[str, None] = Query(default="txt", enum=["txt", "vtt", "srt", "tsv", "json", "ndjson"]),
+    response_format: str = Query(
+        default="ndjson",
+        enum=["ndjson", "multipart"],
+        description="Send one JSON line, or one multipart/mixed part, per file as soon as it is transcribed",
+    ),
+    priority: str = Query(
+        default="normal",
+        enum=list(PRIORITIES),
+        description="Scheduling class of every file; shorter files and higher classes get the model first",
+    ),
+):
+    spec = ModelSpec.parse(model)
+    options = {"diarize": diarize, "min_speakers": min_speakers, "max_speakers": max_speakers}
+
+    # The whole batch takes a single slot of the request queue, which is held until the response has been sent
+    if not executor.try_admit():
+        raise QueueFullError(executor.retry_after)
+    # Files still queued or being transcribed are abandoned when the client disconnects
+    token = CancellationToken()
+
+    def close():
+        token.cancel("client disconnected")
+        executor.release()
+
+    try:
+        items = await executor.decode(expand_uploads, [(file.filename, file.file) for file in audio_files])
+    except BaseException:
+        close()
+        raise
+
+    async def decode(item: BatchItem):
+        return await executor.decode(lambda: load_audio(item.open(), encode))
+
+    def compute(audio) -> Transcript:
+        with cancellation(token):
+            return _transcribe(model, audio, task, language, initial_prompt, vad_filter, word_timestamps, options)
+
+    async def transcribe(item: BatchItem, audio) -> str:
+        transcript_id = await executor.decode(
+            transcription_cache.key,
+            audio,
+            *spec,
+            task,
+            language,
+            initial_prompt,
+            vad_filter,
+            word_timestamps,
+            options,
+        )
+        with scheduling(priority, audio.shape[0] / CONFIG.SAMPLE_RATE):
+            transcript = await executor.infer(
+                transcription_cache.get_or_compute,
+                transcript_id,
+                lambda: compute(audio),
+            )
+        return (await executor.decode(_render, transcript, [output]))[output]
+
+    results = transcribe_batch(items, decode, transcribe, CONFIG.BATCH_PREFETCH)
+    headers = {"Asr-Engine": spec.engine, "Asr-Model": spec.model_name, "Asr-Batch-Size": str(len(items))}
+    if response_format == "multipart":
+        boundary = uuid.uuid4().hex
+        return ClosingStreamingResponse(
+            format_multipart(results, output, boundary),
+            on_close=close,
+            media_type=f"multipart/mixed; boundary={boundary}",
+            headers=headers,
+        )
+    return ClosingStreamingResponse(
+        format_ndjson(results), on_close=close, media_type="application/x-ndjson", headers=headers
     )
 
 
+def _transcribe(model: str, audio, *args, cascade: bool = False) -> Transcript:
+    if cascade:
+        result = transcribe_cascade(model_pool, CONFIG.CASCADE_DRAFT_MODEL, model, audio, *args)
+    else:
+        with model_pool.acquire(model) as asr_model:
+            result = asr_model.transcribe_audio(audio, *args)
+    with stage("write"):
+        return Transcript.from_result(result, model=model)
+
+
+def _render(transcript: Transcript, outputs: List[str]) -> dict:
+    """
+    Renders a transcript in every output format, with the writers of the model that produced it.
+    """
+    asr_model = model_pool.instance(transcript.model if transcript.model in model_pool.names else None)
+    with stage("write"):
+        return {output: asr_model.render(transcript, output) for output in outputs}
+
+
+async def _render_response(
+    transcript_id: str, transcript: Transcript, outputs: List[str], filename: str, headers: dict
+) -> Response:
+    """
+    Returns a single output as text, or several outputs as a JSON object.
+    """
+    rendered = await executor.decode(_render, transcript, outputs)
+    headers = {**headers, "Asr-Transcript-Id": transcript_id}
+    if transcript.escalated is not None:
+        headers["Asr-Cascade-Escalated"] = f"{transcript.escalated:.4f}"
+    if len(outputs) == 1:
+        headers["Content-Disposition"] = f'attachment; filename="{quote(filename)}.{outputs[0]}"'
+        return PlainTextResponse(rendered[outputs[0]], headers=headers)
+    content = {"transcript_id": transcript_id, "language": transcript.language, "outputs": rendered}
+    if transcript.escalated is not None:
+        content["escalated"] = transcript.escalated
+    return JSONResponse(content, headers=headers)
+
+
+def _transcribe_stream(model: str, audio, *args) -> Iterator[str]:
+    with model_pool.acquire(model) as asr_model:
+        yield from asr_model.transcribe_stream(audio, *args)
+
+
+def _detect_language(model: str, audio):
+    with model_pool.acquire(model) as asr_model, stage("language_detection"):
+        return asr_model.language_detection(audio)
+
+
+def _stream_on_executor(
+    chunks: Iterator[str], token: CancellationToken, format_error: Callable[[Exception], str]
+) -> AsyncIterator[str]:
+    """
+    Starts a streamed transcription on the inference pool, where it is scheduled like any other request, and returns
+    its chunks as they are produced. The queue slot of the request is held until the transcription has stopped.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for chunk in chunks:
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    # The task captures the context of the request, such as its scheduling job
+    task = asyncio.ensure_future(executor.infer(produce))
+    task.add_done_callback(_finish_stream)
+    return _drain_stream(queue, task, token, format_error)
+
+
+def _finish_stream(task: asyncio.Future):
+    executor.release()
+    if not task.cancelled():
+        # Retrieved here, as nobody awaits the transcription of a client that went away
+        task.exception()
+
+
+async def _drain_stream(
+    queue: asyncio.Queue, task: asyncio.Future, token: CancellationToken, format_error: Callable[[Exception], str]
+) -> AsyncIterator[str]:
+    """
+    Sends the chunks of a streamed transcription until it ends or its deadline passes. The status of the response has
+    been sent with the first chunk, so an error ends the response with the chunk returned by `format_error` instead.
+    """
+    try:
+        while True:
+            remaining = None if token.deadline is None else max(0.0, token.deadline - time.monotonic())
+            try:
+                # Engines that only yield their whole output at once are not waited for past the deadline
+                chunk = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                token.cancel(DEADLINE_EXCEEDED)
+                yield format_error(RequestCancelled(DEADLINE_EXCEEDED))
+                return
+            if chunk is None:
+                break
+            yield chunk
+        try:
+            await task
+        except Exception as error:
+            yield format_error(error)
+            if not isinstance(error, RequestCancelled):
+                raise
+    finally:
+        # Stops the transcription if the response was closed before it ended
+        token.cancel("client disconnected")
+
+
+def _format_stream_error(error: Exception, stream: str, output: str) -> str:
+    """
+    Formats the error that ended a streamed response: an `error` event for Server-Sent Events, a JSON line for the
+    `ndjson` output, and a last line starting with `ERROR:` otherwise.
+    """
+    if stream == "sse":
+        return format_sse_error(str(error))
+    if output == "ndjson":
+        return json.dumps({"error": str(error)}) + "\n"
+    return f"\nERROR: {error}\n"
+
+
 @app.post("/detect-language", tags=["Endpoints"])
 async def detect_language(
     audio_file: UploadFile = File(...),  # noqa: B008
     encode: bool = Query(default=True, description="Encode audio first through FFmpeg"),
+    model: Union[ModelName, None] = Query(default=CONFIG.MODEL_NAME, description="Model to use"),  # noqa: B008
 ):
-    detected_lang_code, confidence = asr_model.language_detection(load_audio(audio_file.file, encode))
+    with executor.admit(), track_request_memory():
+        audio = await executor.decode(load_audio, audio_file.file, encode)
+        detected_lang_code, confidence = await executor.infer(_detect_language, model, audio)
     return {
-        "detected_language": tokenizer.LANGUAGES[detected_lang_code],
+        "detected_language": LANGUAGES[detected_lang_code],
         "language_code": detected_lang_code,
         "confidence": confidence,
     }
 
 
+@app.websocket("/asr/stream")
+async def asr_stream(
+    websocket: WebSocket,
+    model: str = CONFIG.MODEL_NAME,
+    task: str = "transcribe",
+    language: Union[str, None] = None,
+    initial_prompt: Union[str, None] = None,
+    format: str = "s16le",
+):
+    """
+    Transcribes raw PCM frames at SAMPLE_RATE, sent as binary messages, while they arrive. Partial hypotheses and
+    final segments are sent back as JSON messages. A text message ends the stream.
+    """
+    if (
+        model not in model_pool.names
+        or task not in ("transcribe", "translate")
+        or (language and language not in LANGUAGES)
+        or format not in SAMPLE_FORMATS
+    ):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    transcriber = StreamingTranscriber(task, language, initial_prompt)
+    running = None
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("text") is not None:
+                break
+            try:
+                transcriber.feed(decode_frames(message["bytes"], format))
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": f"Frames are not {format} samples"})
+                await websocket.close(code=1003)
+                return
+
+            if running is not None and running.done():
+                running.result()
+                running = None
+            if running is None and transcriber.ready():
+                running = asyncio.create_task(_stream_pass(websocket, model, transcriber))
+
+        if running is not None:
+            await running
+        for message in await executor.infer(_stream_step, model, transcriber, True):
+            await websocket.send_json(message)
+        await websocket.send_json({"type": "done"})
+        await websocket.close()
+    finally:
+        if running is not None and not running.done():
+            running.cancel()
+
+
+async def _stream_pass(websocket: WebSocket, model: str, transcriber: StreamingTranscriber):
+    if not executor.try_admit():
+        # Under load, passes are skipped and the next one covers the audio received in the meantime
+        return
+    try:
+        messages = await executor.infer(_stream_step, model, transcriber)
+    finally:
+        executor.release()
+    for message in messages:
+        await websocket.send_json(message)
+
+
+def _stream_step(model: str, transcriber: StreamingTranscriber, final: bool = False) -> list:
+    with model_pool.acquire(model) as asr_model:
+        return transcriber.finish(asr_model) if final else transcriber.process(asr_model)
+
+
+@app.post("/jobs", tags=["Jobs"])
+async def create_job(
+    audio_file: UploadFile = File(...),  # noqa: B008
+    encode: bool = Query(default=True, description="Encode audio first through ffmpeg"),
+    model: Union[ModelName, None] = Query(default=CONFIG.MODEL_NAME, description="Model to use"),  # noqa: B008
+    task: Union[str, None] = Query(default="transcribe", enum=["transcribe", "translate"]),
+    language: Union[str, None] = Query(default=None, enum=LANGUAGE_CODES),
+    initial_prompt: Union[str, None] = Query(default=None),
+    vad_filter: Annotated[
+        bool | None,
+        Query(description="Enable the voice activity detection (VAD) to filter out parts of the audio without speech"),
+    ] = False,
+    word_timestamps: bool = Query(
+        default=False,
+        description="Word level timestamps",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "faster_whisper" else False),
+    ),
+    diarize: bool = Query(
+        default=False,
+        description="Diarize the input",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" and CONFIG.HF_TOKEN != "" else False),
+    ),
+    min_speakers: Union[int, None] = Query(
+        default=None,
+        description="Min speakers in this file",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" else False),
+    ),
+    max_speakers: Union[int, None] = Query(
+        default=None,
+        description="Max speakers in this file",
+        include_in_schema=(True if CONFIG.ASR_ENGINE == "whisperx" else False),
+    ),
+):
+    params = {
+        "encode": encode,
+        "model": model,
+        "task": task,
+        "language": language,
+        "initial_prompt": initial_prompt,
+        "vad_filter": vad_filter,
+        "word_timestamps": word_timestamps,
+        "options": {"diarize": diarize, "min_speakers": min_speakers, "max_speakers": max_speakers},
+    }
+    job_id = await executor.decode(job_store.create, audio_file.file, audio_file.filename, params)
+    job_runner.notify()
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "progress": {"processed": job["processed"], "total": job["duration"]},
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+@app.get("/jobs/{job_id}/result", tags=["Jobs"])
+async def get_job_result(
+    job_id: str,
+    output: Union[str, None] = Query(default="txt", enum=["txt", "vtt", "srt", "tsv", "json", "ndjson"]),
+):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+    model = job["params"].get("model")
+    asr_model = model_pool.instance(model if model in model_pool.names else None)
+
+    def render():
+        output_file = StringIO()
+        with stage("write"):
+            asr_model.write_result(job_store.load_result(job_id), output_file, output)
+        output_file.seek(0)
+        return output_file
+
+    return StreamingResponse(
+        await executor.decode(render),
+        media_type="text/plain",
+        headers={
+            "Asr-Engine": asr_model.engine,
+            "Content-Disposition": f'attachment; filename="{quote(job["filename"] or job_id)}.{output}"',
+        },
+    )
+
+
+@app.get("/transcripts/{transcript_id}", tags=["Endpoints"])
+async def get_transcript(
+    transcript_id: str,
+    output: List[OutputFormat] = Query(  # noqa: B008
+        default=["txt"],
+        description="Output formats; several formats are returned together as a JSON object",
+    ),
+):
+    transcript = await executor.decode(transcription_cache.get, transcript_id)
+    if transcript is None:
+        raise HTTPException(status_code=404, detail="Transcript not found")
+    spec = ModelSpec.parse(transcript.model or CONFIG.MODEL_NAME)
+    headers = {"Asr-Engine": spec.engine, "Asr-Model": spec.model_name}
+    return await _render_response(transcript_id, transcript, list(dict.fromkeys(output)), transcript_id, headers)
+
+
+@app.get("/health/live", tags=["Health"])
+async def health_live():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["Health"])
+async def health_ready():
+    if model_ready.is_set():
+        return {"status": "ready"}
+    if model_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": model_error})
+    return JSONResponse(status_code=503, content={"status": "loading"})
+
+
+@app.get("/models", tags=["Endpoints"])
+async def models():
+    stats = model_pool.stats()
+    return {
+        "models": model_pool.names,
+        **stats,
+        "engines": {name: model_pool.instance(name).stats() for name in stats["loaded"]},
+    }
+
+
+@app.get("/metrics", tags=["Endpoints"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=registry.content_type)
+
+
+@app.get("/cache/stats", tags=["Endpoints"])
+async def cache_stats():
+    return transcription_cache.stats()
+
+
 @click.command()
 @click.option(
     "-h",
@@ -136,9 +761,21 @@ async def detect_language(
     default=9000,
     help="Port for the webservice (default: 9000)",
 )
+@click.option(
+    "-w",
+    "--workers",
+    metavar="WORKERS",
+    default=CONFIG.WORKERS,
+    help="Number of worker processes, or 'auto' for one per 4 CPU cores (default: 1)",
+)
 @click.version_option(version=projectMetadata["Version"])
-def start(host: str, port: Optional[int] = None):
-    uvicorn.run(app, host=host, port=port)
+def start(host: str, port: Optional[int] = None, workers: str = "1"):
+    if workers == "auto" or int(workers) > 1:
+        from app.prefork import serve
+
+        serve(host, port, workers)
+    else:
+        uvicorn.run(app, host=host, port=port)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+import io
+import wave
+
+import ffmpeg
+import numpy as np
+
+from app.config import CONFIG
+
+# Container formats that are encoded through ffmpeg, by file extension
+FFMPEG_FORMATS = {"mp3": "mp3", "flac": "flac", "ogg": "ogg", "m4a": "ipod"}
+
+
+def synthetic_speech(duration: float, sr: int = CONFIG.SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """
+    Generates `duration` seconds of speech-like audio: bursts of harmonic tones with a varying pitch, separated by
+    short pauses, over a low noise floor. The same seed always yields the same samples.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * sr)
+    audio = rng.normal(0, 0.003, n_samples).astype(np.float32)
+
+    position = 0
+    while position < n_samples:
+        length = min(int(rng.uniform(0.2, 1.5) * sr), n_samples - position)
+        t = np.arange(length, dtype=np.float32) / sr
+        pitch = rng.uniform(90, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(2, 6) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sr
+        burst = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 6))
+        envelope = np.sin(np.pi * t / t[-1]) if length > 1 else np.ones(1)
+        audio[position : position + length] += 0.2 * burst * envelope
+        position += length + int(rng.uniform(0.1, 0.6) * sr)
+
+    return np.clip(audio, -1, 1)
+
+
+def encode(audio: np.ndarray, fmt: str, sr: int = CONFIG.SAMPLE_RATE) -> bytes:
+    """
+    Encodes mono float32 audio as `pcm` (raw 16-bit little-endian, as expected by `encode=false`), `wav`, or one of
+    the compressed formats in `FFMPEG_FORMATS`.
+    """
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+    if fmt == "pcm":
+        return pcm
+    if fmt == "wav":
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sr)
+            f.writeframes(pcm)
+        return buffer.getvalue()
+    if fmt not in FFMPEG_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    out, _ = (
+        ffmpeg.input("pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
+        .output("pipe:", format=FFMPEG_FORMATS[fmt])
+        .run(cmd="ffmpeg", input=pcm, capture_stdout=True, capture_stderr=True)
+    )
+    return out
@@ -0,0 +1,109 @@
+"""
+Benchmarks audio decoding, the ASR engines and the output writers in isolation.
+
+    ASR_ENGINE=stub python -m benchmarks.components --duration 10 --duration 60 --format wav --format mp3
+"""
+
+import io
+import time
+from typing import Tuple
+
+import click
+
+from app.config import CONFIG
+from app.factory.asr_model_factory import ASRModelFactory
+from app.utils import load_audio
+from benchmarks.audio import encode, synthetic_speech
+from benchmarks.report import print_table, save, summarize
+
+COLUMNS = ["benchmark", "engine", "model", "format", "output", "seconds", "count", "p50", "p95", "p99", "rtf"]
+OUTPUTS = ("txt", "vtt", "srt", "tsv", "json", "ndjson")
+
+
+def _time(repeat: int, func, *args) -> Tuple[list, object]:
+    latencies = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies, result
+
+
+def _decode(data: bytes, encode_audio: bool):
+    return load_audio(io.BytesIO(data), encode_audio)
+
+
+def _write(asr_model, result: dict, output: str) -> str:
+    output_file = io.StringIO()
+    asr_model.write_result(result, output_file, output)
+    return output_file.getvalue()
+
+
+@click.command()
+@click.option("--duration", "durations", multiple=True, type=float, default=(10, 60, 300), show_default=True,
+              help="Duration of the synthetic audio in seconds")
+@click.option("--format", "formats", multiple=True, default=("pcm", "wav", "mp3", "flac"), show_default=True,
+              help="Upload format to decode")
+@click.option("--engine", "engines", multiple=True, default=(CONFIG.ASR_ENGINE,), show_default=True,
+              help="ASR engine to benchmark")
+@click.option("--model", default=CONFIG.MODEL_NAME, show_default=True, help="Model of the engines")
+@click.option("--output", "outputs", multiple=True, default=OUTPUTS, show_default=True, help="Writer to benchmark")
+@click.option("--repeat", default=5, show_default=True, help="Runs of every benchmark")
+@click.option("--seed", default=0, show_default=True, help="Seed of the synthetic audio")
+@click.option("--json", "json_path", default=None, help="Write the results to this JSON file")
+def main(durations, formats, engines, model, outputs, repeat, seed, json_path):
+    rows = []
+    clips = {duration: synthetic_speech(duration, seed=seed) for duration in durations}
+
+    for duration, audio in clips.items():
+        for fmt in formats:
+            data = encode(audio, fmt)
+            latencies, _ = _time(repeat, _decode, data, fmt != "pcm")
+            rows.append({"benchmark": "decode", "format": fmt, "seconds": duration, **summarize(latencies, duration)})
+
+    for engine in engines:
+        asr_model = ASRModelFactory.create_asr_model(engine, model)
+        latencies, _ = _time(1, asr_model.load_model)
+        rows.append({"benchmark": "load", "engine": engine, "model": model, **summarize(latencies)})
+
+        for duration, audio in clips.items():
+            # The first run warms up the model and is not measured
+            asr_model.transcribe_audio(audio, "transcribe", None, None, False, False, {})
+            latencies, result = _time(
+                repeat, asr_model.transcribe_audio, audio, "transcribe", None, None, False, False, {}
+            )
+            rows.append({
+                "benchmark": "transcribe",
+                "engine": engine,
+                "model": model,
+                "seconds": duration,
+                **summarize(latencies, duration),
+            })
+
+            for output in outputs:
+                latencies, _ = _time(repeat, _write, asr_model, result, output)
+                rows.append({
+                    "benchmark": "write",
+                    "engine": engine,
+                    "output": output,
+                    "seconds": duration,
+                    **summarize(latencies),
+                })
+
+    print_table(rows, COLUMNS)
+    save(
+        json_path,
+        rows,
+        durations=durations,
+        formats=formats,
+        engines=engines,
+        model=model,
+        outputs=outputs,
+        repeat=repeat,
+        seed=seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Drives the webservice under concurrent load and reports latency percentiles, real-time factor and throughput.
+
+Without `--url`, the FastAPI app is started in-process with the configured engine:
+
+    ASR_ENGINE=stub python -m benchmarks.load --concurrency 8 --requests 200 --duration 30
+"""
+
+import socket
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from typing import Tuple, Union
+
+import click
+
+from benchmarks.audio import encode, synthetic_speech
+from benchmarks.report import print_table, save, summarize
+
+COLUMNS = ["endpoint", "concurrency", "count", "p50", "p95", "p99", "mean", "rtf", "rps", "statuses"]
+
+
+def _start_server() -> str:
+    import uvicorn
+
+    from app.webservice import app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def _multipart(data: bytes, filename: str) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        f'Content-Disposition: form-data; name="audio_file"; filename="{filename}"\r\n'.encode(),
+        b"Content-Type: application/octet-stream\r\n\r\n",
+        data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _request(url: str, body: bytes, content_type: str) -> Tuple[float, Union[int, str]]:
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        status = type(e).__name__
+    return time.perf_counter() - start, status
+
+
+@click.command()
+@click.option("--url", default=None, help="Base URL of a running webservice. Starts the app in-process if not set")
+@click.option("--endpoint", default="/asr", show_default=True, type=click.Choice(["/asr", "/detect-language"]))
+@click.option("--concurrency", "concurrencies", multiple=True, type=int, default=(1, 4), show_default=True,
+              help="Number of concurrent clients")
+@click.option("--requests", "n_requests", default=50, show_default=True, help="Requests per concurrency level")
+@click.option("--warmup", default=2, show_default=True, help="Unmeasured requests sent before each level")
+@click.option("--duration", default=30.0, show_default=True, help="Duration of the synthetic audio in seconds")
+@click.option("--format", "fmt", default="wav", show_default=True, help="Upload format")
+@click.option("--output", default="txt", show_default=True, help="Output format requested from /asr")
+@click.option("--seed", default=0, show_default=True, help="Seed of the synthetic audio")
+@click.option("--json", "json_path", default=None, help="Write the results to this JSON file")
+def main(url, endpoint, concurrencies, n_requests, warmup, duration, fmt, output, seed, json_path):
+    base_url = url or _start_server()
+    query = f"?encode={'false' if fmt == 'pcm' else 'true'}"
+    if endpoint == "/asr":
+        query += f"&output={output}"
+    body, content_type = _multipart(encode(synthetic_speech(duration, seed=seed), fmt), f"audio.{fmt}")
+    target = base_url.rstrip("/") + endpoint + query
+
+    rows = []
+    for concurrency in concurrencies:
+        for _ in range(warmup):
+            _request(target, body, content_type)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(lambda _: _request(target, body, content_type), range(n_requests)))
+            elapsed = time.perf_counter() - start
+
+        statuses = Counter(status for _, status in results)
+        latencies = [latency for latency, status in results if status == 200]
+        rows.append({
+            "endpoint": endpoint,
+            "concurrency": concurrency,
+            **summarize(latencies, duration),
+            "rps": len(latencies) / elapsed,
+            "statuses": " ".join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str)),
+        })
+
+    print_table(rows, COLUMNS)
+    save(
+        json_path,
+        rows,
+        url=url,
+        endpoint=endpoint,
+        concurrencies=concurrencies,
+        requests=n_requests,
+        warmup=warmup,
+        duration=duration,
+        format=fmt,
+        output=output,
+        seed=seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
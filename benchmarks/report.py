@@ -0,0 +1,60 @@
+import json
+import os
+import platform
+from typing import Iterable, List, Union
+
+import numpy as np
+
+from app.config import CONFIG
+
+
+def summarize(latencies: Iterable[float], audio_seconds: float = 0) -> dict:
+    """
+    Returns the p50/p95/p99 and mean of the latencies, in seconds, and the median real-time factor if the duration
+    of the audio processed by each call is given.
+    """
+    latencies = np.asarray(list(latencies), dtype=np.float64)
+    if latencies.size == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    summary = {
+        "count": int(latencies.size),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "mean": float(latencies.mean()),
+    }
+    if audio_seconds > 0:
+        summary["rtf"] = float(p50 / audio_seconds)
+    return summary
+
+
+def environment() -> dict:
+    return {
+        "engine": CONFIG.ASR_ENGINE,
+        "model": CONFIG.MODEL_NAME,
+        "quantization": CONFIG.MODEL_QUANTIZATION,
+        "device": CONFIG.DEVICE,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+    }
+
+
+def print_table(rows: List[dict], columns: List[str]):
+    def cell(value) -> str:
+        if isinstance(value, float):
+            return f"{value:.4f}"
+        return "" if value is None else str(value)
+
+    widths = [max(len(column), *(len(cell(row.get(column))) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths, strict=True)))
+    for row in rows:
+        print("  ".join(cell(row.get(column)).ljust(width) for column, width in zip(columns, widths, strict=True)))
+
+
+def save(path: Union[str, None], rows: List[dict], **parameters):
+    if not path:
+        return
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "parameters": parameters, "results": rows}, f, indent=2)
@@ -0,0 +1,31 @@
+import io
+import os
+import tempfile
+import wave
+
+import numpy as np
+import pytest
+
+# The configuration is read when the app is imported: serve the stub engine, and keep jobs out of the home directory
+os.environ.setdefault("ASR_ENGINE", "stub")
+os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="asr-jobs-"))
+
+
+def wav(seconds: int, sample_rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.random.default_rng(0).standard_normal(sample_rate * seconds) * 3000).astype("<i2"))
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from app.webservice import app
+
+    with TestClient(app) as client:
+        yield client
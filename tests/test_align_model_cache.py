@@ -0,0 +1,83 @@
+import threading
+
+from app.asr_models.align_model_cache import AlignModelCache
+
+
+class FakeModel:
+    def __init__(self, language, moving=None):
+        self.language = language
+        self.device = "cuda"
+        self.moving = moving
+
+    def parameters(self):
+        return []
+
+    def to(self, device):
+        if device == "cpu" and self.moving is not None:
+            started, release = self.moving
+            started.set()
+            assert release.wait(10)
+        self.device = device
+        return self
+
+
+def make_cache(moving=None):
+    def loader(language_code, device):
+        return FakeModel(language_code, moving if language_code == "en" else None), {"language": language_code}
+
+    return AlignModelCache(loader, device="cuda", max_models=1, max_offloaded=2)
+
+
+def use(cache, language, done=None):
+    with cache.use(language):
+        pass
+    if done is not None:
+        done.set()
+
+
+def test_offload_outside_lock():
+    moving = (threading.Event(), threading.Event())
+    cache = make_cache(moving)
+    use(cache, "en")
+
+    # Loading "fr" moves "en" to CPU memory, which does not hold up the requests for other languages
+    evicting = threading.Thread(target=use, args=(cache, "fr"))
+    evicting.start()
+    assert moving[0].wait(10)
+    loaded = threading.Event()
+    threading.Thread(target=use, args=(cache, "de", loaded)).start()
+    assert loaded.wait(10)
+
+    moving[1].set()
+    evicting.join(10)
+    assert cache.stats()["offloaded"] == ["en"]
+
+
+def test_use_while_being_offloaded():
+    moving = (threading.Event(), threading.Event())
+    cache = make_cache(moving)
+    with cache.use("en"):
+        pass
+    offloading = threading.Thread(target=cache.offload)
+    offloading.start()
+    assert moving[0].wait(10)
+
+    # The model being moved is promoted again instead of being reloaded from disk
+    result = {}
+
+    def use_en():
+        with cache.use("en") as (model, metadata):
+            result["device"] = model.device
+
+    using = threading.Thread(target=use_en)
+    using.start()
+    moving[1].set()
+    using.join(10)
+    offloading.join(10)
+
+    assert result["device"] == "cuda"
+    stats = cache.stats()
+    assert stats["loaded"] == ["en"]
+    assert stats["offloaded"] == []
+    assert stats["languages"]["en"]["misses"] == 1
+    assert stats["languages"]["en"]["reloads"] == 1
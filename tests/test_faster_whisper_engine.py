@@ -0,0 +1,62 @@
+import pytest
+
+faster_whisper = pytest.importorskip("faster_whisper")
+
+import numpy as np  # noqa: E402
+from faster_whisper.transcribe import Segment  # noqa: E402
+
+from app.asr_models.faster_whisper_engine import FasterWhisperASR  # noqa: E402
+from app.cancellation import CancellationToken, RequestCancelled, cancellation  # noqa: E402
+
+
+class LazyModel:
+    """
+    Stands in for a WhisperModel, whose segments are only decoded as the generator is advanced.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self.decoded = 0
+
+    def transcribe(self, audio, **options):
+        def segments():
+            for i in range(self.count):
+                self.decoded += 1
+                yield Segment(i, i * 3000, i * 30.0, (i + 1) * 30.0, f" window {i}", [], -0.1, 1.0, 0.0, None, 0.0)
+
+        info = type("TranscriptionInfo", (), {"language": "en"})()
+        return segments(), info
+
+
+@pytest.fixture
+def asr_model():
+    asr_model = FasterWhisperASR("test", "int8")
+    asr_model.model = LazyModel(10)
+    return asr_model
+
+
+def test_stream_stops_decoding_when_cancelled(asr_model):
+    token = CancellationToken()
+    with cancellation(token):
+        chunks = asr_model.transcribe_stream(np.zeros(16000), "transcribe", "en", None, False, False, {}, "txt")
+        assert next(chunks).strip() == "window 0"
+        token.cancel("client disconnected")
+        with pytest.raises(RequestCancelled):
+            list(chunks)
+
+    assert asr_model.model.decoded == 1
+    assert not asr_model.model_lock.locked()
+
+
+def test_stream_until_deadline(asr_model, monkeypatch):
+    token = CancellationToken(timeout=60)
+    with cancellation(token):
+        chunks = asr_model.transcribe_stream(np.zeros(16000), "transcribe", "en", None, False, False, {}, "txt")
+        assert next(chunks).strip() == "window 0"
+        assert next(chunks).strip() == "window 1"
+        monkeypatch.setattr(token, "deadline", 0)
+        with pytest.raises(RequestCancelled, match="deadline exceeded"):
+            list(chunks)
+
+    assert asr_model.model.decoded == 2
+    assert not asr_model.model_lock.locked()
@@ -0,0 +1,92 @@
+import io
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+from conftest import wav
+
+from app.jobs import JobRunner, JobStore
+
+
+def create_jobs(store: JobStore, count: int):
+    return [store.create(io.BytesIO(b"audio"), f"{i}.wav", {}) for i in range(count)]
+
+
+def test_requeue_jobs_of_worker(tmp_path):
+    first = JobStore(str(tmp_path), recover=False, worker="0")
+    second = JobStore(str(tmp_path), recover=False, worker="1")
+    create_jobs(first, 3)
+    claimed_first = first.next_queued()["id"]
+    claimed_second = second.next_queued()["id"]
+
+    assert first.requeue("0") == 1
+    assert first.get(claimed_first)["status"] == "queued"
+    assert first.get(claimed_second)["status"] == "running"
+    assert first.get(claimed_second)["worker"] == "1"
+
+
+def test_recover_requeues_all_running_jobs(tmp_path):
+    store = JobStore(str(tmp_path), recover=False, worker="0")
+    job_ids = create_jobs(store, 2)
+    store.next_queued()
+    store.next_queued()
+
+    recovered = JobStore(str(tmp_path))
+    assert [recovered.get(job_id)["status"] for job_id in job_ids] == ["queued", "queued"]
+
+
+def test_database_without_worker_column(tmp_path):
+    db = sqlite3.connect(tmp_path / "jobs.db")
+    db.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT, params TEXT NOT NULL, "
+        "duration REAL, processed REAL NOT NULL DEFAULT 0, error TEXT, created_at REAL NOT NULL, "
+        "updated_at REAL NOT NULL)"
+    )
+    db.execute("INSERT INTO jobs VALUES ('old', 'running', 'a.wav', '{}', NULL, 0, NULL, 0, 0)")
+    db.commit()
+    db.close()
+
+    store = JobStore(str(tmp_path), worker="0")
+    assert store.get("old")["status"] == "queued"
+    create_jobs(store, 1)
+    assert store.next_queued()["worker"] == "0"
+
+
+def test_openai_whisper_job_progress(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    whisper = pytest.importorskip("whisper")
+    from app.asr_models.openai_whisper_engine import OpenAIWhisperASR
+
+    torch.manual_seed(0)
+    dims = whisper.model.ModelDimensions(80, 1500, 16, 2, 1, 51865, 448, 16, 2, 1)
+    asr_model = OpenAIWhisperASR("test", "float32")
+    asr_model.model = whisper.model.Whisper(dims)
+    torch.nn.init.normal_(asr_model.model.decoder.positional_embedding)
+    asr_model._check_between_windows(asr_model.model)
+
+    class Pool:
+        @contextmanager
+        def acquire(self, name):
+            yield asr_model
+
+    store = JobStore(str(tmp_path))
+    job_id = store.create(io.BytesIO(wav(45)), "audio.wav", {
+        "encode": True, "task": "transcribe", "language": "en", "initial_prompt": None, "vad_filter": False,
+        "word_timestamps": False, "options": {},
+    })
+    processed = []
+    update = store.update
+
+    def record(job_id, **fields):
+        if "processed" in fields:
+            processed.append(fields["processed"])
+        update(job_id, **fields)
+
+    monkeypatch.setattr(store, "update", record)
+    JobRunner(store, Pool(), ttl=60)._process(store.next_queued())
+
+    assert store.get(job_id)["status"] == "completed"
+    # Reported after every window, before the job completes
+    assert processed == sorted(processed)
+    assert 0 < processed[0] < 45
+    assert processed[-1] == 45
@@ -0,0 +1,18 @@
+from app.metrics import Registry
+
+
+def test_constant_labels_on_every_sample():
+    registry = Registry({"worker": "2"})
+    registry.counter("requests", "Requests.", ["engine"]).inc(engine="stub")
+    registry.gauge("depth", "Depth.", function=lambda: 3)
+    registry.histogram("duration", "Duration.", buckets=(1,)).observe(0.5)
+
+    samples = [line for line in registry.render().splitlines() if not line.startswith("#")]
+    assert samples == [
+        'requests_total{engine="stub",worker="2"} 1',
+        'depth{worker="2"} 3',
+        'duration_bucket{worker="2",le="1"} 1',
+        'duration_bucket{worker="2",le="+Inf"} 1',
+        'duration_sum{worker="2"} 0.5',
+        'duration_count{worker="2"} 1',
+    ]
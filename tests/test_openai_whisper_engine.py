@@ -0,0 +1,89 @@
+import subprocess
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+
+from app.asr_models.openai_whisper_engine import OpenAIWhisperASR  # noqa: E402
+from app.config import CONFIG  # noqa: E402
+
+DIMS = whisper.model.ModelDimensions(
+    n_mels=80,
+    n_audio_ctx=16,
+    n_audio_state=32,
+    n_audio_head=2,
+    n_audio_layer=2,
+    n_vocab=64,
+    n_text_ctx=8,
+    n_text_state=32,
+    n_text_head=2,
+    n_text_layer=2,
+)
+
+
+@pytest.fixture
+def original(monkeypatch, tmp_path):
+    """
+    A randomly initialized Whisper model standing in for downloaded weights, with snapshots written to `tmp_path`.
+    """
+    torch.manual_seed(0)
+    model = whisper.model.Whisper(DIMS)
+    # Whisper leaves the positional embedding of the decoder uninitialized, to be loaded from the checkpoint
+    torch.nn.init.normal_(model.decoder.positional_embedding)
+    monkeypatch.setattr(whisper, "load_model", lambda **kwargs: model)
+    monkeypatch.setattr(CONFIG, "MODEL_SNAPSHOT_DIR", str(tmp_path))
+    return model
+
+
+def assert_same_weights(model, original):
+    expected = original.state_dict()
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(tensor, expected[name]), name
+    assert torch.equal(model.alignment_heads.to_dense(), original.alignment_heads.to_dense())
+    assert torch.equal(model.decoder.mask, original.decoder.mask)
+
+
+def test_load_shared_twice(original):
+    asr_model = OpenAIWhisperASR("test", "float32")
+    asr_model._load_shared()
+    model = asr_model._load_shared()
+
+    assert_same_weights(model, original)
+    assert model.alignment_heads.is_sparse
+    assert not any(tensor.is_meta for tensor in (*model.parameters(), *model.buffers()))
+
+
+def test_load_shared_in_second_process(original, tmp_path):
+    OpenAIWhisperASR("test", "float32")._load_shared()
+
+    # A fresh interpreter, like a prefork or parallel-chunk worker, only finds the snapshot on disk
+    script = (
+        "import sys, torch\n"
+        "from app.asr_models.openai_whisper_engine import OpenAIWhisperASR\n"
+        "model = OpenAIWhisperASR('test', 'float32')._load_shared()\n"
+        "torch.save({**model.state_dict(), 'alignment_heads': model.alignment_heads.to_dense()}, sys.argv[1])\n"
+    )
+    output = tmp_path / "loaded.pt"
+    env = {"MODEL_SNAPSHOT_DIR": str(tmp_path), "PATH": ""}
+    subprocess.run([sys.executable, "-c", script, str(output)], env=env, check=True)
+
+    loaded = torch.load(output, weights_only=True)
+    for name, tensor in original.state_dict().items():
+        assert torch.equal(loaded[name], tensor), name
+    assert torch.equal(loaded["alignment_heads"], original.alignment_heads.to_dense())
+
+
+def test_load_quantized_twice(original, monkeypatch):
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    asr_model = OpenAIWhisperASR("test", "int8")
+    prepared = asr_model._load_quantized()
+    # The second load reads the prepared model from its snapshot
+    model = asr_model._load_quantized()
+
+    mel = torch.randn(1, DIMS.n_mels, DIMS.n_audio_ctx * 2)
+    tokens = torch.tensor([[1, 2, 3]])
+    with torch.no_grad():
+        assert torch.equal(model(mel, tokens), prepared(mel, tokens))
+    assert torch.equal(model.alignment_heads.to_dense(), original.alignment_heads.to_dense())
@@ -0,0 +1,27 @@
+import pytest
+
+from app.prefork import _warn_unshared, shares_weights
+
+
+@pytest.mark.parametrize(
+    ("engine", "quantization", "cuda", "shared"),
+    [
+        ("openai_whisper", "float32", False, True),
+        ("openai_whisper", "int8", False, False),
+        ("openai_whisper", "int8", True, True),
+        ("faster_whisper", "float32", False, False),
+        ("whisperx", "float16", True, False),
+        ("stub", "int8", False, True),
+    ],
+)
+def test_shares_weights(engine, quantization, cuda, shared):
+    assert shares_weights(engine, quantization, cuda) == shared
+
+
+def test_warn_unshared(capsys):
+    _warn_unshared(["openai_whisper:base:int8", "openai_whisper:base:float32", "faster_whisper:small:int8"], 4, False)
+
+    warnings = capsys.readouterr().out.splitlines()
+    assert len(warnings) == 2
+    assert warnings[0].startswith("Warning: the int8 weights of openai_whisper:base cannot be shared")
+    assert warnings[1].startswith("Warning: the int8 weights of faster_whisper:small cannot be shared")
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from app.cache import TranscriptionCache
+from app.config import CONFIG
+from app.executor import executor
+from app.scheduling import ModelScheduler, scheduling
+
+
+def test_preempt_for_call_waiting_for_worker(monkeypatch):
+    # With the default single inference worker, the long transcription occupies the worker the short request waits for
+    monkeypatch.setattr(CONFIG, "SCHEDULER_PREEMPT", True)
+    model_lock = ModelScheduler(engine="stub", model="test")
+    windows = []
+
+    def transcribe(name: str, count: int):
+        with model_lock:
+            for _ in range(count):
+                windows.append(name)
+                time.sleep(0.2)
+                model_lock.preempt()
+
+    async def main():
+        with scheduling("low", 600):
+            long = asyncio.ensure_future(executor.infer(transcribe, "long", 3))
+        await asyncio.sleep(0.1)
+        with scheduling("high", 1):
+            await executor.infer(transcribe, "short", 1)
+        await long
+
+    asyncio.run(main())
+    assert windows == ["long", "short", "long", "long"]
+
+
+def test_no_preemption_for_later_call(monkeypatch):
+    monkeypatch.setattr(CONFIG, "SCHEDULER_PREEMPT", True)
+    model_lock = ModelScheduler(engine="stub", model="test")
+    windows = []
+
+    def transcribe(name: str, count: int):
+        with model_lock:
+            for _ in range(count):
+                windows.append(name)
+                time.sleep(0.1)
+                model_lock.preempt()
+
+    async def main():
+        with scheduling("high", 1):
+            first = asyncio.ensure_future(executor.infer(transcribe, "first", 3))
+        await asyncio.sleep(0.05)
+        with scheduling("low", 600):
+            await asyncio.gather(first, executor.infer(transcribe, "later", 1))
+
+    asyncio.run(main())
+    assert windows == ["first", "first", "first", "later"]
+
+
+def test_preempt_for_call_coalesced_with_preempted_transcription(monkeypatch):
+    monkeypatch.setattr(CONFIG, "SCHEDULER_PREEMPT", True)
+    model_lock = ModelScheduler(engine="stub", model="test")
+    cache = TranscriptionCache(memory_size=1024 * 1024)
+    windows = []
+
+    def transcribe(name: str, count: int):
+        with model_lock:
+            for _ in range(count):
+                windows.append(name)
+                time.sleep(0.2)
+                model_lock.preempt()
+        return name
+
+    async def main():
+        with scheduling("low", 600):
+            long = asyncio.ensure_future(executor.infer(cache.get_or_compute, "same", lambda: transcribe("long", 3)))
+        await asyncio.sleep(0.1)
+        # The same audio ranks before the transcription computing it, and waits for its result
+        with scheduling("normal", 600):
+            same = asyncio.ensure_future(executor.infer(cache.get_or_compute, "same", lambda: transcribe("same", 3)))
+        with scheduling("high", 1):
+            short = asyncio.ensure_future(executor.infer(transcribe, "short", 1))
+        return await asyncio.wait_for(asyncio.gather(long, same, short), 10)
+
+    assert asyncio.run(main()) == ["long", "long", "short"]
+    assert windows == ["long", "short", "long", "long"]
+    assert cache.coalesced == 1
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+from conftest import wav
+
+from app.config import CONFIG
+
+
+@pytest.fixture
+def slow_stub(monkeypatch):
+    # Every 5-second segment takes half a second to produce
+    monkeypatch.setattr(CONFIG, "STUB_SEGMENT_SECONDS", 5)
+    monkeypatch.setattr(CONFIG, "STUB_REAL_TIME_FACTOR", 0.1)
+
+
+def transcribe(client, audio: bytes, **params):
+    return client.post("/asr", params=params, files={"audio_file": ("audio.wav", audio)})
+
+
+def test_stream_sse(client):
+    response = transcribe(client, wav(15), stream="sse")
+
+    assert response.status_code == 200
+    assert response.text.count("data: ") == 4
+    assert response.text.endswith("event: end\ndata: \n\n")
+
+
+def test_stream_sse_past_deadline(client, slow_stub):
+    response = transcribe(client, wav(60), stream="sse", timeout=1.2)
+
+    assert response.status_code == 200
+    assert response.text.endswith("event: error\ndata: The request was cancelled: deadline exceeded.\n\n")
+    assert "event: end" not in response.text
+    assert 0 < response.text.count("data: ") < 12
+
+
+def test_stream_chunked_past_deadline(client, slow_stub):
+    response = transcribe(client, wav(60), stream="chunked", output="ndjson", timeout=1.2)
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1] == {"error": "The request was cancelled: deadline exceeded."}
+    assert 1 < len(lines) < 12
+
+
+def test_stream_whole_output_past_deadline(client, slow_stub, monkeypatch):
+    # Engines that cannot stream segments yield their whole output once it is complete
+    monkeypatch.setattr(CONFIG, "STUB_SEGMENT_SECONDS", 60)
+    response = transcribe(client, wav(60), stream="chunked", timeout=1)
+
+    assert response.text == "\nERROR: The request was cancelled: deadline exceeded.\n"
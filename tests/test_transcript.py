@@ -0,0 +1,51 @@
+import json
+
+from app.transcript import Transcript
+from app.utils import WriteJSON
+
+# Result of whisperx.align followed by whisperx.assign_word_speakers
+WHISPERX_RESULT = {
+    "language": "en",
+    "segments": [
+        {
+            "start": 0.0,
+            "end": 1.0,
+            "text": " Hello world",
+            "words": [
+                {"word": "Hello", "start": 0.0, "end": 0.4, "score": 0.9, "speaker": "SPEAKER_00"},
+                {"word": "world", "start": 0.5, "end": 1.0, "score": 0.8, "speaker": "SPEAKER_00"},
+            ],
+            "speaker": "SPEAKER_00",
+        },
+        {
+            "start": 1.5,
+            "end": 2.0,
+            "text": " 42",
+            # Numbers cannot be aligned
+            "words": [{"word": "42"}],
+        },
+    ],
+    "word_segments": [
+        {"word": "Hello", "start": 0.0, "end": 0.4, "score": 0.9, "speaker": "SPEAKER_00"},
+        {"word": "world", "start": 0.5, "end": 1.0, "score": 0.8, "speaker": "SPEAKER_00"},
+        {"word": "42"},
+    ],
+}
+
+
+def test_json_word_segments():
+    output = json.loads(WriteJSON().render(Transcript.from_result(WHISPERX_RESULT)))
+
+    assert output["word_segments"] == [
+        {"word": "Hello", "start": 0.0, "end": 0.4, "probability": 0.9, "speaker": "SPEAKER_00"},
+        {"word": "world", "start": 0.5, "end": 1.0, "probability": 0.8, "speaker": "SPEAKER_00"},
+        {"word": "42"},
+    ]
+    assert output["word_segments"] == [word for segment in output["segments"] for word in segment["words"]]
+
+
+def test_json_without_word_segments():
+    result = dict(WHISPERX_RESULT)
+    del result["word_segments"]
+
+    assert "word_segments" not in json.loads(WriteJSON().render(Transcript.from_result(result)))
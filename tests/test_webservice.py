@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from conftest import wav
+from starlette.requests import ClientDisconnect
+
+from app.executor import executor
+from app.webservice import ClosingStreamingResponse
+
+
+@pytest.mark.parametrize("path", ["/asr", "/asr/batch", "/detect-language", "/jobs"])
+def test_unknown_model(client, path):
+    field = "audio_files" if path == "/asr/batch" else "audio_file"
+    response = client.post(path, params={"model": "nope"}, files={field: ("audio.wav", wav(1))})
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["query", "model"]
+
+
+def test_response_closed_before_body_is_sent():
+    closed = []
+
+    async def body():
+        yield "never sent"
+
+    response = ClosingStreamingResponse(body(), on_close=lambda: closed.append(True))
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("Connection reset by peer")
+
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+    assert closed == [True]
+
+
+def test_batch_releases_queue_slot(client):
+    response = client.post("/asr/batch", files=[("audio_files", ("a.wav", wav(1))), ("audio_files", ("b.wav", wav(2)))])
+
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 2
+    assert executor.admitted == 0